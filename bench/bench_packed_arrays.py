@@ -0,0 +1,79 @@
+"""
+Micro benchmark: per vertex extend() vs bulk write_array() of vertex and index arrays.
+
+Runs with the protobuf bundled in libs/ and numpy, no blender needed:
+    python3 bench/bench_packed_arrays.py [vertex_count]
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "libs", "protobuf.pylib"))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import numpy as np
+from google.protobuf import descriptor, descriptor_pb2, message, reflection
+import packed_arrays
+
+
+def make_classes():
+    """Stand-in for f3b VertexArray/IndexArray: a float and an int32 packed array"""
+    proto = descriptor_pb2.DescriptorProto()
+    proto.name = "Arrays"
+    for number, name, field_type in ((1, "floats", descriptor_pb2.FieldDescriptorProto.TYPE_FLOAT),
+                                     (2, "ints", descriptor_pb2.FieldDescriptorProto.TYPE_UINT32)):
+        field = proto.field.add()
+        field.name = name
+        field.number = number
+        field.type = field_type
+        field.label = descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED
+        field.options.packed = True
+    desc = descriptor.MakeDescriptor(proto)
+    return reflection.GeneratedProtocolMessageType("Arrays", (message.Message,), {"DESCRIPTOR": desc})
+
+
+def per_vertex(cls, positions, indexes):
+    msg = cls()
+    msg.ints.extend(indexes.tolist())
+    for p in positions.tolist():
+        msg.floats.extend(p)
+    return msg.SerializeToString()
+
+
+def bulk_extend(cls, positions, indexes):
+    msg = cls()
+    msg.ints.extend(indexes.tolist())
+    msg.floats.extend(positions.ravel().tolist())
+    return msg.SerializeToString()
+
+
+def bulk_packed(cls, positions, indexes):
+    msg = cls()
+    packed_arrays.write_array(msg, "ints", indexes)
+    packed_arrays.write_array(msg, "floats", positions)
+    return msg.SerializeToString()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cls = make_classes()
+    positions = np.random.rand(count, 3).astype(np.float32)
+    indexes = np.random.randint(0, count, size=count * 2).astype(np.int32)
+
+    reference = None
+    for name, fn in (("per vertex extend", per_vertex), ("bulk extend", bulk_extend), ("packed write_array", bulk_packed)):
+        t = time.perf_counter()
+        out = fn(cls, positions, indexes)
+        t = time.perf_counter() - t
+        parsed = cls()
+        parsed.MergeFromString(out)
+        if reference is None:
+            reference = parsed
+        assert parsed == reference, name + " output differs"
+        print("%-20s %8.3fs  %5.2fus/vertex  %d bytes" % (name, t, t * 1e6 / count, len(out)))
+
+
+if __name__ == "__main__":
+    main()
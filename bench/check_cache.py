@@ -0,0 +1,88 @@
+"""
+Check of the export cache on a synthetic scene (see synthetic.py): its geometries
+are exported twice with the cache in the same directory, the second time every
+mesh must come from the cache (with its bounds, clusters and LODs) and the output
+must be the one of the first export. Done with the profiler off and on.
+
+Runs against the built addon (./make.sh build), with the bpy stand-in of bench/standin:
+    python3 bench/check_cache.py [--addon build/tmp/f3b_exporter]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCH)
+
+import synthetic
+from run_bench import load_addon
+
+PARAMS = dict(synthetic.DEFAULT_PARAMS, objects=3, triangles=20000, materials=2, material_pool=2, bones=8,
+              lod_levels=2, cluster_threshold=4000)
+# The entities written with the meshes
+FIELDS = ("meshes", "relations", "custom_params")
+
+
+def export_geometries(addon, scene, out_dir, profile):
+    """Export the geometries of scene with the cache in out_dir, returns the output (parsed again) and the cache hits and misses"""
+    f3b_export = addon["f3b_export"]
+    log = addon["logger"].Logger(addon["logger"].WARNING)
+    cfg = f3b_export.ExportCfg(assets_path=out_dir, remove_doubles=bool(PARAMS["remove_doubles"]), lod_levels=PARAMS["lod_levels"],
+                               cluster_threshold=PARAMS["cluster_threshold"], log=log)
+    cfg.profiler = addon["profiler"].Profiler(enabled=profile)
+    cfg.cache = f3b_export.ExportCache(os.path.join(out_dir, "scene.f3bcache"), out_dir, log)
+    data = f3b_export.f3b.datas_pb2.Data()
+    try:
+        f3b_export.export_all_geometries(scene, data, cfg)
+    finally:
+        if cfg.lods is not None:
+            cfg.lods.close()
+        cfg.profiler.close()
+    cfg.cache.save()
+    # The entries reused from the cache are spliced encoded, they are only seen once parsed
+    out = f3b_export.f3b.datas_pb2.Data()
+    out.ParseFromString(data.SerializeToString())
+    return out, cfg.cache.hits, cfg.cache.misses
+
+
+def entities(data, field):
+    return sorted(entry.SerializeToString(deterministic=True) for entry in getattr(data, field))
+
+
+def check(addon, profile):
+    tmp_dir = tempfile.mkdtemp(prefix="f3b_cache_")
+    try:
+        scene = synthetic.build_standin(PARAMS, tmp_dir)
+        first, hits, misses = export_geometries(addon, scene, tmp_dir, profile)
+        errors = []
+        if hits != 0 or misses != PARAMS["objects"]:
+            errors.append("first export: %d hits, %d misses" % (hits, misses))
+        second, hits, misses = export_geometries(addon, scene, tmp_dir, profile)
+        if hits != PARAMS["objects"] or misses != 0:
+            errors.append("second export: %d hits, %d misses" % (hits, misses))
+        for field in FIELDS:
+            if entities(first, field) != entities(second, field):
+                errors.append("the %s reused from the cache differ from the exported ones" % field)
+        print("profiler %-3s: %d meshes, %d relations, %d custom params%s" % (
+            "on" if profile else "off", len(second.meshes), len(second.relations), len(second.custom_params),
+            "" if not errors else "\n    FAILED: " + "\n    FAILED: ".join(errors)))
+        return not errors
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="check_cache.py", description="Check the meshes reused from the export cache")
+    parser.add_argument("--addon", default=os.path.join(os.path.dirname(BENCH), "build", "tmp", "f3b_exporter"), help="Built addon directory")
+    args = parser.parse_args(argv)
+    sys.path.insert(0, os.path.join(BENCH, "standin"))
+    addon = load_addon(args.addon)
+    ok = all([check(addon, profile) for profile in (False, True)])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
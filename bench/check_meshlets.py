@@ -0,0 +1,102 @@
+"""
+Check of the clusters built by meshlets.cluster_mesh on a noisy grid: the vertex
+and triangle limits, that the triangles are the ones of the mesh, that the AABB
+and the sphere of each cluster contain its triangles, and that no viewpoint
+culls (by the normal cone) a cluster with a triangle facing it.
+
+Runs against the built addon (./make.sh build) with numpy, no blender needed:
+    python3 bench/check_meshlets.py [triangles] [--addon build/tmp/f3b_exporter]
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import types
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIMITS = ((64, 124), (32, 32), (256, 512))
+VIEWPOINTS = 64
+
+
+def load_meshlets(addon_dir):
+    """meshlets and Mesh of the built addon, without importing its __init__ (and bpy)"""
+    if not os.path.isfile(os.path.join(addon_dir, "meshlets.py")):
+        sys.exit("No built addon in " + addon_dir + ", run ./make.sh build first or pass --addon")
+    package = types.ModuleType("f3b_exporter")
+    package.__path__ = [os.path.abspath(addon_dir)]
+    sys.modules["f3b_exporter"] = package
+    return importlib.import_module("f3b_exporter.meshlets"), importlib.import_module("f3b_exporter.Mesh")
+
+
+def grid(Mesh, triangles, seed=0):
+    """A wavy grid with noisy normals, about triangles triangles"""
+    rng = np.random.default_rng(seed)
+    n = max(2, int(np.sqrt(triangles / 2.0)))
+    x, y = np.meshgrid(np.linspace(0.0, 10.0, n + 1), np.linspace(0.0, 10.0, n + 1))
+    z = np.sin(x) * np.cos(y) + rng.normal(scale=0.05, size=x.shape)
+    mesh = Mesh.Mesh()
+    mesh.positions = np.column_stack((x.ravel(), z.ravel(), y.ravel())).astype(np.float32)
+    mesh.normals = np.tile(np.float32([0.0, 1.0, 0.0]), (len(mesh.positions), 1))
+    v = np.arange(n * n).reshape(n, n) + np.arange(n)[:, None]
+    quads = np.stack((v, v + 1, v + n + 2, v + n + 1), axis=-1).reshape(-1, 4)
+    mesh.indexes = np.concatenate((quads[:, [0, 2, 1]], quads[:, [0, 3, 2]]), axis=1).reshape(-1).astype(np.int32)
+    return mesh
+
+
+def check(meshlets, mesh, max_vertices, max_triangles):
+    out, offsets, bounds = meshlets.cluster_mesh(mesh, max_vertices, max_triangles)
+    tris = out.indexes.reshape(-1, 3)
+    sizes = np.diff(offsets)
+    vertices = [len(np.unique(tris[offsets[i]:offsets[i + 1]])) for i in range(len(sizes))]
+    errors = []
+    if sizes.max() > max_triangles or max(vertices) > max_vertices:
+        errors.append("limits: %d triangles, %d vertices" % (sizes.max(), max(vertices)))
+
+    def corners(m):
+        return np.sort(np.sort(m.positions[m.indexes].reshape(-1, 9), axis=1), axis=0)
+    if not np.array_equal(corners(out), corners(mesh)):
+        errors.append("the triangles are not the ones of the mesh")
+
+    p = out.positions[tris].astype(np.float64)
+    segment = np.repeat(np.arange(len(sizes)), sizes)
+    eps = 1e-5
+    if not np.all((p >= bounds["aabb_min"][segment][:, None] - eps) & (p <= bounds["aabb_max"][segment][:, None] + eps)):
+        errors.append("a triangle is outside the AABB of its cluster")
+    distance = np.linalg.norm(p - bounds["sphere_center"][segment][:, None], axis=2)
+    if not np.all(distance <= bounds["sphere_radius"][segment][:, None] + eps):
+        errors.append("a triangle is outside the sphere of its cluster")
+
+    normals = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    cutoff = bounds["cone_cutoff"]
+    culled = 0
+    for view in np.random.default_rng(1).normal(scale=20.0, size=(VIEWPOINTS, 3)):
+        to_view = view - bounds["cone_apex"]
+        to_view /= np.linalg.norm(to_view, axis=1)[:, None]
+        cull = (cutoff > 0.0) & (np.einsum("ij,ij->i", to_view, bounds["cone_axis"]) < -np.sqrt(np.clip(1.0 - cutoff ** 2, 0.0, 1.0)))
+        facing = np.einsum("ij,ij->i", normals, view - p[:, 0]) > 0.0
+        if np.any(facing & cull[segment]):
+            errors.append("the cone culls a cluster with a triangle facing %s" % view)
+            break
+        culled += cull.sum()
+    print("%4d vertices %4d triangles: %6d clusters, up to %d triangles and %d vertices, %d culled in %d views%s" % (
+        max_vertices, max_triangles, len(sizes), sizes.max(), max(vertices), culled, VIEWPOINTS,
+        "" if not errors else "\n    FAILED: " + "\n    FAILED: ".join(errors)))
+    return not errors
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="check_meshlets.py", description="Check the clusters of meshlets.cluster_mesh")
+    parser.add_argument("triangles", type=int, nargs="?", default=50000)
+    parser.add_argument("--addon", default=os.path.join(ROOT, "build", "tmp", "f3b_exporter"), help="Built addon directory")
+    args = parser.parse_args(argv)
+    meshlets, Mesh = load_meshlets(args.addon)
+    mesh = grid(Mesh, args.triangles)
+    ok = all([check(meshlets, mesh, max_vertices, max_triangles) for max_vertices, max_triangles in LIMITS])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
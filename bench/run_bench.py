@@ -0,0 +1,211 @@
+"""
+Exporter benchmark on synthetic scenes (see synthetic.py for the cases).
+
+Every case is exported --repeat times with the profiler enabled, the fastest
+time of each phase (export_all_*, export_meshes, extract_meshdata, bake,
+dds_conversion, write...) is written to --output as JSON. With --baseline, the
+phases are compared with a previous output and the run fails if any is more
+than --threshold times slower.
+
+Runs against the built addon (./make.sh build), inside blender:
+    blender -b --factory-startup --python bench/run_bench.py -- [options]
+or without it, with the bpy and mathutils stand-in of bench/standin:
+    python3 bench/run_bench.py [options]
+With the stand-in, the time spent by blender (to_mesh, frame_set, foreach_get)
+is the one of numpy copies, only the time spent in the exporter is meaningful.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.append(BENCH)
+
+import numpy as np
+import synthetic
+
+RESULTS_VERSION = 1
+# Phases faster than this in the baseline are too noisy to be compared
+MIN_COMPARED_SECONDS = 0.01
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="run_bench.py", description="Benchmark the f3b exporter on synthetic scenes")
+    parser.add_argument("--case", action="append", default=[], help="NAME or NAME:param=value,... (default: all the cases)")
+    parser.add_argument("--list", action="store_true", help="List the cases and their parameters")
+    parser.add_argument("--repeat", type=int, default=3, help="Exports per case, the fastest time of each phase is kept")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio that fails the comparison")
+    parser.add_argument("--addon", default=os.path.join(ROOT, "build", "tmp", "f3b_exporter"), help="Built addon directory")
+    parser.add_argument("--dds-writer", default=None, help="DDSWriter executable (default: the one bundled with the addon)")
+    parser.add_argument("--memory", action="store_true", help="Trace the peak memory and the memory growth of each phase (slower)")
+    return parser.parse_args(argv)
+
+
+def script_args(argv):
+    if "--" in argv:
+        return argv[argv.index("--") + 1:]
+    return argv[1:]
+
+
+def in_blender():
+    try:
+        import bpy
+        return hasattr(bpy, "app") and bpy.app.binary_path is not None
+    except ImportError:
+        return False
+
+
+def load_addon(addon_dir):
+    """Modules of the built addon, imported as a package without registering it"""
+    if not os.path.isfile(os.path.join(addon_dir, "exporter_utils.py")):
+        sys.exit("No built addon in " + addon_dir + ", run ./make.sh build first or pass --addon")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(addon_dir)))
+    package = os.path.basename(os.path.abspath(addon_dir))
+    importlib.import_module(package)
+    return {name: importlib.import_module(package + "." + name) for name in ("f3b_export", "logger", "profiler", "data_writer")}
+
+
+def export_once(addon, scene, params, out_dir, trace_memory):
+    """Export scene in out_dir, returns the profiler report"""
+    f3b_export = addon["f3b_export"]
+    log = addon["logger"].Logger(addon["logger"].WARNING)
+    cfg = f3b_export.ExportCfg(assets_path=out_dir, textures_to_dds=bool(params["dds"]), export_tangents=bool(params["tangents"]), mikktspace_tangents=bool(params["mikktspace"]),
+                               remove_doubles=bool(params["remove_doubles"]), max_influences=params["max_influences"], lod_levels=params["lod_levels"],
+                               optimize_vertex_cache=bool(params["vertex_cache"]),
+                               cluster_threshold=params["cluster_threshold"], bulk_extraction=bool(params["bulk"]), log=log)
+    cfg.profiler = addon["profiler"].Profiler(enabled=True, trace_memory=trace_memory)
+    cfg.writer = addon["data_writer"].DataWriter(os.path.join(out_dir, "bench.f3b"))
+    data = f3b_export.f3b.datas_pb2.Data()
+    try:
+        with cfg.profiler.phase("export"):
+            f3b_export.export(scene, data, cfg)
+            with cfg.profiler.phase("write"):
+                cfg.writer.close(data)
+    except:
+        cfg.writer.abort()
+        raise
+    finally:
+        if cfg.lods is not None:
+            cfg.lods.close()
+        cfg.profiler.close()
+    cfg.profiler.count("bytes_written", cfg.writer.bytes_written)
+    return cfg.profiler.report()
+
+
+def run_case(addon, name, params, args, build):
+    tmp_dir = tempfile.mkdtemp(prefix="f3b_bench_")
+    try:
+        if params["dds"]:
+            writer = args.dds_writer or addon["f3b_export"].DDS_WRITER_PATH
+            if not os.access(writer, os.X_OK):
+                return {"params": params, "skipped": "no DDSWriter in " + writer}
+            addon["f3b_export"].DDS_WRITER_PATH = writer
+        start = time.perf_counter()
+        scene = build(params, tmp_dir)
+        result = {"params": params, "setup_seconds": time.perf_counter() - start, "phases": {}}
+        for r in range(max(1, args.repeat)):
+            # A new assets directory each time, or the asset manifest and the DDS cache would skip the work
+            out_dir = os.path.join(tmp_dir, "out%d" % r)
+            os.makedirs(out_dir)
+            report = export_once(addon, scene, params, out_dir, args.memory)
+            for phase, stats in report["phases"].items():
+                best = result["phases"].get(phase)
+                if best is None or stats["seconds"] < best["seconds"]:
+                    result["phases"][phase] = stats
+            result["counters"] = report["counters"]
+            shutil.rmtree(out_dir, ignore_errors=True)
+        result["seconds"] = result["phases"]["export"]["seconds"]
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold):
+    """(case, phase, baseline seconds, seconds, ratio) of every phase compared, and the ones over threshold"""
+    rows = []
+    for name, case in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None or "phases" not in case or "phases" not in base:
+            continue
+        if base["params"] != case["params"]:
+            print("%s: parameters changed since the baseline, not compared" % name)
+            continue
+        for phase, stats in case["phases"].items():
+            base_stats = base["phases"].get(phase)
+            if base_stats is None or base_stats["seconds"] < MIN_COMPARED_SECONDS:
+                continue
+            rows.append((name, phase, base_stats["seconds"], stats["seconds"], stats["seconds"] / base_stats["seconds"]))
+    return rows, [row for row in rows if row[4] > threshold]
+
+
+def print_case(name, case):
+    if "skipped" in case:
+        print("%-24s skipped: %s" % (name, case["skipped"]))
+        return
+    print("%-24s %8.3fs  (setup %.2fs)" % (name, case["seconds"], case["setup_seconds"]))
+    for phase, stats in sorted(case["phases"].items(), key=lambda p: p[1]["seconds"], reverse=True):
+        if phase != "export":
+            print("    %-28s %8.3fs %6d calls" % (phase, stats["seconds"], stats["calls"]))
+
+
+def main(argv):
+    args = parse_args(script_args(argv))
+    if args.list:
+        for name in synthetic.CASES:
+            print(name, synthetic.parse_case(name)[1])
+        return 0
+
+    blender = in_blender()
+    if not blender:
+        sys.path.insert(0, os.path.join(BENCH, "standin"))
+    addon = load_addon(args.addon)
+    build = synthetic.build_blender if blender else synthetic.build_standin
+
+    results = {
+        "version": RESULTS_VERSION,
+        "backend": "blender %s" % (".".join(str(v) for v in __import__("bpy").app.version),) if blender else "standin",
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "cases": {},
+    }
+    for text in args.case or list(synthetic.CASES):
+        name, params = synthetic.parse_case(text)
+        results["cases"][name] = case = run_case(addon, name, params, args, build)
+        print_case(name, case)
+
+    tmp = args.output + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, args.output)
+    print("Results written in " + args.output)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("backend") != results["backend"]:
+        print("WARNING: baseline measured with %s, this run with %s" % (baseline.get("backend"), results["backend"]))
+    rows, regressions = compare(results, baseline, args.threshold)
+    for name, phase, base, now, ratio in rows:
+        print("%-24s %-28s %8.3fs -> %8.3fs  x%.2f%s" % (name, phase, base, now, ratio, "  REGRESSION" if ratio > args.threshold else ""))
+    if regressions:
+        print("%d phases slower than x%.2f the baseline" % (len(regressions), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
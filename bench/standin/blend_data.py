@@ -0,0 +1,503 @@
+"""
+Data-blocks of the bpy stand-in: just the attributes the exporter reads,
+stored in numpy columns so foreach_get() is a copy like in blender.
+Built by bench/synthetic.py, never loaded from a blend file.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from mathutils import Matrix, Quaternion, Vector
+
+
+class ID:
+    """Base of the data-blocks, none of them is linked from a library"""
+    library = None
+
+
+class Struct:
+    """bpy struct whose RNA properties are its attributes"""
+
+    @property
+    def bl_rna(self):
+        properties = []
+        for name, value in vars(self).items():
+            if isinstance(value, (ID, Struct)):
+                kind = "POINTER"
+            elif isinstance(value, (list, tuple, Columns)):
+                kind = "COLLECTION"
+            else:
+                kind = type(value).__name__.upper()
+            properties.append(SimpleNamespace(identifier=name, type=kind))
+        return SimpleNamespace(properties=properties)
+
+
+class Item:
+    """Element i of a Columns collection, its attributes are read from the columns"""
+    __slots__ = ("_owner", "index")
+
+    def __init__(self, owner, index):
+        self._owner = owner
+        self.index = index
+
+    def __getattr__(self, name):
+        return self._owner.item_attr(self.index, name)
+
+
+class Columns:
+    """bpy collection whose attributes are stored column by column"""
+
+    def __init__(self, count, **columns):
+        self.count = count
+        self.columns = columns
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return Item(self, i)
+
+    def __iter__(self):
+        return (Item(self, i) for i in range(self.count))
+
+    def foreach_get(self, attr, out):
+        values = self.columns[attr]
+        out[...] = values.reshape(-1).astype(out.dtype, copy=False)
+
+    def item_attr(self, i, name):
+        if name not in self.columns:
+            raise AttributeError(name)
+        value = self.columns[name][i]
+        if isinstance(value, np.ndarray):
+            return Vector(value)
+        return value.item()
+
+
+class Polygons(Columns):
+
+    def __init__(self, mesh, **columns):
+        Columns.__init__(self, len(columns["material_index"]), **columns)
+        self.mesh = mesh
+
+    def item_attr(self, i, name):
+        if name == "loop_indices":
+            start = int(self.columns["loop_start"][i])
+            return range(start, start + int(self.columns["loop_total"][i]))
+        if name == "vertices":
+            start = int(self.columns["loop_start"][i])
+            return self.mesh.loops.columns["vertex_index"][start:start + int(self.columns["loop_total"][i])].tolist()
+        return Columns.item_attr(self, i, name)
+
+
+class VertexGroupElement:
+    __slots__ = ("group", "weight")
+
+    def __init__(self, group, weight):
+        self.group = group
+        self.weight = weight
+
+
+class Vertices(Columns):
+
+    def __init__(self, co, normal, group_index=None, group_weight=None):
+        Columns.__init__(self, len(co), co=co, normal=normal)
+        self.group_index = group_index
+        self.group_weight = group_weight
+
+    def item_attr(self, i, name):
+        if name == "groups":
+            if self.group_index is None:
+                return []
+            return [VertexGroupElement(int(g), float(w)) for g, w in zip(self.group_index[i], self.group_weight[i]) if w > 0.0]
+        return Columns.item_attr(self, i, name)
+
+
+class Layer:
+    """uv or vertex color layer"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+class LayerList(list):
+
+    @property
+    def active(self):
+        return self[0] if self else None
+
+
+class TessFaceLayer(Columns):
+    """Per face view of a per corner layer of a triangulated mesh (tessface_uv_textures, tessface_vertex_colors)"""
+
+    def __init__(self, name, values, kind):
+        Columns.__init__(self, len(values) // 3)
+        self.name = name
+        self.values = values
+        self.kind = kind
+        self.data = self
+
+    def item_attr(self, i, name):
+        corners = self.values[3 * i:3 * i + 3]
+        if self.kind == "uv" and name == "uv":
+            return [Vector(c) for c in corners]
+        if self.kind == "color" and name in ("color1", "color2", "color3"):
+            return Vector(corners[int(name[-1]) - 1][:3])
+        raise AttributeError(name)
+
+
+class Mesh(ID):
+    """Triangulated mesh"""
+
+    def __init__(self, name, positions, triangles, material_index, uvs=(), colors=None, smooth=True,
+                 group_index=None, group_weight=None):
+        self.name = name
+        n_tris = len(triangles)
+        n_loops = 3 * n_tris
+        positions = np.asarray(positions, dtype=np.float32)
+        loop_vertex = np.asarray(triangles, dtype=np.int32).reshape(-1)
+        corners = positions[loop_vertex].reshape(n_tris, 3, 3)
+        face_normal = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        vertex_normal = np.zeros_like(positions)
+        np.add.at(vertex_normal, loop_vertex, np.repeat(face_normal, 3, axis=0))
+        face_normal /= np.maximum(np.linalg.norm(face_normal, axis=1), 1e-12)[:, None]
+        vertex_normal /= np.maximum(np.linalg.norm(vertex_normal, axis=1), 1e-12)[:, None]
+
+        self.vertices = Vertices(positions, vertex_normal, group_index, group_weight)
+        self.loops = Columns(n_loops, vertex_index=loop_vertex,
+                             tangent=np.zeros((n_loops, 3), dtype=np.float32),
+                             bitangent=np.zeros((n_loops, 3), dtype=np.float32))
+        self.polygons = Polygons(self,
+                                 material_index=np.asarray(material_index, dtype=np.int32),
+                                 use_smooth=np.full(n_tris, smooth, dtype=bool),
+                                 loop_start=np.arange(0, n_loops, 3, dtype=np.int32),
+                                 loop_total=np.full(n_tris, 3, dtype=np.int32),
+                                 normal=face_normal.astype(np.float32))
+        self.tessfaces = self.polygons
+        edges = np.unique(np.sort(np.stack((loop_vertex, loop_vertex.reshape(-1, 3)[:, [1, 2, 0]].reshape(-1)), axis=1), axis=1), axis=0)
+        self.edges = Columns(len(edges), vertices=edges.astype(np.int32), use_edge_sharp=np.zeros(len(edges), dtype=bool))
+        self.shape_keys = None
+        self.uv_layers = LayerList(Layer("UVMap.%03d" % i, Columns(n_loops, uv=np.asarray(uv, dtype=np.float32)))
+                                   for i, uv in enumerate(uvs))
+        self.tessface_uv_textures = LayerList(TessFaceLayer(layer.name, layer.data.columns["uv"], "uv") for layer in self.uv_layers)
+        self.vertex_colors = LayerList()
+        self.tessface_vertex_colors = LayerList()
+        if colors is not None:
+            colors = np.asarray(colors, dtype=np.float32)
+            self.vertex_colors.append(Layer("Col", Columns(n_loops, color=colors)))
+            self.tessface_vertex_colors.append(TessFaceLayer("Col", colors, "color"))
+        self.materials = []
+
+    def calc_tangents(self, uvmap=""):
+        """Per triangle tangents of the uv layer uvmap"""
+        uv = next(layer for layer in self.uv_layers if layer.name == uvmap).data.columns["uv"].reshape(-1, 3, 2)
+        corners = self.vertices.columns["co"][self.loops.columns["vertex_index"]].reshape(-1, 3, 3)
+        e1 = corners[:, 1] - corners[:, 0]
+        e2 = corners[:, 2] - corners[:, 0]
+        d1 = uv[:, 1] - uv[:, 0]
+        d2 = uv[:, 2] - uv[:, 0]
+        det = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1]
+        r = np.where(np.abs(det) > 1e-12, 1.0 / np.where(det == 0.0, 1.0, det), 0.0)[:, None]
+        tangent = (e1 * d2[:, 1:2] - e2 * d1[:, 1:2]) * r
+        normal = self.polygons.columns["normal"]
+        tangent -= normal * np.einsum("ij,ij->i", normal, tangent)[:, None]
+        tangent /= np.maximum(np.linalg.norm(tangent, axis=1), 1e-12)[:, None]
+        bitangent = np.cross(normal, tangent)
+        self.loops.columns["tangent"] = np.repeat(tangent, 3, axis=0).astype(np.float32)
+        self.loops.columns["bitangent"] = np.repeat(bitangent, 3, axis=0).astype(np.float32)
+
+
+class Bone:
+
+    def __init__(self, name, parent, matrix_local):
+        self.name = name
+        self.parent = parent
+        self.matrix_local = matrix_local
+
+
+class Armature(ID):
+
+    def __init__(self, name, bones):
+        self.name = name
+        self.bones = bones
+
+
+class PoseBones(list):
+    """Pose bones of an armature object, their matrices are evaluated at the frame of the scene"""
+
+    def __init__(self, obj, bones):
+        list.__init__(self, bones)
+        self.obj = obj
+
+    def foreach_get(self, attr, out):
+        if attr != "matrix":
+            raise AttributeError(attr)
+        # blender returns the matrices column by column
+        out[...] = self.obj.pose_matrices().transpose(0, 2, 1).reshape(-1)
+
+
+class PoseBone:
+
+    def __init__(self, bone, parent):
+        self.name = bone.name
+        self.bone = bone
+        self.parent = parent
+        self.constraints = []
+
+
+class Pose:
+
+    def __init__(self, obj, bones):
+        pose_bones = []
+        for bone in bones:
+            parent = pose_bones[bones.index(bone.parent)] if bone.parent is not None else None
+            pose_bones.append(PoseBone(bone, parent))
+        self.bones = PoseBones(obj, pose_bones)
+
+
+class Action(ID):
+    """
+    Synthetic action: every channel oscillates with its own speed and phase.
+    With one channel the object moves on a circle, else each channel rotates
+    a pose bone around its x axis.
+    """
+
+    def __init__(self, name, frame_start, frame_end, channels=1, seed=0):
+        self.name = name
+        self.frame_range = Vector((frame_start, frame_end))
+        self.id_root = "OBJECT"
+        self.channels = channels
+        self.fcurves = []
+        rng = np.random.RandomState(seed)
+        self.speed = rng.uniform(0.05, 0.2, channels)
+        self.phase = rng.uniform(0.0, 2.0 * np.pi, channels)
+
+    def angles(self, frame):
+        return 0.5 * np.sin(self.speed * frame + self.phase)
+
+
+class Strip:
+
+    def __init__(self, action):
+        self.name = action.name
+        self.action = action
+        self.action_frame_start, self.action_frame_end = action.frame_range
+        self.frame_start, self.frame_end = action.frame_range
+        self.scale = 1.0
+        self.repeat = 1.0
+        self.use_reverse = False
+        self.blend_type = "REPLACE"
+        self.blend_in = 0.0
+        self.blend_out = 0.0
+        self.extrapolation = "HOLD"
+        self.influence = 1.0
+        self.use_animated_influence = False
+        self.mute = False
+        self.fcurves = []
+
+
+class Track:
+
+    def __init__(self, name, strips):
+        self.name = name
+        self.strips = strips
+        self.mute = False
+        self.is_solo = False
+
+
+class AnimData:
+
+    def __init__(self, action):
+        self.action = action
+        self.action_blend_type = "REPLACE"
+        self.action_influence = 1.0
+        self.action_extrapolation = "HOLD"
+        self.use_nla = True
+        self.nla_tracks = [Track(action.name, [Strip(action)])]
+        self.drivers = []
+
+
+class Modifier(Struct):
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.show_viewport = True
+        self.show_render = True
+
+
+class Modifiers(list):
+
+    def new(self, name, type):
+        modifier = Modifier(name, type)
+        self.append(modifier)
+        return modifier
+
+
+class MaterialSlot:
+
+    def __init__(self, material):
+        self.material = material
+
+
+class VertexGroup:
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class Object(ID):
+
+    def __init__(self, scene, name, type, data, matrix=None):
+        self.scene = scene
+        self.name = name
+        self.type = type
+        self.data = data
+        self.parent = None
+        self.hide_render = False
+        self.select = True
+        self.modifiers = Modifiers()
+        self.material_slots = []
+        self.vertex_groups = []
+        self.constraints = []
+        self.particle_systems = []
+        self.rigid_body = None
+        self.rigid_body_constraint = None
+        self.animation_data = None
+        self.pose = None
+        self.armature = None
+        self.rest = matrix if matrix is not None else Matrix.Identity(4)
+        self.rotation_mode = "QUATERNION"
+        self.rotation_quaternion = Quaternion()
+        self.dimensions = Vector((1.0, 1.0, 1.0))
+
+    def __repr__(self):
+        return "<Object %s>" % self.name
+
+    def keys(self):
+        return []
+
+    def find_armature(self):
+        return self.armature
+
+    def to_mesh(self, scene, apply_modifiers, settings, calc_tessface=True, calc_undeformed=False):
+        return self.data
+
+    def animation_data_create(self, action):
+        self.animation_data = AnimData(action)
+        return self.animation_data
+
+    @property
+    def matrix_local(self):
+        action = self.animation_data.action if self.animation_data is not None else None
+        if action is None or self.pose is not None:
+            return self.rest
+        a = action.angles(self.scene.frame_current)[0]
+        return Matrix.Translation((np.cos(a), np.sin(a), 0.0)) * Quaternion((0.0, 0.0, 1.0), a).to_matrix() * self.rest
+
+    @property
+    def matrix_world(self):
+        return self.matrix_local
+
+    def pose_matrices(self):
+        """Armature space matrices [n,4,4] of the pose bones at the current frame"""
+        bones = self.data.bones
+        action = self.animation_data.action if self.animation_data is not None else None
+        angles = action.angles(self.scene.frame_current) if action is not None else np.zeros(len(bones))
+        c = np.cos(angles)
+        s = np.sin(angles)
+        rot = np.zeros((len(bones), 4, 4))
+        rot[:, 0, 0] = 1.0
+        rot[:, 1, 1] = c
+        rot[:, 1, 2] = -s
+        rot[:, 2, 1] = s
+        rot[:, 2, 2] = c
+        rot[:, 3, 3] = 1.0
+        out = np.empty((len(bones), 4, 4))
+        index = {}
+        for i, bone in enumerate(bones):
+            index[bone.name] = i
+            local = np.asarray(bone.matrix_local).dot(rot[i])
+            if bone.parent is not None:
+                p = index[bone.parent.name]
+                # bone.matrix_local is in armature space, make it relative to the parent rest pose
+                local = out[p].dot(np.linalg.inv(np.asarray(bone.parent.matrix_local))).dot(local)
+            out[i] = local
+        return out.astype(np.float32)
+
+
+class Render:
+
+    def __init__(self, fps):
+        self.fps = fps
+
+
+class Scene:
+
+    def __init__(self, name, fps=24):
+        self.name = name
+        self.objects = []
+        self.render = Render(fps)
+        self.frame_current = 1
+        self.frame_subframe = 0.0
+        self.use_gravity = False
+        self.gravity = Vector((0.0, 0.0, -9.81))
+
+    def frame_set(self, frame, subframe=0.0):
+        self.frame_current = frame
+        self.frame_subframe = subframe
+
+
+class Image(ID):
+
+    def __init__(self, name, filepath, size):
+        self.name = name
+        self.filepath = filepath
+        self.filepath_raw = filepath
+        self.file_format = "PNG"
+        self.packed_file = None
+        self.size = size
+
+
+class Link:
+
+    def __init__(self, from_node):
+        self.from_node = from_node
+
+
+class Socket:
+
+    def __init__(self, name="", links=(), default_value=None):
+        self.name = name
+        self.links = list(links)
+        self.default_value = default_value
+
+
+class Node:
+
+    def __init__(self, name, type, inputs=(), outputs=(), **attrs):
+        self.name = name
+        self.type = type
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.__dict__.update(attrs)
+
+
+class NodeTree(ID):
+
+    def __init__(self, name, nodes=()):
+        self.name = name
+        self.nodes = list(nodes)
+
+
+class Material(ID):
+
+    def __init__(self, name, node_tree):
+        self.name = name
+        self.node_tree = node_tree
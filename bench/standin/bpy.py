@@ -0,0 +1,67 @@
+"""
+Stand-in for the part of the bpy module used by the exporter, for the bench
+to run without blender. The data-blocks are in blend_data.py.
+"""
+
+import os
+from types import SimpleNamespace
+
+import blend_data
+
+
+def _property(**kwargs):
+    return kwargs.get("default")
+
+
+props = SimpleNamespace(
+    BoolProperty=_property,
+    IntProperty=_property,
+    FloatProperty=_property,
+    StringProperty=_property,
+    EnumProperty=_property,
+    PointerProperty=_property,
+    FloatVectorProperty=_property,
+)
+
+
+class _Type:
+    pass
+
+
+class Texture(blend_data.ID):
+    pass
+
+
+types = SimpleNamespace(
+    ID=blend_data.ID,
+    Texture=Texture,
+    Operator=_Type,
+    Panel=_Type,
+    Menu=_Type,
+    PropertyGroup=_Type,
+    NodeTree=blend_data.NodeTree,
+    Object=blend_data.Object,
+    Mesh=blend_data.Mesh,
+    Material=blend_data.Material,
+    Image=blend_data.Image,
+)
+
+data = SimpleNamespace(filepath="", objects=[], materials=[], images=[], actions=[])
+context = SimpleNamespace(scene=None)
+app = SimpleNamespace(binary_path=None, background=True, version=(2, 79, 0))
+
+
+def _abspath(path, start=None, library=None):
+    if path.startswith("//"):
+        return os.path.join(start or os.path.dirname(data.filepath), path[2:])
+    return path
+
+
+path = SimpleNamespace(abspath=_abspath)
+
+
+def _register(cls):
+    pass
+
+
+utils = SimpleNamespace(register_class=_register, unregister_class=_register)
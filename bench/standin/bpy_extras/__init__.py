@@ -0,0 +1 @@
+"""Stand-in for blender's bpy_extras package, see bpy.py"""
@@ -0,0 +1,5 @@
+"""Stand-in for bpy_extras.io_utils, see bpy.py"""
+
+
+class ExportHelper:
+    filepath = ""
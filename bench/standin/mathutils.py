@@ -0,0 +1,209 @@
+"""
+Stand-in for the part of blender's mathutils used by the exporter, backed by numpy.
+Only loaded by the bench when it doesn't run inside blender.
+"""
+
+import math
+
+import numpy as np
+
+
+class Vector:
+
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self._v = np.array(values, dtype=np.float64)
+
+    def __len__(self):
+        return len(self._v)
+
+    def __getitem__(self, i):
+        return float(self._v[i]) if isinstance(i, int) else self._v[i].tolist()
+
+    def __setitem__(self, i, value):
+        self._v[i] = value
+
+    def __iter__(self):
+        return iter(self._v.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return self._v.astype(dtype) if dtype is not None else self._v.copy()
+
+    def __repr__(self):
+        return "Vector(%r)" % (tuple(self._v.tolist()),)
+
+    def __add__(self, other):
+        return Vector(self._v + np.asarray(other, dtype=np.float64))
+
+    def __sub__(self, other):
+        return Vector(self._v - np.asarray(other, dtype=np.float64))
+
+    def __mul__(self, other):
+        if isinstance(other, (int, float)):
+            return Vector(self._v * other)
+        return float(np.dot(self._v, np.asarray(other, dtype=np.float64)))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vector(-self._v)
+
+    def copy(self):
+        return Vector(self._v)
+
+    @property
+    def length(self):
+        return float(np.linalg.norm(self._v))
+
+    def normalized(self):
+        n = np.linalg.norm(self._v)
+        return Vector(self._v / n if n > 0.0 else self._v)
+
+    def cross(self, other):
+        return Vector(np.cross(self._v, np.asarray(other, dtype=np.float64)))
+
+    def dot(self, other):
+        return float(np.dot(self._v, np.asarray(other, dtype=np.float64)))
+
+    x = property(lambda self: float(self._v[0]), lambda self, v: self.__setitem__(0, v))
+    y = property(lambda self: float(self._v[1]), lambda self, v: self.__setitem__(1, v))
+    z = property(lambda self: float(self._v[2]), lambda self, v: self.__setitem__(2, v))
+    w = property(lambda self: float(self._v[3]), lambda self, v: self.__setitem__(3, v))
+
+
+class Quaternion:
+
+    def __init__(self, values=(1.0, 0.0, 0.0, 0.0), angle=None):
+        if angle is not None:
+            axis = np.array(values, dtype=np.float64)
+            axis = axis / (np.linalg.norm(axis) or 1.0)
+            s = math.sin(angle * 0.5)
+            values = (math.cos(angle * 0.5), axis[0] * s, axis[1] * s, axis[2] * s)
+        self._q = np.array(values, dtype=np.float64)
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, i):
+        return float(self._q[i])
+
+    def __iter__(self):
+        return iter(self._q.tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return self._q.astype(dtype) if dtype is not None else self._q.copy()
+
+    def __repr__(self):
+        return "Quaternion(%r)" % (tuple(self._q.tolist()),)
+
+    def __mul__(self, other):
+        if isinstance(other, Quaternion):
+            w1, x1, y1, z1 = self._q
+            w2, x2, y2, z2 = other._q
+            return Quaternion((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                               w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                               w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                               w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2))
+        return Vector(self.to_matrix()._m[:3, :3].dot(np.asarray(other, dtype=np.float64)))
+
+    def copy(self):
+        return Quaternion(self._q)
+
+    def normalize(self):
+        self._q /= np.linalg.norm(self._q) or 1.0
+
+    def normalized(self):
+        q = self.copy()
+        q.normalize()
+        return q
+
+    def rotate(self, other):
+        self._q = (other * self)._q
+
+    def to_matrix(self):
+        w, x, y, z = self._q
+        m = Matrix.Identity(4)
+        m._m[:3, :3] = ((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+                        (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+                        (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)))
+        return m
+
+    w = property(lambda self: float(self._q[0]))
+    x = property(lambda self: float(self._q[1]))
+    y = property(lambda self: float(self._q[2]))
+    z = property(lambda self: float(self._q[3]))
+
+
+def _quaternion_of(r):
+    """Quaternion of the rotation matrix r [3,3]"""
+    tr = r[0, 0] + r[1, 1] + r[2, 2]
+    if tr > 0.0:
+        s = math.sqrt(tr + 1.0) * 2.0
+        return Quaternion((0.25 * s, (r[2, 1] - r[1, 2]) / s, (r[0, 2] - r[2, 0]) / s, (r[1, 0] - r[0, 1]) / s))
+    i = int(np.argmax((r[0, 0], r[1, 1], r[2, 2])))
+    j, k = (i + 1) % 3, (i + 2) % 3
+    s = math.sqrt(max(1.0 + r[i, i] - r[j, j] - r[k, k], 0.0)) * 2.0
+    q = [0.0, 0.0, 0.0, 0.0]
+    q[0] = (r[k, j] - r[j, k]) / s
+    q[i + 1] = 0.25 * s
+    q[j + 1] = (r[j, i] + r[i, j]) / s
+    q[k + 1] = (r[k, i] + r[i, k]) / s
+    return Quaternion(q)
+
+
+class Matrix:
+    """Row major 4x4 matrix, multiplied with * like in blender 2.7x"""
+
+    def __init__(self, rows=None):
+        self._m = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+    @staticmethod
+    def Identity(size):
+        return Matrix(np.identity(size))
+
+    @staticmethod
+    def Translation(v):
+        m = Matrix.Identity(4)
+        m._m[:3, 3] = np.asarray(v, dtype=np.float64)[:3]
+        return m
+
+    def __len__(self):
+        return len(self._m)
+
+    def __getitem__(self, i):
+        return Vector(self._m[i])
+
+    def __array__(self, dtype=None, copy=None):
+        return self._m.astype(dtype) if dtype is not None else self._m.copy()
+
+    def __repr__(self):
+        return "Matrix(%r)" % (self._m.tolist(),)
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix(self._m.dot(other._m))
+        v = np.asarray(other, dtype=np.float64)
+        if len(v) == 3:
+            return Vector(self._m[:3, :3].dot(v) + self._m[:3, 3])
+        return Vector(self._m.dot(v))
+
+    def copy(self):
+        return Matrix(self._m)
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(self._m))
+
+    def transposed(self):
+        return Matrix(self._m.T)
+
+    def to_translation(self):
+        return Vector(self._m[:3, 3])
+
+    def to_scale(self):
+        return Vector(np.linalg.norm(self._m[:3, :3], axis=0))
+
+    def to_quaternion(self):
+        r = self._m[:3, :3]
+        return _quaternion_of(r / np.where(np.linalg.norm(r, axis=0) > 0.0, np.linalg.norm(r, axis=0), 1.0))
+
+    def decompose(self):
+        return self.to_translation(), self.to_quaternion(), self.to_scale()
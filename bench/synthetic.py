@@ -0,0 +1,353 @@
+"""
+Synthetic scenes for the exporter benchmark.
+
+A case is a dict of parameters (see DEFAULT_PARAMS), the same case can be
+built in blender (build_blender) or with the stand-in of bench/standin
+(build_standin), both build the same geometry, materials, rigs and actions.
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+DEFAULT_PARAMS = {
+    "objects": 1,  # mesh objects
+    "triangles": 20000,  # per mesh
+    "uv_layers": 1,
+    "colors": 0,  # 1 to add a vertex color layer
+    "materials": 1,  # material slots per mesh, the triangles are split evenly among them
+    "material_pool": 0,  # distinct materials shared by all the meshes, 0 = materials
+    "textures": 0,  # image textures per material
+    "texture_size": 256,
+    "bones": 0,  # bones of the rig, every mesh is skinned to it with up to 4 influences per vertex
+    "frames": 0,  # length of the actions
+    "animated": 0,  # mesh objects with an action, the rig always has one if frames > 0
+    "tangents": 0,  # export options
+    "mikktspace": 1,
+    "remove_doubles": 1,
+    "max_influences": 0,
+    "lod_levels": 0,
+    "vertex_cache": 0,
+    "cluster_threshold": 0,
+    "bulk": 1,
+    "dds": 0,
+}
+
+CASES = {
+    "dense_mesh": {"triangles": 200000, "uv_layers": 2, "colors": 1, "materials": 4},
+    "dense_mesh_per_corner": {"triangles": 20000, "uv_layers": 2, "colors": 1, "materials": 4, "bulk": 0},
+    "tangents": {"triangles": 100000, "uv_layers": 2, "tangents": 1},
+    "tangents_fast": {"triangles": 100000, "uv_layers": 2, "tangents": 1, "mikktspace": 0},
+    "skinned_mesh": {"triangles": 100000, "bones": 64},
+    "vertex_cache": {"triangles": 200000, "uv_layers": 1, "materials": 2, "vertex_cache": 1},
+    "clusters": {"triangles": 500000, "uv_layers": 1, "cluster_threshold": 10000},
+    "lods": {"objects": 4, "triangles": 100000, "uv_layers": 2, "materials": 2, "bones": 16, "lod_levels": 4},
+    "rig": {"triangles": 2000, "bones": 128, "frames": 250},
+    "many_objects": {"objects": 1000, "triangles": 200, "material_pool": 16, "animated": 100, "frames": 100},
+    "materials": {"objects": 64, "triangles": 12, "material_pool": 64, "textures": 4, "texture_size": 512},
+    "dds": {"objects": 16, "triangles": 12, "material_pool": 16, "textures": 2, "texture_size": 1024, "dds": 1},
+}
+
+
+def parse_case(text):
+    """'name' or 'name:param=value,...' -> (name, params), name is a CASES entry or a new case built from the defaults"""
+    name, _, overrides = text.partition(":")
+    params = dict(DEFAULT_PARAMS)
+    params.update(CASES.get(name, {}))
+    for item in filter(None, overrides.split(",")):
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key not in DEFAULT_PARAMS:
+            raise ValueError("Unknown parameter %s of case %s" % (key, name))
+        params[key] = int(value)
+    if params["material_pool"] <= 0:
+        params["material_pool"] = params["materials"]
+    return name, params
+
+
+def grid(triangles, seed):
+    """Wavy grid of about `triangles` triangles: positions [n,3], triangles [t,3], vertex uv [n,2]"""
+    w = max(1, int(np.sqrt(triangles / 2.0)))
+    h = max(1, int(np.ceil(triangles / (2.0 * w))))
+    u, v = np.meshgrid(np.linspace(0.0, 1.0, w + 1), np.linspace(0.0, 1.0, h + 1))
+    phase = seed * 0.37
+    z = 0.1 * np.sin(u * 12.0 + phase) * np.cos(v * 9.0 + phase)
+    positions = np.column_stack((u.ravel() * w * 0.1, v.ravel() * h * 0.1, z.ravel()))
+    i, j = np.meshgrid(np.arange(w), np.arange(h))
+    a = (j * (w + 1) + i).ravel()
+    b = a + 1
+    c = a + w + 1
+    d = c + 1
+    tris = np.empty((2 * len(a), 3), dtype=np.int32)
+    tris[0::2] = np.column_stack((a, b, d))
+    tris[1::2] = np.column_stack((a, d, c))
+    return positions.astype(np.float32), tris[:triangles], np.column_stack((u.ravel(), v.ravel())).astype(np.float32)
+
+
+def mesh_arrays(params, seed):
+    """Per mesh arrays shared by both builders"""
+    positions, tris, vertex_uv = grid(params["triangles"], seed)
+    n_tris = len(tris)
+    loop_vertex = tris.reshape(-1)
+    arrays = {
+        "positions": positions,
+        "triangles": tris,
+        "material_index": (np.arange(n_tris) * params["materials"] // max(1, n_tris)).astype(np.int32),
+        # Per corner uvs: seams every 8 quads so welding has something to split
+        "uvs": [vertex_uv[loop_vertex] * (k + 1) + 0.01 * ((np.arange(3 * n_tris) // 48) % 2)[:, None]
+                for k in range(params["uv_layers"])],
+        "colors": None,
+    }
+    if params["colors"]:
+        arrays["colors"] = np.column_stack((vertex_uv[loop_vertex], np.full(3 * n_tris, 0.5))).astype(np.float32)
+    if params["bones"] > 0:
+        # Up to 4 influences, from the bones closest along x
+        rng = np.random.RandomState(seed)
+        x = positions[:, 0] / max(1e-6, positions[:, 0].max())
+        first = np.minimum((x * params["bones"]).astype(np.int32), params["bones"] - 1)
+        k = min(4, params["bones"])
+        arrays["group_index"] = (first[:, None] + np.arange(k)) % params["bones"]
+        weights = rng.uniform(0.1, 1.0, (len(positions), k))
+        # Quantized so blender can add them one group and weight at a time
+        arrays["group_weight"] = np.round(weights * 16.0) / 16.0
+    return arrays
+
+
+def rig_bones(n):
+    """(name, parent index, head, tail) of a binary tree of n bones"""
+    bones = []
+    for i in range(n):
+        parent = (i - 1) // 2 if i > 0 else -1
+        depth = int(np.log2(i + 1))
+        head = (0.1 * (i - (2 ** depth - 1)), 0.0, float(depth))
+        bones.append(("bone.%03d" % i, parent, head, (head[0], 0.0, head[2] + 1.0)))
+    return bones
+
+
+def write_png(path, size, seed):
+    """Gradient RGB png of size x size pixels"""
+    x = np.linspace(0, 255, size, dtype=np.float32)
+    row = np.empty((size, 3), dtype=np.uint8)
+    row[:, 0] = x
+    row[:, 1] = (x + seed * 37) % 256
+    row[:, 2] = 255 - x
+    rows = np.empty((size, 1 + 3 * size), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = row.reshape(-1)
+    rows[:, 1::3] = (rows[:, 1::3].astype(np.int32) + np.arange(size)[:, None]) % 256
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 1)))
+        f.write(chunk(b"IEND", b""))
+
+
+def texture_files(params, tmp_dir):
+    """Path of the texture files of each material of the pool"""
+    out = []
+    tex_dir = os.path.join(tmp_dir, "textures")
+    if params["textures"] > 0 and not os.path.isdir(tex_dir):
+        os.makedirs(tex_dir)
+    for m in range(params["material_pool"]):
+        files = []
+        for t in range(params["textures"]):
+            path = os.path.join(tex_dir, "mat%03d_tex%d.png" % (m, t))
+            if not os.path.exists(path):
+                write_png(path, params["texture_size"], m * 16 + t)
+            files.append(path)
+        out.append(files)
+    return out
+
+
+MATERIAL_DEF = "!Materials/Bench.j3md"
+
+
+def input_label(t, params):
+    label = "!Map%d" % t
+    if params["dds"]:
+        label += "+dds{solid=dxt1,alpha=dxt5}"
+    return label
+
+
+def build_standin(params, tmp_dir):
+    """Scene of the bpy stand-in"""
+    import blend_data as bd
+    from mathutils import Matrix
+
+    scene = bd.Scene("bench")
+    textures = texture_files(params, tmp_dir)
+    materials = []
+    for m in range(params["material_pool"]):
+        group = bd.Node("Group", "GROUP", node_tree=bd.NodeTree(MATERIAL_DEF))
+        rgb = bd.Node("RGB", "RGB", outputs=[bd.Socket("Color", default_value=(0.8, 0.2, 0.1, 1.0))])
+        nodes = [group, rgb]
+        group.inputs.append(bd.Socket("!Color", [bd.Link(rgb)]))
+        for t, path in enumerate(textures[m]):
+            size = params["texture_size"]
+            tex = bd.Node("Image Texture.%03d" % t, "TEX_IMAGE", outputs=[bd.Socket("Color"), bd.Socket("Alpha")],
+                          image=bd.Image(os.path.basename(path), path, (size, size)))
+            group.inputs.append(bd.Socket(input_label(t, params), [bd.Link(tex)]))
+            nodes.append(tex)
+        materials.append(bd.Material("Material.%03d" % m, bd.NodeTree("Shader Nodetree", nodes)))
+
+    rig = None
+    if params["bones"] > 0:
+        bones = []
+        for name, parent, head, tail in rig_bones(params["bones"]):
+            bones.append(bd.Bone(name, bones[parent] if parent >= 0 else None, Matrix.Translation(head)))
+        rig = bd.Object(scene, "Rig", "ARMATURE", bd.Armature("Rig", bones))
+        rig.pose = bd.Pose(rig, bones)
+        if params["frames"] > 0:
+            rig.animation_data_create(bd.Action("RigAction", 1, params["frames"], channels=len(bones), seed=1))
+        scene.objects.append(rig)
+
+    for i in range(params["objects"]):
+        arrays = mesh_arrays(params, i)
+        mesh = bd.Mesh("Mesh.%03d" % i, arrays["positions"], arrays["triangles"], arrays["material_index"],
+                       arrays["uvs"], arrays["colors"], True, arrays.get("group_index"), arrays.get("group_weight"))
+        obj = bd.Object(scene, "Object.%03d" % i, "MESH", mesh, Matrix.Translation((i * 2.0, 0.0, 0.0)))
+        for k in range(params["materials"]):
+            material = materials[(i * params["materials"] + k) % len(materials)] if materials else None
+            mesh.materials.append(material)
+            obj.material_slots.append(bd.MaterialSlot(material))
+        if rig is not None:
+            obj.armature = rig
+            obj.modifiers.new("Armature", "ARMATURE")
+            obj.vertex_groups = [bd.VertexGroup(bone.name, b) for b, bone in enumerate(rig.data.bones)]
+        if i < params["animated"] and params["frames"] > 0:
+            obj.animation_data_create(bd.Action("Action.%03d" % i, 1, params["frames"], seed=i))
+        scene.objects.append(obj)
+    return scene
+
+
+def build_blender(params, tmp_dir):
+    """The same scene, in the current scene of blender (its objects are removed first)"""
+    import bpy
+
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        scene.objects.unlink(obj)
+    scene.render.fps = 24
+    scene.frame_set(1)
+
+    textures = texture_files(params, tmp_dir)
+    group = bpy.data.node_groups.get(MATERIAL_DEF) or bpy.data.node_groups.new(MATERIAL_DEF, 'ShaderNodeTree')
+    materials = []
+    for m in range(params["material_pool"]):
+        for t in range(len(group.inputs), params["textures"] + 1):
+            group.inputs.new('NodeSocketColor', input_label(t - 1, params) if t > 0 else "!Color")
+        mat = bpy.data.materials.new("Material.%03d" % m)
+        mat.use_nodes = True
+        nt = mat.node_tree
+        gnode = nt.nodes.new('ShaderNodeGroup')
+        gnode.node_tree = group
+        rgb = nt.nodes.new('ShaderNodeRGB')
+        rgb.outputs[0].default_value = (0.8, 0.2, 0.1, 1.0)
+        nt.links.new(rgb.outputs[0], gnode.inputs["!Color"])
+        for t, path in enumerate(textures[m]):
+            tex = nt.nodes.new('ShaderNodeTexImage')
+            tex.image = bpy.data.images.load(path)
+            nt.links.new(tex.outputs[0], gnode.inputs[input_label(t, params)])
+        materials.append(mat)
+
+    rig = None
+    if params["bones"] > 0:
+        arm = bpy.data.armatures.new("Rig")
+        rig = bpy.data.objects.new("Rig", arm)
+        scene.objects.link(rig)
+        scene.objects.active = rig
+        bpy.ops.object.mode_set(mode='EDIT')
+        edit_bones = []
+        for name, parent, head, tail in rig_bones(params["bones"]):
+            eb = arm.edit_bones.new(name)
+            eb.head = head
+            eb.tail = tail
+            if parent >= 0:
+                eb.parent = edit_bones[parent]
+            edit_bones.append(eb)
+        bpy.ops.object.mode_set(mode='OBJECT')
+        if params["frames"] > 0:
+            action = bpy.data.actions.new("RigAction")
+            rng = np.random.RandomState(1)
+            frames = np.arange(1, params["frames"] + 1, dtype=np.float64)
+            for pbone in rig.pose.bones:
+                pbone.rotation_mode = 'QUATERNION'
+                a = 0.5 * np.sin(rng.uniform(0.05, 0.2) * frames + rng.uniform(0.0, 2.0 * np.pi))
+                path = 'pose.bones["%s"].rotation_quaternion' % pbone.name
+                for index, values in enumerate((np.cos(a * 0.5), np.sin(a * 0.5), np.zeros_like(a), np.zeros_like(a))):
+                    _keyframes(action.fcurves.new(path, index, pbone.name), frames, values)
+            _assign_action(rig, action)
+
+    for i in range(params["objects"]):
+        arrays = mesh_arrays(params, i)
+        mesh = _blender_mesh("Mesh.%03d" % i, arrays)
+        obj = bpy.data.objects.new("Object.%03d" % i, mesh)
+        obj.location = (i * 2.0, 0.0, 0.0)
+        scene.objects.link(obj)
+        for k in range(params["materials"]):
+            mesh.materials.append(materials[(i * params["materials"] + k) % len(materials)] if materials else None)
+        if rig is not None:
+            modifier = obj.modifiers.new("Armature", 'ARMATURE')
+            modifier.object = rig
+            groups = [obj.vertex_groups.new(bone.name) for bone in rig.data.bones]
+            index = arrays["group_index"]
+            weight = arrays["group_weight"]
+            for g, vgroup in enumerate(groups):
+                rows, cols = np.nonzero(index == g)
+                for w in np.unique(weight[rows, cols]):
+                    vgroup.add(rows[weight[rows, cols] == w].tolist(), float(w), 'REPLACE')
+        if i < params["animated"] and params["frames"] > 0:
+            action = bpy.data.actions.new("Action.%03d" % i)
+            rng = np.random.RandomState(i)
+            frames = np.arange(1, params["frames"] + 1, dtype=np.float64)
+            a = 0.5 * np.sin(rng.uniform(0.05, 0.2) * frames + rng.uniform(0.0, 2.0 * np.pi))
+            obj.rotation_mode = 'XYZ'
+            _keyframes(action.fcurves.new("location", 0), frames, i * 2.0 + np.cos(a))
+            _keyframes(action.fcurves.new("location", 1), frames, np.sin(a))
+            _keyframes(action.fcurves.new("rotation_euler", 2), frames, a)
+            _assign_action(obj, action)
+    scene.update()
+    return scene
+
+
+def _keyframes(fcurve, frames, values):
+    fcurve.keyframe_points.add(len(frames))
+    fcurve.keyframe_points.foreach_set("co", np.column_stack((frames, values)).ravel().tolist())
+    fcurve.update()
+
+
+def _assign_action(obj, action):
+    obj.animation_data_create()
+    obj.animation_data.action = action
+    track = obj.animation_data.nla_tracks.new()
+    track.name = action.name
+    track.strips.new(action.name, 1, action)
+
+
+def _blender_mesh(name, arrays):
+    import bpy
+
+    tris = arrays["triangles"]
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(arrays["positions"]))
+    mesh.vertices.foreach_set("co", arrays["positions"].ravel())
+    mesh.loops.add(3 * len(tris))
+    mesh.loops.foreach_set("vertex_index", tris.ravel())
+    mesh.polygons.add(len(tris))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, 3 * len(tris), 3, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_total", np.full(len(tris), 3, dtype=np.int32))
+    mesh.polygons.foreach_set("material_index", arrays["material_index"])
+    mesh.polygons.foreach_set("use_smooth", np.ones(len(tris), dtype=bool))
+    for k, uv in enumerate(arrays["uvs"]):
+        mesh.uv_textures.new("UVMap.%03d" % k)
+        mesh.uv_layers[k].data.foreach_set("uv", uv.ravel())
+    if arrays["colors"] is not None:
+        mesh.vertex_colors.new("Col")
+        mesh.vertex_colors[0].data.foreach_set("color", arrays["colors"][:, :3].ravel())
+    mesh.update(calc_edges=True)
+    return mesh
@@ -19,10 +19,8 @@ import os
 _modules_path = os.path.join(os.path.dirname(__file__), "libs")
 for path in os.listdir(_modules_path):
     p=os.path.join(_modules_path,path)
-    print("Load library ",p)
     sys.path.append(p)
 del _modules_path
-print(sys.path)
 
 # Use F8 to reload (see http://wiki.blender.org/index.php/Dev:2.5/Py/Scripts/Cookbook/Code_snippets/Multi-File_packages)
 from . import helpers
@@ -0,0 +1,206 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+import hashlib
+import os
+import shutil
+
+from .logger import Logger
+from .shared_files import locked, read_json, write_json
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = ".f3b_assets.json"
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AssetManifest:
+    """
+    Record of the files written in assets_path (source, size, mtime and content hash).
+    Unchanged files are not copied again, and files with the same content are
+    stored once: later copies are hardlinks to the first one or, where hardlinks
+    are not supported, the first copy is used in their place.
+    Exports running at the same time in assets_path merge their records on save.
+    """
+
+    def __init__(self, assets_path, log=None):
+        self.assets_path = assets_path
+        self.log = log or Logger()
+        self.path = os.path.join(assets_path, MANIFEST_NAME)
+        self.entries = {}  # rpath -> {"source", "size", "mtime", "hash"}
+        self.sources = {}  # source path -> [size, mtime, hash], last known content of the sources
+        self.redirects = {}  # rpath -> rpath of the first copy of the same content, for this run
+        self.updated = set()  # rpaths recorded by this run
+        self.updated_sources = set()
+        self.bytes_copied = 0
+        self.bytes_skipped = 0
+        manifest = self._load()
+        if manifest is not None:
+            self.entries = manifest["entries"]
+            self.sources = manifest["sources"]
+        self.by_hash = {}
+        for rpath, entry in self.entries.items():
+            if os.path.exists(self._abs(rpath)):
+                self.by_hash.setdefault(entry["hash"], rpath)
+
+    def _load(self):
+        """The manifest saved in assets_path, None if there is none"""
+        if not os.path.isfile(self.path):
+            return None
+        manifest = read_json(self.path)
+        if isinstance(manifest, dict) and manifest.get("version") != MANIFEST_VERSION:
+            return None
+        if not isinstance(manifest, dict) or "entries" not in manifest:
+            self.log.warning("Invalid asset manifest %s, it will be rebuilt", self.path)
+            return None
+        return {"entries": manifest["entries"], "sources": manifest.get("sources", {})}
+
+    def _abs(self, rpath):
+        return os.path.join(self.assets_path, rpath)
+
+    def _remove(self, output_file):
+        """Remove output_file if it exists, another export might be removing it too"""
+        try:
+            os.remove(output_file)
+        except FileNotFoundError:
+            pass
+
+    def _record(self, rpath, source, size, mtime, digest):
+        self.entries[rpath] = {"source": source, "size": size, "mtime": mtime, "hash": digest}
+        self.updated.add(rpath)
+
+    def _unchanged(self, rpath, source, size, mtime, digest=None):
+        entry = self.entries.get(rpath)
+        return (entry is not None and entry["source"] == source and entry["size"] == size
+                and entry["mtime"] == mtime and (digest is None or entry["hash"] == digest)
+                and os.path.exists(self._abs(rpath)))
+
+    def source_hash(self, source):
+        """Content hash of the file source, hashed again only if its size or mtime changed"""
+        st = os.stat(source)
+        known = self.sources.get(source)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime:
+            return known[2]
+        digest = hash_file(source)
+        self.sources[source] = [st.st_size, st.st_mtime, digest]
+        self.updated_sources.add(source)
+        return digest
+
+    def _forget(self, rpath):
+        """Drop rpath from by_hash, its content is about to change"""
+        for digest in [d for d, r in self.by_hash.items() if r == rpath]:
+            del self.by_hash[digest]
+
+    def _first_copy(self, digest):
+        """rpath of a file in the assets with the content digest, or None"""
+        first = self.by_hash.get(digest)
+        if first is None:
+            return None
+        entry = self.entries.get(first)
+        if entry is None or entry["hash"] != digest or not os.path.exists(self._abs(first)):
+            del self.by_hash[digest]
+            return None
+        return first
+
+    def _store(self, rpath, source, size, mtime, digest, write):
+        output_file = self._abs(rpath)
+        self._forget(rpath)
+        first = self._first_copy(digest)
+        if first is not None:
+            # Same content already in the assets, link it
+            self._remove(output_file)
+            try:
+                os.link(self._abs(first), output_file)
+            except (OSError, AttributeError):
+                self.log.debug("%s has the same content of %s, it will be used in its place", rpath, first)
+                self.redirects[rpath] = first
+                self.bytes_skipped += size
+                return first
+            self.log.debug("%s is a link to %s", rpath, first)
+            self.bytes_skipped += size
+        else:
+            # Never write through an existing file, it might be a link shared with other assets
+            self._remove(output_file)
+            write(output_file)
+            self.bytes_copied += size
+            self.by_hash[digest] = rpath
+        self._record(rpath, source, size, mtime, digest)
+        return rpath
+
+    def copy_file(self, source, rpath):
+        """Copy source in assets_path/rpath unless it is already there. Returns the rpath to use"""
+        output_file = self._abs(rpath)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        st = os.stat(source)
+        if self._unchanged(rpath, source, st.st_size, st.st_mtime):
+            self.log.debug("%s already up to date", rpath)
+            self.bytes_skipped += st.st_size
+            return rpath
+        digest = self.source_hash(source)
+        if os.path.abspath(source) == os.path.abspath(output_file):
+            self._forget(rpath)
+            self._record(rpath, source, st.st_size, st.st_mtime, digest)
+            self.by_hash.setdefault(digest, rpath)
+            return rpath
+        return self._store(rpath, source, st.st_size, st.st_mtime, digest,
+                           lambda output_file: shutil.copyfile(source, output_file))
+
+    def write_bytes(self, data, rpath, name):
+        """Write data (eg. a packed file) in assets_path/rpath unless it is already there. Returns the rpath to use"""
+        output_file = self._abs(rpath)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        source = "packed:" + name
+        digest = hashlib.sha1(data).hexdigest()
+        if self._unchanged(rpath, source, len(data), None, digest):
+            self.log.debug("%s already up to date", rpath)
+            self.bytes_skipped += len(data)
+            return rpath
+
+        def write(output_file):
+            with open(output_file, "wb") as f:
+                f.write(data)
+        return self._store(rpath, source, len(data), None, digest, write)
+
+    def resolve(self, rpath):
+        """The rpath used in place of rpath during this run"""
+        return self.redirects.get(rpath, rpath)
+
+    def save(self):
+        if not os.path.exists(self.assets_path):
+            return
+        with locked(self.path):
+            # Keep what the other exports in assets_path saved since this one started
+            saved = self._load()
+            if saved is not None:
+                saved["entries"].update((rpath, self.entries[rpath]) for rpath in self.updated if rpath in self.entries)
+                saved["sources"].update((source, self.sources[source]) for source in self.updated_sources)
+                self.entries = saved["entries"]
+                self.sources = saved["sources"]
+            # Drop the files removed since they were written (eg. intermediate copies converted to DDS)
+            self.entries = {rpath: entry for rpath, entry in self.entries.items() if os.path.exists(self._abs(rpath))}
+            self.sources = {source: known for source, known in self.sources.items() if os.path.exists(source)}
+            write_json(self.path, {"version": MANIFEST_VERSION, "entries": self.entries, "sources": self.sources})
+        self.log.info("Assets: %d bytes copied, %d bytes skipped", self.bytes_copied, self.bytes_skipped)
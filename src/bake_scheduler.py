@@ -0,0 +1,138 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Baking of sampled animations.
+
+scene.frame_set() evaluates the whole scene, so instead of sweeping the
+frames of every action of every object, the (object, action) pairs are
+grouped: each group holds at most one action per object, it is swept once
+over the union of the frame ranges and every sampler of the group is fed
+from the same evaluation. Objects that depend on other animated objects
+(constraint targets, drivers) are baked alone, with every other object on
+its current action, like when each action was baked on its own.
+"""
+
+
+def frame_to_time(frame, fps):
+    return int((frame * 1000) / fps)
+
+
+class BakeJob:
+    """Action to sample on obj over [frame_start, frame_end), done() is called once it has been sampled"""
+
+    def __init__(self, obj, action, frame_start, frame_end, samplers, done=None):
+        self.obj = obj
+        self.action = action
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.samplers = samplers
+        self.done = done
+
+
+def _targets(constraints):
+    for c in constraints:
+        target = getattr(c, "target", None)
+        if target is not None:
+            yield target
+        for t in getattr(c, "targets", ()):
+            if t.target is not None:
+                yield t.target
+
+
+def depends_on_others(obj, animated):
+    """True if the evaluation of obj can change with the action of another animated object, animated is a set"""
+    targets = list(_targets(obj.constraints))
+    if obj.pose is not None:
+        for pbone in obj.pose.bones:
+            targets.extend(_targets(pbone.constraints))
+    if any(t != obj and t in animated for t in targets):
+        return True
+    if obj.animation_data is not None:
+        for driver in obj.animation_data.drivers:
+            for var in driver.driver.variables:
+                if any(t.id is not None and t.id != obj for t in var.targets):
+                    return True
+    return False
+
+
+def plan_groups(jobs, animated):
+    """Split jobs in groups that can be sampled by the same frame sweep"""
+    animated = set(animated)
+    dependent = {}
+    shared = []  # (objects of the group, jobs of the group)
+    alone = []
+    for job in jobs:
+        if job.obj not in dependent:
+            dependent[job.obj] = depends_on_others(job.obj, animated)
+        if dependent[job.obj]:
+            alone.append([job])
+            continue
+        for objs, group in shared:
+            if job.obj not in objs:
+                objs.add(job.obj)
+                group.append(job)
+                break
+        else:
+            shared.append(({job.obj}, [job]))
+    return [group for _, group in shared] + alone
+
+
+def sweep(scene, group, fps):
+    """Set the action of every job of group and sample them over the union of their frame ranges"""
+    for job in group:
+        job.obj.animation_data.action = job.action
+    frame_start = min(job.frame_start for job in group)
+    frame_end = max(job.frame_end for job in group)
+    for f in range(frame_start, frame_end):
+        scene.frame_set(f)
+        t = None
+        for job in group:
+            if job.frame_start <= f < job.frame_end:
+                if t is None:
+                    t = frame_to_time(f, fps)
+                for sampler in job.samplers:
+                    sampler.capture(t)
+    for job in group:
+        if job.done is not None:
+            job.done()
+    return frame_end - frame_start
+
+
+def bake(scene, jobs, animated, fps, log=None):
+    """
+    Sample all jobs.
+    side effects :
+    * change the current action of the objects of the jobs, animated objects are restored to their current action between groups
+    * change the scene.frame by scene.frame_set
+    Returns the number of frames evaluated
+    """
+    animated = list(animated)
+    current = [(obj, obj.animation_data.action) for obj in animated]
+    groups = plan_groups(jobs, animated)
+    frames = 0
+    try:
+        for group in groups:
+            for obj, action in current:
+                obj.animation_data.action = action
+            frames += sweep(scene, group, fps)
+    finally:
+        for obj, action in current:
+            obj.animation_data.action = action
+    if log is not None:
+        log.info("Baked %d actions in %d groups, %d frames evaluated", len(jobs), len(groups), frames)
+    return frames
@@ -0,0 +1,326 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Headless export of many blend files.
+
+    blender -b --python f3b_exporter/batch_export.py -- [options] files...
+
+files are paths, glob patterns (** is recursive) or @list.txt files with one
+path per line. The files are split in chunks of --files-per-worker, each chunk
+is exported by a background blender process (so its startup is paid once per
+chunk and the memory it leaks is released when it exits), --workers of them
+run at once. A worker that crashes fails the file it was exporting, the rest
+of its chunk goes to a new worker.
+The result, timings and errors of every file are written to --summary.
+
+The coordinator doesn't need bpy, it can run in plain python too with --blender.
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_VERSION = 1
+# Lines of the output of a crashed worker kept in the summary
+CRASH_LOG_LINES = 20
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="blender -b --python batch_export.py --", description="Export blend files to f3b")
+    parser.add_argument("files", nargs="*", help="blend files, glob patterns or @file with one path per line")
+    parser.add_argument("--output-dir", help="Where to write the .f3b files, mirroring the layout of the inputs (default: next to each blend file)")
+    parser.add_argument("--summary", default="f3b_batch_summary.json", help="Results and timings of the export")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Blender processes running at once")
+    parser.add_argument("--files-per-worker", type=int, default=8, help="Files exported by a blender process before it is replaced")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which a blender process is killed")
+    parser.add_argument("--blender", default=None, help="Blender executable of the workers (default: the running one)")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+
+    # Export options, same as the ones of the f3bExporter operator
+    parser.add_argument("--selection", dest="option_export_selection", action="store_true", help="Export only the selected objects")
+    parser.add_argument("--tangents", dest="option_export_tangents", action="store_true")
+    parser.add_argument("--fast-tangents", dest="option_mikktspace_tangents", action="store_false", help="Compute the tangents with the exporter instead of blender (MikkTSpace): faster, but only close to it")
+    parser.add_argument("--keep-doubles", dest="option_remove_doubles", action="store_false")
+    parser.add_argument("--weld-epsilon", dest="option_weld_epsilon", type=float, default=0.0)
+    parser.add_argument("--max-influences", dest="option_max_influences", type=int, default=0, help="Bone weights kept per vertex (0 = all)")
+    parser.add_argument("--lod-levels", dest="option_lod_levels", type=int, default=0, help="Simplified meshes exported after each mesh (0 = no LODs)")
+    parser.add_argument("--lod-ratio", dest="option_lod_ratio", type=float, default=0.5, help="Triangles of each LOD level, relative to the previous one")
+    parser.add_argument("--lod-screen-size", dest="option_lod_screen_size", type=float, default=0.5, help="Screen height fraction below which the first LOD level is used")
+    parser.add_argument("--optimize-vertex-cache", dest="option_optimize_vertex_cache", action="store_true", help="Reorder the meshes for the GPU vertex caches")
+    parser.add_argument("--cluster-threshold", dest="option_cluster_threshold", type=int, default=0, help="Split the meshes with more triangles than this in clusters (0 = never)")
+    parser.add_argument("--cluster-vertices", dest="option_cluster_vertices", type=int, default=64)
+    parser.add_argument("--cluster-triangles", dest="option_cluster_triangles", type=int, default=124)
+    parser.add_argument("--no-bounds", dest="option_export_bounds", action="store_false", help="Don't write the bounds of the meshes, objects and scene")
+    parser.add_argument("--incremental", dest="option_incremental", action="store_true")
+    parser.add_argument("--reduce-keyframes", dest="option_reduce_keyframes", action="store_true")
+    parser.add_argument("--translation-tolerance", dest="option_translation_tolerance", type=float, default=0.001)
+    parser.add_argument("--rotation-tolerance", dest="option_rotation_tolerance", type=float, default=0.1, help="Degrees")
+    parser.add_argument("--scale-tolerance", dest="option_scale_tolerance", type=float, default=0.001)
+    parser.add_argument("--streaming", dest="option_streaming", action="store_true")
+    parser.add_argument("--profile", dest="option_profile", action="store_true")
+    parser.add_argument("--profile-memory", dest="option_profile_memory", action="store_true", help="Also trace the memory of each phase (slower)")
+    parser.add_argument("--slow-extraction", dest="option_bulk_extraction", action="store_false")
+    parser.add_argument("--dds", dest="option_convert_texture_dds", action="store_true")
+    parser.add_argument("--dds-workers", dest="option_dds_workers", type=int, default=0, help="DDSWriter processes per export (default: cores / workers)")
+    parser.add_argument("--dds-memory", dest="option_dds_memory", type=int, default=2000)
+    parser.add_argument("--snapshot", dest="option_snapshot", action="store_true", help="Capture .f3bsnap.npz snapshots, to be converted by snapshot_convert.py")
+    parser.add_argument("--log-level", dest="option_log_level", choices=["QUIET", "INFO", "DEBUG"], default="INFO")
+    return parser.parse_args(argv)
+
+
+def script_args(argv):
+    """Arguments after --, blender keeps the ones before it"""
+    if "--" in argv:
+        return argv[argv.index("--") + 1:]
+    return argv[1:]
+
+
+def export_options(args):
+    """The option_* attributes of args, as f3b_export.export_file expects them"""
+    options = {k: v for k, v in vars(args).items() if k.startswith("option_")}
+    options["option_rotation_tolerance"] = math.radians(args.option_rotation_tolerance)
+    if options["option_dds_workers"] <= 0:
+        options["option_dds_workers"] = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    return options
+
+
+def expand_files(patterns):
+    """Absolute paths of the blend files matching patterns, without duplicates, in order"""
+    files = []
+    for pattern in patterns:
+        if pattern.startswith("@"):
+            with open(pattern[1:], "r") as f:
+                found = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        elif glob.has_magic(pattern):
+            found = sorted(glob.glob(pattern, recursive=True))
+        else:
+            found = [pattern]
+        for path in found:
+            path = os.path.abspath(path)
+            if path not in files:
+                files.append(path)
+    return files
+
+
+def output_paths(files, output_dir):
+    """blend file -> f3b file, in output_dir the inputs keep their layout relative to their common directory"""
+    if not output_dir:
+        return {f: os.path.splitext(f)[0] + ".f3b" for f in files}
+    root = os.path.commonpath([os.path.dirname(f) for f in files]) if files else ""
+    return {f: os.path.join(os.path.abspath(output_dir), os.path.splitext(os.path.relpath(f, root))[0] + ".f3b") for f in files}
+
+
+def make_chunks(files, files_per_worker):
+    """Largest files first, so the slowest chunks start before the others"""
+    def size(f):
+        try:
+            return os.path.getsize(f)
+        except OSError:
+            return 0
+    files = sorted(files, key=size, reverse=True)
+    n = max(1, files_per_worker)
+    return [files[i:i + n] for i in range(0, len(files), n)]
+
+
+def default_blender():
+    try:
+        import bpy
+        return bpy.app.binary_path
+    except ImportError:
+        return "blender"
+
+
+class BatchExporter:
+    """Runs the chunks of files in background blender processes and collects their results"""
+
+    def __init__(self, blender, options, outputs, workers, files_per_worker, timeout=None, tmp_dir=None):
+        self.blender = blender
+        self.options = options
+        self.outputs = outputs
+        self.workers = max(1, workers)
+        self.files_per_worker = max(1, files_per_worker)
+        self.timeout = timeout
+        self.tmp_dir = tmp_dir or tempfile.mkdtemp(prefix="f3b_batch_")
+        self.processes = 0
+
+    def command(self, job_path):
+        return [self.blender, "-b", "--factory-startup", "-noaudio", "--python", os.path.abspath(__file__), "--", "--worker", job_path]
+
+    def _run_worker(self, chunk, n):
+        """Export chunk in a new blender process. Returns (results by file, returncode, log path)"""
+        job_path = os.path.join(self.tmp_dir, "job%s.json" % n)
+        results_path = job_path + ".results"
+        log_path = job_path + ".log"
+        with open(job_path, "w") as f:
+            json.dump({"files": [[blend, self.outputs[blend]] for blend in chunk], "options": self.options}, f)
+        with open(log_path, "w") as log:
+            try:
+                returncode = subprocess.run(self.command(job_path), stdout=log, stderr=subprocess.STDOUT, timeout=self.timeout).returncode
+            except subprocess.TimeoutExpired:
+                returncode = "timeout"
+            except OSError as e:
+                # Blender could not be started (eg. a wrong --blender path)
+                log.write("Can't run %s: %s\n" % (self.blender, e))
+                returncode = None
+        results = {}
+        if os.path.exists(results_path):
+            with open(results_path, "r") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # Last line of a crashed worker
+                    results[result["file"]] = result
+        return results, returncode, log_path
+
+    def export_chunk(self, index, chunk):
+        """Results of the files of chunk, in order. Files left by a crashed worker go to a new one,
+        unless blender could not be started at all"""
+        results = []
+        attempt = 0
+        while chunk:
+            n = "%d_%d" % (index, attempt)
+            start = time.time()
+            done, returncode, log_path = self._run_worker(chunk, n)
+            if returncode is not None:
+                self.processes += 1
+            for blend in chunk:
+                if blend in done:
+                    done[blend]["worker"] = n
+                    results.append(done[blend])
+            missing = [blend for blend in chunk if blend not in done]
+            if missing:
+                with open(log_path, "r", errors="replace") as f:
+                    tail = f.readlines()[-CRASH_LOG_LINES:]
+                if returncode is None:
+                    results.extend({"file": blend, "output": self.outputs[blend], "ok": False, "worker": n, "seconds": 0.0,
+                                    "error": "".join(tail)} for blend in missing)
+                    break
+                # The first file not done is the one the worker was exporting
+                results.append({"file": missing[0], "output": self.outputs[missing[0]], "ok": False, "worker": n,
+                                "seconds": time.time() - start - sum(done[b]["seconds"] for b in chunk if b in done),
+                                "error": "Blender exited with code %s\n%s" % (returncode, "".join(tail))})
+            chunk = missing[1:]
+            attempt += 1
+        return results
+
+    def run(self, files):
+        chunks = make_chunks(files, self.files_per_worker)
+        if not chunks:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+            results = [r for chunk_results in pool.map(self.export_chunk, range(len(chunks)), chunks) for r in chunk_results]
+        order = {f: i for i, f in enumerate(files)}
+        return sorted(results, key=lambda r: order[r["file"]])
+
+
+def write_summary(path, results, seconds, exporter):
+    failed = [r for r in results if not r["ok"]]
+    summary = {
+        "version": SUMMARY_VERSION,
+        "seconds": seconds,
+        "workers": exporter.workers,
+        "files_per_worker": exporter.files_per_worker,
+        "worker_processes": exporter.processes,
+        "exported": len(results) - len(failed),
+        "failed": len(failed),
+        "files_per_second": len(results) / seconds if seconds > 0 else 0.0,
+        "export_seconds": sum(r["seconds"] for r in results),
+        "files": results,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, path)
+    return summary
+
+
+def coordinator_main(args):
+    files = expand_files(args.files)
+    exporter = BatchExporter(args.blender or default_blender(), export_options(args), output_paths(files, args.output_dir),
+                             args.workers, args.files_per_worker, args.timeout)
+    start = time.time()
+    try:
+        results = exporter.run(files)
+    finally:
+        shutil.rmtree(exporter.tmp_dir, ignore_errors=True)
+    summary = write_summary(os.path.abspath(args.summary), results, time.time() - start, exporter)
+    print("f3b: exported %d files, %d failed, in %.2fs with %d workers (%d blender processes), summary in %s" % (
+        summary["exported"], summary["failed"], summary["seconds"], exporter.workers, exporter.processes, args.summary))
+    for r in results:
+        if not r["ok"]:
+            print("f3b: FAILED " + r["file"])
+    return 1 if summary["failed"] else 0
+
+
+def import_exporter():
+    """f3b_export of the addon this script is part of, without registering it"""
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(addon_dir))
+    package = os.path.basename(addon_dir)
+    importlib.import_module(package)
+    return importlib.import_module(package + ".f3b_export")
+
+
+def worker_main(job_path):
+    """Export the files of the job, appending one result per line to job_path.results as soon as it is done"""
+    import bpy
+    f3b_export = import_exporter()
+    with open(job_path, "r") as f:
+        job = json.load(f)
+    options = argparse.Namespace(**job["options"])
+    with open(job_path + ".results", "a") as out:
+        for blend, output in job["files"]:
+            result = {"file": blend, "output": output}
+            start = time.time()
+            try:
+                bpy.ops.wm.open_mainfile(filepath=blend)
+                result["load_seconds"] = time.time() - start
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                profile = f3b_export.export_file(bpy.context.scene, output, options)
+                result["ok"] = True
+                if profile is not None:
+                    result["profile"] = profile
+            except Exception:
+                result["ok"] = False
+                result["error"] = traceback.format_exc()
+            result["seconds"] = time.time() - start
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    return 0
+
+
+def main(argv):
+    args = parse_args(script_args(argv))
+    if args.worker is not None:
+        return worker_main(args.worker)
+    return coordinator_main(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
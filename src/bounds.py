@@ -0,0 +1,89 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Bounding volumes of the exported meshes, objects and scene, in y up coordinates.
+
+The bounds of a mesh are computed from its positions: the tight AABB, and a
+sphere centered on it that contains all of them. The bounds of an object are
+the ones of its meshes moved by its world matrix (the AABB of the moved
+corners, the moved sphere scaled by the largest axis scale), the bounds of
+the scene enclose the ones of all the objects.
+
+They are written as custom params (see f3b_encode.export_bounds):
+bounds_<mesh id> and bounds_<object id>, related to the mesh and the object,
+and bounds_scene.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+Bounds = namedtuple("Bounds", "aabb_min aabb_max sphere_center sphere_radius")
+
+# z up (blender) to y up (f3b), see cnv_arrayZupToYup
+_Z_TO_Y = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, -1.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+
+
+def points_bounds(points):
+    """Bounds of the points [n,3], None if there are none"""
+    if len(points) == 0:
+        return None
+    points = np.asarray(points, dtype=np.float64)
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    center = (lo + hi) * 0.5
+    d = points - center
+    return Bounds(lo, hi, center, float(np.sqrt(np.einsum("ij,ij->i", d, d).max())))
+
+
+def yup_matrix(matrix):
+    """The blender (z up) 4x4 matrix for y up coordinates"""
+    return _Z_TO_Y.dot(np.array(matrix, dtype=np.float64)).dot(_Z_TO_Y.T)
+
+
+def transform_bounds(bounds, matrix):
+    """Bounds containing bounds moved by the y up 4x4 matrix"""
+    corners = np.array(np.meshgrid(*zip(bounds.aabb_min, bounds.aabb_max), indexing="ij")).reshape(3, -1).T
+    moved = corners.dot(matrix[:3, :3].T) + matrix[:3, 3]
+    scale = np.sqrt((matrix[:3, :3] ** 2).sum(axis=0)).max()
+    return Bounds(moved.min(axis=0), moved.max(axis=0), matrix[:3, :3].dot(bounds.sphere_center) + matrix[:3, 3],
+                  bounds.sphere_radius * scale)
+
+
+def merge_bounds(bounds):
+    """Bounds containing all the bounds, None if there are none"""
+    bounds = [b for b in bounds if b is not None]
+    if not bounds:
+        return None
+    lo = np.min([b.aabb_min for b in bounds], axis=0)
+    hi = np.max([b.aabb_max for b in bounds], axis=0)
+    center = (lo + hi) * 0.5
+    radius = max(np.linalg.norm(b.sphere_center - center) + b.sphere_radius for b in bounds)
+    # The corners of the AABB may be closer than the spheres
+    radius = min(radius, float(np.linalg.norm(hi - center)))
+    return Bounds(lo, hi, center, float(radius))
+
+
+def pack_bounds(bounds):
+    """Bounds as bytes, for the export cache"""
+    return np.concatenate((bounds.aabb_min, bounds.aabb_max, bounds.sphere_center, [bounds.sphere_radius])).astype("<f8").tobytes()
+
+
+def unpack_bounds(body):
+    v = np.frombuffer(body, dtype="<f8")
+    return Bounds(v[0:3], v[3:6], v[6:9], float(v[9]))
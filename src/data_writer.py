@@ -0,0 +1,83 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Output of the exported Data message.
+
+In streaming mode the entries of the top level repeated fields are encoded
+and appended to the file as soon as they are finished, then dropped. This is
+valid because the encoding of a message is the concatenation of the encoding
+of its fields, and repeated fields found several times are merged by the
+parsers, so the file reads back as one Data message.
+"""
+
+import os
+
+from .packed_arrays import length_delimited
+
+
+class DataWriter:
+    """Writes the exported Data to path, all at once or streaming the finished entries"""
+
+    def __init__(self, path, streaming=False):
+        self.path = path
+        self.streaming = streaming
+        self.bytes_written = 0
+        self._tmp = path + ".tmp"
+        self._file = open(self._tmp, "wb") if streaming else None
+
+    def _write(self, body):
+        self._file.write(body)
+        self.bytes_written += len(body)
+
+    def entry(self, data, field_name):
+        """
+        New entry of the repeated field data.<field_name>.
+        In streaming mode the entry is not part of data, it is written by done()
+        """
+        if not self.streaming:
+            return getattr(data, field_name).add()
+        return getattr(type(data)(), field_name).add()
+
+    def done(self, data, field_name, entry):
+        """entry, from entry(), is complete"""
+        if self.streaming:
+            tag, value = length_delimited(data.DESCRIPTOR.fields_by_name[field_name].number, entry.SerializeToString())
+            self._write(tag + value)
+
+    def flush(self, data):
+        """In streaming mode, write all the entries of data and remove them from it"""
+        if self.streaming:
+            self._write(data.SerializeToString())
+            data.Clear()
+
+    def close(self, data):
+        """Write what is left of data and move the file in place"""
+        if self.streaming:
+            self.flush(data)
+        else:
+            self._file = open(self._tmp, "wb")
+            self._write(data.SerializeToString())
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        """Drop the partially written file, the previous one (if any) is left untouched"""
+        if self._file is not None:
+            self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
@@ -0,0 +1,276 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+import hashlib
+import math
+import os
+import shutil
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import Logger
+from .shared_files import locked, read_json, write_json
+
+MULTIRES = ":100%,-low:50%,-lower:50%,-lowest:16px"
+BATCH_SIZE = 16
+# Memory used by a DDSWriter process before loading any texture
+BASE_MEMORY_MB = 256
+# Bytes per source pixel held while converting: rgba source, rgba output and
+# compressed copies, all with their mipmaps and multires variants
+BYTES_PER_PIXEL = 16
+
+DDS_CACHE_VERSION = 1
+DDS_CACHE_NAME = ".f3b_dds.json"
+
+DDSJob = namedtuple("DDSJob", "format input output pixels key")
+DDSBatch = namedtuple("DDSBatch", "jobs memory_mb")
+DDSTiming = namedtuple("DDSTiming", "batch jobs pixels seconds returncode")
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def job_memory_mb(job):
+    return job.pixels * BYTES_PER_PIXEL / (1024.0 * 1024.0)
+
+
+def multires_outputs(output, multires):
+    """Files written by DDSWriter for output: one for each suffix of the multires spec"""
+    if multires == "":
+        return [output]
+    base, ext = os.path.splitext(output)
+    return [base + variant.split(":")[0].strip() + ext for variant in multires.split(",")]
+
+
+class DDSCache:
+    """
+    DDS files converted by previous exports in assets_path, keyed by the content
+    of their source and the conversion parameters.
+    Exports running at the same time in assets_path merge their entries on save.
+    """
+    # Entries not used for this many exports are forgotten
+    MAX_UNUSED_RUNS = 16
+
+    def __init__(self, assets_path, log=None):
+        self.assets_path = assets_path
+        self.log = log or Logger()
+        self.path = os.path.join(assets_path, DDS_CACHE_NAME)
+        self.entries = {}  # key -> {"outputs": [rpath], "run": last export using it}
+        self.run = 0
+        self.hits = 0
+        self.updated = set()  # keys used or converted by this export
+        self.written = set()  # rpaths converted by this export
+        cache = self._load()
+        if cache is not None:
+            self.entries = cache["entries"]
+            self.run = cache["run"]
+        self.run += 1
+
+    def _load(self):
+        """The cache saved in assets_path, None if there is none"""
+        if not os.path.isfile(self.path):
+            return None
+        cache = read_json(self.path)
+        if isinstance(cache, dict) and cache.get("version") != DDS_CACHE_VERSION:
+            return None
+        if not isinstance(cache, dict) or "entries" not in cache or "run" not in cache:
+            self.log.warning("Invalid DDS cache %s, it will be rebuilt", self.path)
+            return None
+        return cache
+
+    def key_of(self, source_hash, format, mipmaps, multires):
+        return hashlib.sha1(repr((DDS_CACHE_VERSION, source_hash, format, mipmaps, multires)).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """rpath of the main DDS file converted for key, or None if it has to be converted"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if not all(os.path.exists(os.path.join(self.assets_path, rpath)) for rpath in entry["outputs"]):
+            del self.entries[key]
+            return None
+        entry["run"] = self.run
+        self.updated.add(key)
+        self.hits += 1
+        return entry["outputs"][0]
+
+    def share(self, key, rpath):
+        """
+        Give the DDS file rpath its own copy (a hardlink where supported) of the files converted for key,
+        that might belong to another texture with the same content, converted again in this export.
+        Returns rpath
+        """
+        outputs = self.entries[key]["outputs"]
+        base = os.path.splitext(outputs[0])[0]
+        own_base = os.path.splitext(rpath)[0]
+        own = []
+        for output in outputs:
+            source = os.path.join(self.assets_path, output)
+            target = os.path.join(self.assets_path, own_base + output[len(base):])
+            if os.path.lexists(target):
+                os.remove(target)
+            try:
+                os.link(source, target)
+            except (OSError, AttributeError):
+                shutil.copyfile(source, target)
+            own.append(target)
+        self.put(key, own)
+        return rpath
+
+    def put(self, key, outputs):
+        """Record the files (absolute paths, main DDS file first) converted for key"""
+        rpaths = [os.path.relpath(output, self.assets_path).replace(os.sep, "/") for output in outputs]
+        # The files now hold this conversion, not the one of entries that wrote them before
+        for other in [k for k, e in self.entries.items() if set(e["outputs"]) & set(rpaths)]:
+            del self.entries[other]
+        self.entries[key] = {"outputs": rpaths, "run": self.run}
+        self.updated.add(key)
+        self.written.update(rpaths)
+
+    def save(self):
+        """Forget the entries not used for a while or whose files are gone, and write the cache"""
+        if not os.path.exists(self.assets_path):
+            return
+        with locked(self.path):
+            # Keep what the other exports in assets_path saved since this one started
+            saved = self._load()
+            if saved is not None:
+                entries = {key: entry for key, entry in saved["entries"].items()
+                           if key not in self.updated and not set(entry["outputs"]) & self.written}
+                entries.update((key, self.entries[key]) for key in self.updated if key in self.entries)
+                self.entries = entries
+                self.run = max(self.run, saved["run"])
+            self.entries = {key: entry for key, entry in self.entries.items()
+                            if entry["run"] >= self.run - self.MAX_UNUSED_RUNS
+                            and all(os.path.exists(os.path.join(self.assets_path, rpath)) for rpath in entry["outputs"])}
+            write_json(self.path, {"version": DDS_CACHE_VERSION, "run": self.run, "entries": self.entries})
+        self.log.info("DDS cache: %d textures reused", self.hits)
+
+
+class DDSScheduler:
+    """
+    Queue of the textures to convert to DDS during one export.
+    Jobs are sorted largest first and packed in batches that fit memory_mb
+    (one DDSWriter process each), then up to workers batches run at once.
+    """
+
+    def __init__(self, writer_path, workers=0, memory_mb=2000, batch_size=BATCH_SIZE, multires=MULTIRES, mipmaps=True, cache=None, log=None):
+        self.writer_path = writer_path
+        self.log = log or Logger()
+        self.workers = workers if workers > 0 else default_workers()
+        self.memory_mb = memory_mb
+        self.batch_size = batch_size
+        self.multires = multires
+        self.mipmaps = mipmaps
+        self.cache = cache
+        self.jobs = []
+        self.inputs = set()  # inputs of the queued jobs
+        self.timings = []
+
+    def add(self, format, input, output, pixels, key=None):
+        """Queue the conversion of input to output, textures sharing the same copy are converted once.
+        key is the DDSCache key the outputs are recorded with, once converted"""
+        if input in self.inputs:
+            return
+        self.inputs.add(input)
+        self.jobs.append(DDSJob(format, input, output, pixels, key))
+
+    def batches(self):
+        """Split the jobs, largest first, in batches within the memory budget"""
+        budget = self.memory_mb - BASE_MEMORY_MB
+        out = []
+        jobs = []
+        used = 0.0
+        for job in sorted(self.jobs, key=lambda j: j.pixels, reverse=True):
+            needed = job_memory_mb(job)
+            if jobs and (len(jobs) >= self.batch_size or used + needed > budget):
+                out.append(DDSBatch(jobs, BASE_MEMORY_MB + used))
+                jobs = []
+                used = 0.0
+            if needed > budget:
+                self.log.warning("%s needs about %dMB, more than the DDS memory budget", job.input, needed)
+            jobs.append(job)
+            used += needed
+        if jobs:
+            out.append(DDSBatch(jobs, BASE_MEMORY_MB + used))
+        return out
+
+    def command(self, batch):
+        command = [self.writer_path, "--use-opengl"]
+        if self.mipmaps:
+            command.append("--gen-mipmaps")
+        command += ["--format ", ",".join(job.format for job in batch.jobs),
+                    "--inlist ", ",".join(job.input for job in batch.jobs),
+                    "--outlist", ",".join(job.output for job in batch.jobs)]
+        if self.multires != "":
+            command.append("--multires")
+            command.append(self.multires)
+        return command
+
+    def _run_batch(self, i, batch):
+        command = self.command(batch)
+        env = dict(os.environ)
+        # Caps the heap of the JVM behind DDSWriter, whichever launcher is used, to the share
+        # of the budget the batch was packed for, since up to workers batches run at once
+        env["JAVA_TOOL_OPTIONS"] = (env.get("JAVA_TOOL_OPTIONS", "") + " -Xmx" + str(int(math.ceil(batch.memory_mb))) + "M").strip()
+        self.log.debug("Run %s", command)
+        start = time.time()
+        returncode = subprocess.call(command, env=env)
+        timing = DDSTiming(i, len(batch.jobs), sum(job.pixels for job in batch.jobs), time.time() - start, returncode)
+        self.log.info("DDS batch %d: %d textures, %d pixels, %.2fs", timing.batch, timing.jobs, timing.pixels, timing.seconds)
+        if returncode != 0:
+            self.log.warning("DDSWriter exited with code %d", returncode)
+        return timing
+
+    def run(self):
+        """Convert all the queued textures, then remove the intermediate copies and empty the queue"""
+        batches = self.batches()
+        if not batches:
+            return
+        # Never write through an existing file, it might be a link shared with other textures (see DDSCache.share)
+        for job in self.jobs:
+            for output in multires_outputs(job.output, self.multires):
+                if os.path.lexists(output):
+                    os.remove(output)
+        start = time.time()
+        # Always wait for the first batch, to ensure all resources are extracted properly
+        timings = [self._run_batch(0, batches[0])]
+        if len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches) - 1)) as pool:
+                futures = [pool.submit(self._run_batch, i, batch) for i, batch in enumerate(batches) if i > 0]
+                timings.extend(f.result() for f in futures)
+        self.timings.extend(timings)
+        self.log.info("Converted %d textures to DDS in %d batches with %d workers, %.2fs",
+                      len(self.jobs), len(batches), self.workers, time.time() - start)
+        if self.cache is not None:
+            for batch, timing in zip(batches, timings):
+                if timing.returncode != 0:
+                    continue
+                for job in batch.jobs:
+                    if job.key is not None and os.path.exists(job.output):
+                        outputs = multires_outputs(job.output, self.multires)
+                        self.cache.put(job.key, [job.output] + [f for f in outputs[1:] if os.path.exists(f)])
+        for job in self.jobs:
+            try:
+                os.remove(job.input)
+            except OSError:
+                pass
+        self.jobs = []
+        self.inputs = set()
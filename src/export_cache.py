@@ -0,0 +1,423 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Cross run cache of encoded entities.
+
+Meshes, materials and animations are stored already encoded, keyed by a
+fingerprint of everything they are built from (geometry, modifier stack,
+node tree, f-curves, NLA strips, constraints, drivers, export options) and
+of the state of the objects and textures their modifiers and constraints
+reference.
+Meshes with modifiers referencing other data-blocks and animations that
+depend on other animated objects are not cached. Entries are stored without
+their id, ids are unstable between blender sessions and are assigned again
+when an entry is spliced in the output.
+"""
+
+import hashlib
+import json
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+import bpy
+
+from .packed_arrays import strip_field, length_delimited, splice_message
+from .logger import Logger
+
+CACHE_VERSION = 2
+
+# Stand-in for an entity that has been spliced from the cache, only its id is known
+SplicedEntity = namedtuple("SplicedEntity", "id")
+
+
+class ExportCache:
+    """Encoded entities of previous runs, stored in a directory next to the exported file"""
+    # Entries not used for this many runs are removed
+    MAX_UNUSED_RUNS = 8
+
+    def __init__(self, path, assets_path, log=None):
+        self.path = path
+        self.log = log or Logger()
+        self.assets_path = assets_path
+        self.index_file = os.path.join(path, "index.json")
+        self.entries = {}
+        self.run = 0
+        self.hits = 0
+        self.misses = 0
+        if os.path.isfile(self.index_file):
+            try:
+                with open(self.index_file, "r") as f:
+                    index = json.load(f)
+                if index.get("version") == CACHE_VERSION:
+                    self.entries = index["entries"]
+                    self.run = index["run"]
+            except (ValueError, KeyError):
+                self.log.warning("Invalid export cache index %s, it will be rebuilt", self.index_file)
+        self.run += 1
+
+    def _fragments_file(self, key):
+        return os.path.join(self.path, key + ".bin")
+
+    def get(self, key):
+        """Return the [(part, encoded bytes)] stored for key, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            files = [os.path.join(self.assets_path, f) for f in entry["files"]]
+            try:
+                if not all(os.path.exists(f) for f in files):
+                    raise IOError("Missing asset")
+                with open(self._fragments_file(key), "rb") as f:
+                    blob = f.read()
+            except (IOError, OSError):
+                del self.entries[key]
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        fragments = []
+        pos = 0
+        for part in entry["parts"]:
+            size, = struct.unpack_from("<I", blob, pos)
+            pos += 4
+            fragments.append((part, blob[pos:pos + size]))
+            pos += size
+        entry["run"] = self.run
+        self.hits += 1
+        return fragments
+
+    def put(self, key, fragments, files=()):
+        """Store [(part, encoded bytes)] for key. files are the assets (relative to assets_path) they refer to"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._fragments_file(key), "wb") as f:
+            for _, body in fragments:
+                f.write(struct.pack("<I", len(body)))
+                f.write(body)
+        self.entries[key] = {"parts": [part for part, _ in fragments], "files": list(files), "run": self.run}
+
+    def save(self):
+        """Prune the entries that have not been used for a while and write the index"""
+        for key in [k for k, e in self.entries.items() if e["run"] < self.run - self.MAX_UNUSED_RUNS]:
+            del self.entries[key]
+            try:
+                os.remove(self._fragments_file(key))
+            except OSError:
+                pass
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.index_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": CACHE_VERSION, "run": self.run, "entries": self.entries}, f)
+        os.replace(tmp, self.index_file)
+        self.log.info("Export cache: %d hits, %d misses", self.hits, self.misses)
+
+
+def encode_without_id(msg):
+    """Encoded msg, without its id field"""
+    return strip_field(msg.SerializeToString(), msg.DESCRIPTOR.fields_by_name["id"].number)
+
+
+def splice_with_id(parent, field_name, body, entity_id):
+    """Append an entry stored by encode_without_id to parent.<field_name>, with the given id"""
+    id_field = parent.DESCRIPTOR.fields_by_name[field_name].message_type.fields_by_name["id"]
+    tag, value = length_delimited(id_field.number, entity_id.encode("utf-8"))
+    splice_message(parent, field_name, body + tag + value)
+    return SplicedEntity(entity_id)
+
+
+# Fingerprints
+
+def cache_options(cfg):
+    """The export options that change the encoded entities"""
+    return (CACHE_VERSION, cfg.is_preview, cfg.export_tangents, cfg.mikktspace_tangents, cfg.remove_doubles, cfg.weld_epsilon, cfg.max_influences, cfg.textures_to_dds,
+            cfg.keyframe_tolerances, cfg.lod_levels, cfg.lod_ratio, cfg.optimize_vertex_cache,
+            cfg.cluster_threshold, cfg.cluster_max_vertices, cfg.cluster_max_triangles)
+
+
+def _plain(value):
+    """Turn bpy/mathutils values into something with a stable repr"""
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, bpy.types.ID):
+        return ("ID", value.name, getattr(value.library, "filepath", None))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    try:
+        return tuple(_plain(v) for v in value)
+    except TypeError:
+        return repr(value)
+
+
+def hash_value(h, value):
+    h.update(repr(_plain(value)).encode("utf-8"))
+
+
+def hash_attr(h, collection, attr, size, dtype=np.float32):
+    """Hash a whole attribute of a bpy collection, read with foreach_get"""
+    count = len(collection)
+    if count == 0:
+        return
+    out = np.empty(count * size, dtype=dtype)
+    collection.foreach_get(attr, out)
+    h.update(attr.encode("utf-8"))
+    h.update(out.tobytes())
+
+
+def hash_rna(h, struct, depth=1):
+    """Hash the value of every property of a bpy struct (nested structs up to depth, data-blocks by name)"""
+    for prop in struct.bl_rna.properties:
+        ident = prop.identifier
+        if ident == "rna_type" or prop.type == "COLLECTION":
+            continue
+        value = getattr(struct, ident, None)
+        if prop.type == "POINTER" and value is not None and not isinstance(value, bpy.types.ID):
+            if depth > 0:
+                hash_rna(h, value, depth - 1)
+            continue
+        hash_value(h, (ident, value))
+
+
+def hash_image(h, image):
+    hash_value(h, (image.name, image.filepath, image.file_format, image.source))
+    if image.packed_file:
+        h.update(image.packed_file.data)
+    else:
+        try:
+            st = os.stat(bpy.path.abspath(image.filepath))
+            hash_value(h, (st.st_size, st.st_mtime))
+        except OSError:
+            hash_value(h, "missing")
+
+
+def hash_node_tree(h, tree, seen):
+    if tree is None or tree.name in seen:
+        return
+    seen.add(tree.name)
+    for node in tree.nodes:
+        hash_value(h, (node.bl_idname, node.name, node.label))
+        hash_rna(h, node, 0)
+        for socket in node.inputs:
+            hash_value(h, (socket.identifier, getattr(socket, "default_value", None)))
+        if getattr(node, "image", None) is not None:
+            hash_image(h, node.image)
+        hash_node_tree(h, getattr(node, "node_tree", None), seen)
+    for link in tree.links:
+        hash_value(h, (link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier))
+
+
+def hash_mesh_data(h, data):
+    """Hash the geometry of a mesh data-block"""
+    hash_attr(h, data.vertices, "co", 3)
+    hash_attr(h, data.edges, "vertices", 2, np.int32)
+    hash_attr(h, data.edges, "use_edge_sharp", 1, np.bool_)
+    hash_attr(h, data.loops, "vertex_index", 1, np.int32)
+    hash_attr(h, data.polygons, "loop_start", 1, np.int32)
+    hash_attr(h, data.polygons, "loop_total", 1, np.int32)
+    hash_attr(h, data.polygons, "material_index", 1, np.int32)
+    hash_attr(h, data.polygons, "use_smooth", 1, np.bool_)
+
+
+def hash_curve_data(h, data):
+    """Hash the settings and the control points of a curve data-block"""
+    hash_rna(h, data, 0)
+    for spline in data.splines:
+        hash_value(h, (spline.type, spline.use_cyclic_u, spline.order_u, spline.resolution_u))
+        hash_attr(h, spline.points, "co", 4)
+        hash_attr(h, spline.bezier_points, "co", 3)
+        hash_attr(h, spline.bezier_points, "handle_left", 3)
+        hash_attr(h, spline.bezier_points, "handle_right", 3)
+
+
+def hash_target(h, target):
+    """
+    Hash the state of target, a data-block referenced by a modifier or a constraint: the transform
+    of an object and its geometry or pose, the settings and image of a texture.
+    Returns False for the data-blocks that can't be hashed
+    """
+    hash_value(h, ("target", target))
+    if isinstance(target, bpy.types.Object):
+        hash_value(h, target.matrix_world)
+        if target.type == 'MESH':
+            hash_mesh_data(h, target.data)
+            for mod in target.modifiers:
+                hash_rna(h, mod)
+        elif target.type in ('CURVE', 'SURFACE'):
+            hash_curve_data(h, target.data)
+        elif target.type == 'LATTICE':
+            hash_attr(h, target.data.points, "co_deform", 3)
+        elif target.type == 'ARMATURE':
+            hash_value(h, [pbone.matrix for pbone in target.pose.bones])
+        return True
+    if isinstance(target, bpy.types.Texture):
+        hash_rna(h, target)
+        if getattr(target, "image", None) is not None:
+            hash_image(h, target.image)
+        return True
+    if isinstance(target, bpy.types.Image):
+        hash_image(h, target)
+        return True
+    return False
+
+
+def referenced_ids(struct):
+    """The data-blocks referenced by the properties of a bpy struct"""
+    for prop in struct.bl_rna.properties:
+        if prop.type == "POINTER":
+            value = getattr(struct, prop.identifier, None)
+            if isinstance(value, bpy.types.ID):
+                yield value
+
+
+def mesh_fingerprint(obj, cfg):
+    """
+    Fingerprint of everything export_meshes reads: geometry, modifier stack (and the state of the
+    data-blocks it references) and skinning. None if the meshes of obj can't be cached
+    """
+    h = hashlib.sha1()
+    data = obj.data
+    hash_value(h, ("mesh", data.name, data.library, cache_options(cfg)))
+    hash_mesh_data(h, data)
+    for layer in data.uv_layers:
+        hash_value(h, layer.name)
+        hash_attr(h, layer.data, "uv", 2)
+    for layer in data.vertex_colors:
+        hash_value(h, (layer.name, layer.active))
+        hash_attr(h, layer.data, "color", len(layer.data[0].color) if len(layer.data) else 3)
+    if data.shape_keys is not None:
+        for key_block in data.shape_keys.key_blocks:
+            hash_value(h, (key_block.name, key_block.value, key_block.mute))
+            hash_attr(h, key_block.data, "co", 3)
+    if len(obj.vertex_groups) > 0:
+        hash_value(h, [g.name for g in obj.vertex_groups])
+        hash_value(h, [[(g.group, g.weight) for g in v.groups] for v in data.vertices])
+    armature = obj.find_armature()
+    relative = False
+    for mod in obj.modifiers:
+        hash_rna(h, mod)
+        for target in referenced_ids(mod):
+            if target == armature:
+                # Skinned, the rest pose is hashed below
+                continue
+            if not hash_target(h, target):
+                return None
+            relative = True
+    if relative:
+        # Targets are applied relative to the object (Mirror, Boolean, Hook...)
+        hash_value(h, obj.matrix_world)
+    if armature is not None:
+        # The rest pose the vertices are bound to
+        hash_value(h, [(b.name, b.parent.name if b.parent is not None else None, b.matrix_local) for b in armature.data.bones])
+    return "mesh_" + h.hexdigest()
+
+
+def material_fingerprint(mat, cfg):
+    """Fingerprint of a material node tree, including the images it uses"""
+    h = hashlib.sha1()
+    hash_value(h, ("material", mat.name, mat.library, cache_options(cfg)))
+    hash_node_tree(h, mat.node_tree, set())
+    return "material_" + h.hexdigest()
+
+
+def hash_constraints(h, constraints, owner):
+    """Hash the settings of constraints of owner and the state of their targets"""
+    for c in constraints:
+        hash_rna(h, c)
+        targets = list(referenced_ids(c))
+        for t in getattr(c, "targets", ()):
+            hash_rna(h, t)
+            if t.target is not None:
+                targets.append(t.target)
+        for target in targets:
+            # The state of owner changes with the sampled frame, its action is hashed
+            if target != owner:
+                hash_target(h, target)
+
+
+def hash_fcurve_modifiers(h, fcurve):
+    for mod in fcurve.modifiers:
+        hash_rna(h, mod)
+        if hasattr(mod, "control_points"):
+            hash_value(h, [(p.frame, p.min, p.max) for p in mod.control_points])
+
+
+def hash_fcurve(h, fcurve):
+    hash_value(h, (fcurve.data_path, fcurve.array_index, fcurve.extrapolation, fcurve.mute))
+    hash_fcurve_modifiers(h, fcurve)
+    hash_attr(h, fcurve.keyframe_points, "co", 2)
+    hash_attr(h, fcurve.keyframe_points, "handle_left", 2)
+    hash_attr(h, fcurve.keyframe_points, "handle_right", 2)
+    hash_value(h, [k.interpolation for k in fcurve.keyframe_points])
+
+
+def hash_action(h, action):
+    """Hash the frame range and the f-curves of an action"""
+    hash_value(h, (action.name, action.id_root, action.frame_range))
+    for fcurve in action.fcurves:
+        hash_fcurve(h, fcurve)
+
+
+def hash_nla(h, animation_data, action):
+    """Hash the active action and the NLA tracks of animation_data, with the actions other than action"""
+    hash_value(h, (animation_data.action, animation_data.action_blend_type, animation_data.action_influence,
+                   animation_data.action_extrapolation, animation_data.use_nla))
+    actions = [animation_data.action]
+    for track in animation_data.nla_tracks:
+        hash_value(h, (track.name, track.mute, track.is_solo))
+        for strip in track.strips:
+            hash_value(h, (strip.name, strip.action, strip.action_frame_start, strip.action_frame_end,
+                           strip.frame_start, strip.frame_end, strip.scale, strip.repeat, strip.use_reverse,
+                           strip.blend_type, strip.blend_in, strip.blend_out, strip.extrapolation,
+                           strip.influence, strip.use_animated_influence, strip.mute))
+            # Animated influence and time
+            for fcurve in strip.fcurves:
+                hash_fcurve(h, fcurve)
+            actions.append(strip.action)
+    for other in actions:
+        if other is not None and other != action:
+            hash_action(h, other)
+
+
+def action_fingerprint(obj, action, name, fps, cfg):
+    """
+    Fingerprint of an action sampled on obj: f-curves and their modifiers, frame range, rest pose,
+    constraints, drivers and the other actions and NLA strips of obj, that are evaluated with it.
+    Only valid if obj doesn't depend on other animated objects (see bake_scheduler.depends_on_others),
+    the baked samples would change with their actions
+    """
+    h = hashlib.sha1()
+    hash_value(h, ("action", name, fps, obj.type, cache_options(cfg)))
+    hash_action(h, action)
+    if obj.type == 'ARMATURE':
+        for bone in obj.data.bones:
+            hash_value(h, (bone.name, bone.parent.name if bone.parent else None, bone.matrix_local))
+    hash_constraints(h, obj.constraints, obj)
+    if obj.pose is not None:
+        for pbone in obj.pose.bones:
+            hash_value(h, pbone.name)
+            hash_constraints(h, pbone.constraints, obj)
+    if obj.animation_data is not None:
+        hash_nla(h, obj.animation_data, action)
+        for driver in obj.animation_data.drivers:
+            hash_value(h, (driver.data_path, driver.array_index, driver.mute, driver.driver.type, driver.driver.expression))
+            hash_fcurve_modifiers(h, driver)
+            hash_attr(h, driver.keyframe_points, "co", 2)
+            for var in driver.driver.variables:
+                hash_value(h, (var.name, var.type))
+                for t in var.targets:
+                    hash_value(h, (t.id, t.data_path, t.bone_target, t.transform_type, t.transform_space))
+    return "action_" + h.hexdigest()
@@ -0,0 +1,217 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Encoding of the columnar data built by the exporter (meshes, sampled transforms)
+into f3b messages. Doesn't use bpy, so it is shared by the exporter and the
+offline converter of the scene snapshots (see snapshot.py).
+"""
+
+import hashlib
+
+import f3b
+import f3b.datas_pb2
+import numpy as np
+
+from .packed_arrays import write_array
+from .keyframe_reduction import reduce_keys
+from .transform_samples import changed_samples, decompose
+
+
+def export_mesh_arrays(mesh, dst_mesh):
+    """Write a columnar Mesh (see extract_meshdata) into dst_mesh"""
+    positions = dst_mesh.vertexArrays.add()
+    positions.attrib = f3b.datas_pb2.VertexArray.position
+    positions.floats.step = 3
+    write_array(positions.floats, "values", mesh.positions)
+
+    normals = dst_mesh.vertexArrays.add()
+    normals.attrib = f3b.datas_pb2.VertexArray.normal
+    normals.floats.step = 3
+    write_array(normals.floats, "values", mesh.normals)
+
+    indexes = dst_mesh.indexArrays.add()
+    indexes.ints.step = 3
+    write_array(indexes.ints, "values", mesh.indexes)
+
+    texcoords_ids=[f3b.datas_pb2.VertexArray.texcoord,f3b.datas_pb2.VertexArray.texcoord2,f3b.datas_pb2.VertexArray.texcoord3,f3b.datas_pb2.VertexArray.texcoord4,f3b.datas_pb2.VertexArray.texcoord5,f3b.datas_pb2.VertexArray.texcoord6,f3b.datas_pb2.VertexArray.texcoord7,f3b.datas_pb2.VertexArray.texcoord8]
+    tangents_ids=[f3b.datas_pb2.VertexArray.tangent,f3b.datas_pb2.VertexArray.tangent2,f3b.datas_pb2.VertexArray.tangent3,f3b.datas_pb2.VertexArray.tangent4,f3b.datas_pb2.VertexArray.tangent5,f3b.datas_pb2.VertexArray.tangent6,f3b.datas_pb2.VertexArray.tangent7,f3b.datas_pb2.VertexArray.tangent8]
+
+    for i,tx in enumerate(mesh.texcoords):
+        texcoords = dst_mesh.vertexArrays.add()
+        texcoords.attrib = texcoords_ids[i]
+        texcoords.floats.step = 2
+        write_array(texcoords.floats, "values", tx)
+        if i < len(mesh.tangents):
+            tangents = dst_mesh.vertexArrays.add()
+            tangents.attrib = tangents_ids[i]
+            tangents.floats.step = 4
+            write_array(tangents.floats, "values", mesh.tangents[i])
+
+    if mesh.colors is not None:
+        colors = dst_mesh.vertexArrays.add()
+        colors.attrib = f3b.datas_pb2.VertexArray.color
+        colors.floats.step = 4
+        write_array(colors.floats, "values", mesh.colors)
+
+    if mesh.has_skin:
+        dst_skin=dst_mesh.skin
+        write_array(dst_skin, "boneCount", mesh.skin.boneCount)
+        write_array(dst_skin, "boneIndex", mesh.skin.boneIndex)
+        write_array(dst_skin, "boneWeight", mesh.skin.boneWeight)
+
+
+
+def lod_id(base_id, level):
+    """id of the LOD level of the mesh base_id"""
+    return "%s_lod%d" % (base_id, level)
+
+
+def export_lod(mesh, dst_mesh, base_id, base_name, level):
+    """Write the columnar Mesh of the LOD level of the mesh base_id into dst_mesh"""
+    dst_mesh.primitive = f3b.datas_pb2.Mesh.triangles
+    dst_mesh.id = lod_id(base_id, level)
+    dst_mesh.name = "%s_lod%d" % (base_name, level)
+    export_mesh_arrays(mesh, dst_mesh)
+
+
+def link_lod(data, base_id, level, screen_size):
+    """
+    Relate the LOD level of the mesh base_id to it, with custom params for its level and the
+    screen size below which it replaces the previous level (see simplify.lod_screen_size)
+    """
+    mesh_id = lod_id(base_id, level)
+    custom_params = data.custom_params.add()
+    custom_params.id = "params_" + mesh_id
+    param = custom_params.params.add()
+    param.name = "lod_level"
+    param.vint = level
+    param = custom_params.params.add()
+    param.name = "lod_screen_size"
+    param.vfloat = screen_size
+    for ref1, ref2 in ((mesh_id, base_id), (custom_params.id, mesh_id)):
+        rel = data.relations.add()
+        rel.ref1 = ref1
+        rel.ref2 = ref2
+
+
+def clusters_id(mesh_id):
+    """id of the custom params with the cluster bounds of the mesh mesh_id"""
+    return "clusters_" + mesh_id
+
+
+# Columns of the rows of the cluster files (name, little endian type, size), in order: the range of
+# triangles of the cluster in the index array of its mesh, then its bounds (see meshlets.cluster_bounds)
+CLUSTER_COLUMNS = (("first_triangle", "u4", 1), ("triangles", "u4", 1),
+                   ("aabb_min", "f4", 3), ("aabb_max", "f4", 3), ("sphere_center", "f4", 3), ("sphere_radius", "f4", 1),
+                   ("cone_axis", "f4", 3), ("cone_apex", "f4", 3), ("cone_cutoff", "f4", 1))
+
+
+def pack_clusters(offsets, bounds):
+    """The clusters with the offsets in the triangles of their mesh and the bounds of meshlets.cluster_mesh, as rows of CLUSTER_COLUMNS"""
+    offsets = np.asarray(offsets)
+    columns = dict(bounds, first_triangle=offsets[:-1], triangles=np.diff(offsets))
+    rows = np.zeros(len(offsets) - 1, dtype=[(name, "<" + kind, (size,)) for name, kind, size in CLUSTER_COLUMNS])
+    for name, _, size in CLUSTER_COLUMNS:
+        rows[name] = np.asarray(columns[name]).reshape(-1, size)
+    return rows.tobytes()
+
+
+def clusters_rpath(body):
+    """rpath of the cluster file with the content body, named after it so it is stable between exports"""
+    return "Clusters/" + hashlib.sha1(body).hexdigest() + ".bin"
+
+
+def export_clusters(data, mesh_id, count, rpath):
+    """
+    Relate the clusters of the mesh mesh_id, written by pack_clusters in the asset rpath, to it with the custom
+    params clusters (their number), clusters_rpath and clusters_layout (the columns of the file, as name:type:size).
+    Returns the custom params
+    """
+    custom_params = data.custom_params.add()
+    custom_params.id = clusters_id(mesh_id)
+    param = custom_params.params.add()
+    param.name = "clusters"
+    param.vint = count
+    param = custom_params.params.add()
+    param.name = "clusters_rpath"
+    param.vstring = rpath
+    param = custom_params.params.add()
+    param.name = "clusters_layout"
+    param.vstring = ",".join("%s:%s:%d" % column for column in CLUSTER_COLUMNS)
+    rel = data.relations.add()
+    rel.ref1 = custom_params.id
+    rel.ref2 = mesh_id
+    return custom_params
+
+
+def bounds_id(entity_id):
+    """id of the custom params with the bounds of the entity entity_id"""
+    return "bounds_" + entity_id
+
+
+def export_bounds(data, entity_id, bounds, related=True):
+    """
+    Write bounds (see bounds.py) as the custom params aabb_min, aabb_max, sphere_center and sphere_radius,
+    related to the entity entity_id if related. Returns the custom params
+    """
+    custom_params = data.custom_params.add()
+    custom_params.id = bounds_id(entity_id)
+    for name in ("aabb_min", "aabb_max", "sphere_center"):
+        param = custom_params.params.add()
+        param.name = name
+        param.vvec3.x, param.vvec3.y, param.vvec3.z = getattr(bounds, name).tolist()
+    param = custom_params.params.add()
+    param.name = "sphere_radius"
+    param.vfloat = bounds.sphere_radius
+    if related:
+        rel = data.relations.add()
+        rel.ref1 = custom_params.id
+        rel.ref2 = entity_id
+    return custom_params
+
+
+def store_sampled_transform(dst, times, mats, tolerances=None):
+    """
+    Write the samples mats [n,4,4] taken at times [n] to the sampled_transform dst:
+    repeated samples are removed, the others are decomposed, converted to y up
+    and, with tolerances, reduced to the keys that can't be interpolated.
+    """
+    keep = changed_samples(mats, 0.000001)
+    times = times[keep]
+    loc, quat, sca = decompose(mats[keep])
+    translations = np.column_stack((loc[:, 0], loc[:, 2], -loc[:, 1]))
+    rotations = np.column_stack((quat[:, 0], quat[:, 1], quat[:, 3], -quat[:, 2]))
+    scales = np.column_stack((sca[:, 0], sca[:, 2], sca[:, 1]))
+    if tolerances is not None:
+        keep = reduce_keys(times, translations, rotations, scales, tolerances)
+        times = times[keep]
+        translations = translations[keep]
+        rotations = rotations[keep]
+        scales = scales[keep]
+    write_array(dst, "at", times)
+    write_array(dst, "translation_x", translations[:, 0])
+    write_array(dst, "translation_y", translations[:, 1])
+    write_array(dst, "translation_z", translations[:, 2])
+    write_array(dst, "scale_x", scales[:, 0])
+    write_array(dst, "scale_y", scales[:, 1])
+    write_array(dst, "scale_z", scales[:, 2])
+    write_array(dst, "rotation_w", rotations[:, 0])
+    write_array(dst, "rotation_x", rotations[:, 1])
+    write_array(dst, "rotation_y", rotations[:, 2])
+    write_array(dst, "rotation_z", rotations[:, 3])
+    return len(times)
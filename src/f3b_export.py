@@ -16,7 +16,6 @@
 # <pep8 compliant>
 
 import mathutils
-import bpy_extras
 import math
 import f3b
 import f3b.datas_pb2
@@ -27,10 +26,25 @@ import f3b.physics_pb2
 from . import helpers 
 from .utils import * 
 from .exporter_utils import *
+from .scene_index import index_of
+from .export_cache import *
+from .asset_manifest import AssetManifest
+from .keyframe_reduction import Tolerances
+from .f3b_encode import export_mesh_arrays, store_sampled_transform, export_lod, link_lod, lod_id, export_clusters, clusters_id, pack_clusters, clusters_rpath, export_bounds
+from .simplify import LodQueue, lod_screen_size
+from .vertex_cache import Report as VertexCacheReport
+from .meshlets import cluster_mesh
+from .bounds import points_bounds, transform_bounds, merge_bounds, yup_matrix, pack_bounds, unpack_bounds
+from .snapshot import SnapshotWriter, snapshot_path
+from .bake_scheduler import BakeJob, bake, frame_to_time, depends_on_others
+from .data_writer import DataWriter
+from .profiler import Profiler, profiled
+from .logger import Logger, LEVELS
+from .dds_scheduler import DDSScheduler, DDSCache, default_workers
 
 import re,os
-import subprocess
-from  concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import hashlib
 
 DDS_SUPPORT=False
 DDS_WRITER_PATH=os.path.dirname(__file__)+"/bin/DDSWriter."
@@ -42,7 +56,7 @@ else:
     DDS_SUPPORT=True
 
 class ExportCfg:
-    def __init__(self, is_preview=False, assets_path="/tmp",option_export_selection=False,textures_to_dds=False,export_tangents=False,remove_doubles=False):
+    def __init__(self, is_preview=False, assets_path="/tmp",option_export_selection=False,textures_to_dds=False,export_tangents=False,mikktspace_tangents=True,remove_doubles=False,weld_epsilon=0.0,max_influences=0,lod_levels=0,lod_ratio=0.5,lod_screen_size=0.5,optimize_vertex_cache=False,cluster_threshold=0,cluster_max_vertices=64,cluster_max_triangles=124,export_bounds=True,bulk_extraction=True,dds_workers=0,dds_memory=2000,keyframe_tolerances=None,log=None):
         self.is_preview = is_preview
         self.assets_path = bpy.path.abspath(assets_path)
         self._modified = {}
@@ -50,7 +64,35 @@ class ExportCfg:
         self.option_export_selection=option_export_selection
         self.textures_to_dds=textures_to_dds
         self.export_tangents=export_tangents
+        self.mikktspace_tangents=mikktspace_tangents
         self.remove_doubles=remove_doubles
+        self.weld_epsilon=weld_epsilon
+        self.max_influences=max_influences
+        self.lod_levels=lod_levels
+        self.lod_ratio=lod_ratio
+        self.lod_screen_size=lod_screen_size
+        self.optimize_vertex_cache=optimize_vertex_cache
+        self.cluster_threshold=cluster_threshold
+        self.cluster_max_vertices=cluster_max_vertices
+        self.cluster_max_triangles=cluster_max_triangles
+        self.export_bounds=export_bounds
+        self.bulk_extraction=bulk_extraction
+        self.keyframe_tolerances=keyframe_tolerances
+        self.scene_index=None
+        self.cache=None
+        self.writer=None
+        self.snapshot=None
+        self.lods=LodQueue(lod_levels,lod_ratio) if lod_levels>0 else None
+        self.lod_cache_entries={}
+        self.cluster_params={}
+        self.mesh_bounds={}
+        self.object_bounds=[]
+        self.vertex_cache=VertexCacheReport() if optimize_vertex_cache else None
+        self.profiler=Profiler()
+        self.log=log or Logger()
+        self.assets=AssetManifest(self.assets_path,self.log)
+        self.dds_cache=DDSCache(self.assets_path,self.log)
+        self.dds_queue=DDSScheduler(DDS_WRITER_PATH,dds_workers,dds_memory,cache=self.dds_cache,log=self.log)
 
     def _k_of(self, v):
         # hash(v) or id(v) ?
@@ -72,27 +114,41 @@ class ExportCfg:
         self._modified[k] = modified
         return old
 
-    def info(self, txt):
-        print("INFO: " + txt)
+    def new_entry(self, data, field_name):
+        """New entry of data.<field_name>, that has to be passed to entry_done() once complete"""
+        if self.writer is None:
+            return getattr(data, field_name).add()
+        return self.writer.entry(data, field_name)
 
-    def warning(self, txt):
-        print("WARNING: " + txt)
+    def entry_done(self, data, field_name, entry):
+        if self.writer is not None:
+            self.writer.done(data, field_name, entry)
 
-    def error(self, txt):
-        print("ERROR: " + txt)
+    def flush(self, data):
+        """The entries of data are complete, write them now if the output is streamed"""
+        if self.writer is not None:
+            self.writer.flush(data)
 
+    def info(self, txt, *args):
+        self.log.info(txt, *args)
 
+    def warning(self, txt, *args):
+        self.log.warning(txt, *args)
+
+    def error(self, txt, *args):
+        self.log.error(txt, *args)
+
+
+@profiled
 def export_all_forcefields(scene,data,cfg):
     if scene.use_gravity:
         force_field=data.cr_forcefields.add()
         force_field.id="sceneGravity"
         cnv_vec3(cnv_toVec3ZupToYup(scene.gravity), force_field.gravity.strength)
 
+@profiled
 def export_all_collisionplane(scene,data,cfg):
-    for obj in scene.objects:
-        if  obj.type!= 'MESH' or obj.hide_render or (cfg.option_export_selection and not obj.select):
-            #print("Skip ",obj,"not selected/render disabled")
-            continue
+    for obj in index_of(scene, cfg).colliders:
         for m in obj.modifiers:
             if m.type == "COLLISION":
                 cfg.need_update(obj)
@@ -121,25 +177,30 @@ def export_all_collisionplane(scene,data,cfg):
         
 
 def export(scene, data, cfg):
-    if hasattr(f3b.datas_pb2.Data,"cr_collisionplanes") :export_all_collisionplane(scene, data, cfg)
-    export_all_tobjects(scene, data, cfg)
-    if hasattr(f3b.datas_pb2.Data,"cr_emitters")  : export_all_emitters(scene,data,cfg)
-    export_all_speakers(scene, data, cfg)
-    export_all_geometries(scene, data, cfg)
-    export_all_materials(scene, data, cfg)
-    export_all_lights(scene, data, cfg)
-    export_all_skeletons(scene, data, cfg)
-    export_all_actions(scene, data, cfg)
-    export_all_physics(scene, data, cfg)
-    if hasattr(f3b.datas_pb2.Data,"cr_forcefields"): export_all_forcefields(scene,data,cfg)
-
-
-
+    index_of(scene, cfg)
+    stages = []
+    if hasattr(f3b.datas_pb2.Data,"cr_collisionplanes") :stages.append(export_all_collisionplane)
+    stages.append(export_all_tobjects)
+    if hasattr(f3b.datas_pb2.Data,"cr_emitters")  : stages.append(export_all_emitters)
+    stages.append(export_all_speakers)
+    stages.append(export_all_geometries)
+    stages.append(export_all_materials)
+    stages.append(export_all_lights)
+    stages.append(export_all_skeletons)
+    stages.append(export_all_actions)
+    stages.append(export_all_physics)
+    if hasattr(f3b.datas_pb2.Data,"cr_forcefields"): stages.append(export_all_forcefields)
+    for stage in stages:
+        with cfg.log.stage(stage.__name__):
+            stage(scene, data, cfg)
+            with cfg.profiler.phase("write"):
+                cfg.flush(data)
+
+
+
+@profiled
 def export_all_tobjects(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-           # print("Skip ",obj,"not selected/render disabled")
-            continue
+    for obj in index_of(scene, cfg).objects:
         if cfg.need_update(obj):
             tobject = data.tobjects.add()
             tobject.id = cfg.id_of(obj)
@@ -161,13 +222,12 @@ def export_all_tobjects(scene, data, cfg):
                  cfg.id_of(obj.parent), cfg.id_of(obj), cfg)
             export_obj_customproperties(obj, tobject, data, cfg)
         else:
-            print("Skip ",obj,"already exported")
+            cfg.log.debug("Skip %s already exported", obj)
 
 
+@profiled
 def export_all_physics(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            continue
+    for obj in index_of(scene, cfg).physics:
         phy_data = None
         phy_data = export_rb(obj, phy_data, data, cfg)
         export_rbct(obj, phy_data, data, cfg)
@@ -312,6 +372,7 @@ def export_rb(ob, phy_data, data, cfg):
     add_relation_raw(data.relations,rigidbody.id, cfg.id_of(ob), cfg)
     return phy_data
 
+@profiled
 def export_audio(src, dst, cfg):
     base_name=src.name
     ext="."+src.filepath.lower().split(".")[-1]
@@ -321,58 +382,44 @@ def export_audio(src, dst, cfg):
         ext="."+src.name.lower().split(".")[-1]
 
     origin_file=bpy.path.abspath(src.filepath)
-    print("Base sound name",base_name,"assets path",cfg.assets_path)
-    output_file=os.path.join(cfg.assets_path,"Sounds",base_name)+ext  
-    print("Write sound in",output_file)
+    rpath="Sounds/"+base_name+ext
+    cfg.log.debug("Write sound %s in %s", base_name, rpath)
 
-    output_parent=os.path.dirname(output_file)
-        
     is_packed=src.packed_file
 
     if cfg.need_update(src):       
-    
-        if not os.path.exists(output_parent):
-            os.makedirs(output_parent)
-          
         if is_packed:
-            print(base_name,"is packed inside the blend file. It will be extracted in",output_file)
-            with open(output_file, 'wb') as f:
-                f.write(src.packed_file.data)
+            cfg.log.debug("%s is packed inside the blend file. It will be extracted in %s", base_name, rpath)
+            rpath=cfg.assets.write_bytes(src.packed_file.data,rpath,base_name)
         else:
-            print(origin_file,"will be copied in",output_file)
-            import shutil
-            if origin_file != output_file:
-                shutil.copyfile(origin_file, output_file)            
+            cfg.log.debug("%s will be copied in %s", origin_file, rpath)
+            rpath=cfg.assets.copy_file(origin_file,rpath)
     else:
-        print(base_name,"already up to date")
-    dst.rpath = "Sounds/"+base_name+ext
-    print("Set rpath to", dst.rpath)
+        cfg.log.debug("%s already up to date", base_name)
+        rpath=cfg.assets.resolve(rpath)
+    dst.rpath = rpath
+    cfg.log.debug("Set rpath to %s", dst.rpath)
 
+@profiled
 def export_all_speakers(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            #print("Skip ",obj,"not selected/render disabled")
-            continue
-        if obj.type == 'SPEAKER':
-            if cfg.need_update(obj.data):
-                dst_speaker = data.speakers.add()
-                dst_speaker.id = cfg.id_of(obj.data)
-                dst_speaker.name = obj.name
-                export_audio(obj.data.sound,dst_speaker,cfg)
-                dst_speaker.volume = obj.data.volume
-                dst_speaker.pitch = obj.data.pitch
-                dst_speaker.distance_max=obj.data.distance_max
-                dst_speaker.distance_reference=obj.data.distance_reference
-                dst_speaker.attenuation = obj.data.attenuation
-            add_relation_raw(data.relations,  
-            cfg.id_of(obj.data),  cfg.id_of(obj),cfg)
+    for obj in index_of(scene, cfg).of_type('SPEAKER'):
+        if cfg.need_update(obj.data):
+            dst_speaker = data.speakers.add()
+            dst_speaker.id = cfg.id_of(obj.data)
+            dst_speaker.name = obj.name
+            export_audio(obj.data.sound,dst_speaker,cfg)
+            dst_speaker.volume = obj.data.volume
+            dst_speaker.pitch = obj.data.pitch
+            dst_speaker.distance_max=obj.data.distance_max
+            dst_speaker.distance_reference=obj.data.distance_reference
+            dst_speaker.attenuation = obj.data.attenuation
+        add_relation_raw(data.relations,  
+        cfg.id_of(obj.data),  cfg.id_of(obj),cfg)
 
   
+@profiled
 def export_all_emitters(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            #print("Skip ",obj,"not selected/render disabled")
-            continue
+    for obj in index_of(scene, cfg).emitters:
         for i in range(len(obj.particle_systems)):
             src_p = obj.particle_systems[i] #Emitter
             src_e = src_p.settings #Settings
@@ -381,7 +428,7 @@ def export_all_emitters(scene, data, cfg):
                 dst_e = data.cr_emitters.add()
                 dst_e.id=cfg.id_of(obj)+"_em_"+str(i)
                 dst_e.name=src_e.name
-                print("Export particle emitter " +src_e.name)
+                cfg.log.debug("Export particle emitter %s", src_e.name)
                 # fps=(1.0/src_e.timestep)
                 frame_end=src_e.frame_end
                 frame_start=src_e.frame_start
@@ -455,51 +502,96 @@ def export_all_emitters(scene, data, cfg):
                                
             add_relation_raw(data.relations,    cfg.id_of(obj),  dst_e.id,cfg)
 
+@profiled
 def export_all_geometries(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            #sprint("Skip ",obj,"not selected/render disabled")
-            continue
-        if obj.type == 'MESH':
-            if len(obj.data.polygons) != 0 and cfg.need_update(obj.data):
-                meshes = export_meshes(obj, data.meshes, scene, cfg)
-                for material_index, mesh in meshes.items():
-                    # several object can share the same mesh
-                    for obj2 in scene.objects:
-                        if obj2.data == obj.data: 
-                            add_relation_raw(data.relations, 
-                            
-                             mesh.id,cfg.id_of(obj2), cfg)
-                    if material_index > -1 and material_index < len(obj.material_slots):
-                        src_mat = obj.material_slots[material_index].material
-                        add_relation_raw(data.relations,   cfg.id_of(src_mat),mesh.id, cfg)
-            else:
-                print("Skip ",obj,"already exported")
+    index = index_of(scene, cfg)
+    for obj in index.of_type('MESH'):
+        if len(obj.data.polygons) != 0 and cfg.need_update(obj.data):
+            meshes = export_meshes_cached(obj, data, scene, cfg)
+            # several object can share the same mesh
+            users = index.users_of(obj.data)
+            for material_index, mesh in meshes.items():
+                for obj2 in users:
+                    add_relation_raw(data.relations, mesh.id,cfg.id_of(obj2), cfg)
+                if material_index > -1 and material_index < len(obj.material_slots):
+                    src_mat = obj.material_slots[material_index].material
+                    add_relation_raw(data.relations,   cfg.id_of(src_mat),mesh.id, cfg)
+            if cfg.export_bounds:
+                for obj2 in users:
+                    export_object_bounds(obj2, [cfg.mesh_bounds.get(mesh.id) for mesh in meshes.values()], data, cfg)
+            # The chains already done are written now, so with streaming only the pending ones stay in memory
+            export_all_lods(data, cfg, wait=False)
+            cfg.flush(data)
+        else:
+            cfg.log.debug("Skip %s already exported", obj)
+    export_all_lods(data, cfg)
+    if cfg.export_bounds and cfg.object_bounds:
+        export_bounds(data, "scene", merge_bounds(cfg.object_bounds), related=False)
+    if cfg.vertex_cache is not None:
+        cfg.info("Vertex cache: %s", cfg.vertex_cache.summary())
+
+
+def export_object_bounds(obj, mesh_bounds, data, cfg):
+    """Export the world bounds of obj, from the bounds of its meshes"""
+    matrix = yup_matrix(obj.matrix_world)
+    bounds = merge_bounds([transform_bounds(b, matrix) for b in mesh_bounds if b is not None])
+    if bounds is not None:
+        export_bounds(data, cfg.id_of(obj), bounds)
+        cfg.object_bounds.append(bounds)
 
 
+@profiled
+def export_all_lods(data, cfg, wait=True):
+    """
+    Write the LOD chains computed while the geometries are exported, related to their base meshes.
+    Without wait, only the chains already done, so they are written (streamed) along with the geometries
+    """
+    if cfg.lods is None:
+        return
+    for (base_id, base_name, material_index, geometry_id), chain in cfg.lods.results(wait):
+        cached = cfg.lod_cache_entries.get(geometry_id)
+        for level, mesh in enumerate(chain, 1):
+            if cfg.vertex_cache is not None:
+                mesh = optimize_vertex_cache(mesh, "%s_lod%d" % (base_name, level), cfg)
+            dst = data.meshes.add()
+            export_lod(mesh, dst, base_id, base_name, level)
+            link_lod(data, base_id, level, lod_screen_size(cfg.lod_screen_size, cfg.lod_ratio, level))
+            cfg.profiler.count("lod_meshes")
+            cfg.profiler.count("lod_indices", len(mesh.indexes))
+            if cached is not None:
+                cached[1].append(("%d_lod%d" % (material_index, level), encode_without_id(dst)))
+        if cfg.log.debug_enabled:
+            cfg.log.debug("Mesh %s: %d LODs, %s indices", base_name, len(chain), [len(mesh.indexes) for mesh in chain])
+        if cached is not None and not lods_pending(cfg, geometry_id):
+            # The cache entry of the geometry is complete with its LODs
+            cfg.cache.put(*cfg.lod_cache_entries.pop(geometry_id))
+
+
+def lods_pending(cfg, geometry_id):
+    """Whether LOD chains of the meshes of geometry_id are still to be written"""
+    return any(key[3] == geometry_id for key in cfg.lods.keys())
+
+
+@profiled
 def export_all_materials(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            continue
-        if obj.type == 'MESH':
-            for i in range(len(obj.material_slots)):
-                src_mat = obj.material_slots[i].material
-                if cfg.need_update(src_mat):
-                    dst_mat = data.materials.add()
-                    export_material(src_mat, dst_mat, cfg)
-    if DDS_SUPPORT and cfg.textures_to_dds: exportDDSs()
+    for src_mat in index_of(scene, cfg).materials:
+        if cfg.need_update(src_mat):
+            export_material_cached(src_mat, data, cfg)
+            cfg.flush(data)
+    if DDS_SUPPORT and cfg.textures_to_dds:
+        cfg.profiler.count("dds_textures", len(cfg.dds_queue.jobs))
+        with cfg.profiler.phase("dds_conversion"):
+            cfg.dds_queue.run()
 
 
+@profiled
 def export_all_lights(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.hide_render or (cfg.option_export_selection and not obj.select):
-            continue
-        if obj.type == 'LAMP':
-            src_light = obj.data
-            if cfg.need_update(src_light):
-                dst_light = data.lights.add()
-                export_light(src_light, dst_light, cfg)
-            add_relation_raw(data.relations,  cfg.id_of(src_light),cfg.id_of(obj), cfg)
+    for obj in index_of(scene, cfg).of_type('LAMP'):
+        src_light = obj.data
+        if cfg.need_update(src_light):
+            dst_light = data.lights.add()
+            export_light(src_light, dst_light, cfg)
+        add_relation_raw(data.relations,  cfg.id_of(src_light),cfg.id_of(obj), cfg)
 
 
 
@@ -511,14 +603,22 @@ def add_relation_raw(relations ,ref1,ref2, cfg):
     # if t1 <= t2:
     rel.ref1 = ref1
     rel.ref2 = ref2
-    cfg.info("add relation: '%s' to '%s'" % ( ref1, ref2))
+    cfg.profiler.count("relations")
+    if cfg.log.debug_enabled:
+        cfg.log.debug("add relation: '%s' to '%s'", ref1, ref2)
     # else:
         # rel.ref1 = ref2
         # rel.ref2 = ref1
         # cfg.info("add relation: '%s'(%s) to '%s'(%s)" % (t2, ref2, t1, ref1))
 
 
-def export_meshes(src_geometry, meshes, scene, cfg):
+@profiled
+def export_meshes(src_geometry, meshes, scene, cfg, data=None):
+    """
+    Export the sub mesh of each material of src_geometry in meshes.
+    data is the Data of the scene meshes, where their clusters are written and for which LODs are queued in cfg.lods
+    (None for the meshes of the emitters)
+    """
     mode = 'PREVIEW' if cfg.is_preview else 'RENDER'
     # Set up modifiers whether to apply deformation or not
     # tips from https://code.google.com/p/blender-cod/source/browse/blender_26/export_xmodel.py#185
@@ -538,7 +638,8 @@ def export_meshes(src_geometry, meshes, scene, cfg):
     # FIXME apply transform for mesh under armature modify the blender data !!
     # if src_geometry.find_armature():
     #     apply_transform(src_geometry)
-    src_mesh = src_geometry.to_mesh(scene, True, mode, True, False)
+    with cfg.profiler.phase("to_mesh"):
+        src_mesh = src_geometry.to_mesh(scene, True, mode, True, False)
     # Restore modifier settings
     for mod in mod_armature:
         setattr(mod[0], mod_state_attr, mod[1])
@@ -552,68 +653,60 @@ def export_meshes(src_geometry, meshes, scene, cfg):
         if material_index not in dstMap:
             dstMap[material_index] = meshes.add()
 
+    #Collect mesh data of all the materials in one pass
+    submeshes = None
+    if cfg.snapshot is not None:
+        # Captured as is, the sub meshes are built by the snapshot converter
+        with cfg.profiler.phase("extract_meshdata"):
+            arrays=read_mesh_arrays(src_mesh,src_geometry,cfg.export_tangents,cfg.log,cfg.mikktspace_tangents,cfg.max_influences)
+            source=cfg.snapshot.add_mesh_source(arrays)
+    elif cfg.bulk_extraction:
+        with cfg.profiler.phase("extract_meshdata"):
+            submeshes=extract_submeshes_bulk(src_mesh,src_geometry,cfg.export_tangents,cfg.remove_doubles,cfg.weld_epsilon,log=cfg.log,mikktspace=cfg.mikktspace_tangents,max_influences=cfg.max_influences)
+
     for material_index, dst in dstMap.items():
         dst.primitive = f3b.datas_pb2.Mesh.triangles
-        dst.id = cfg.id_of(src_mesh) + "_" + str(material_index)
+        dst.id = cfg.id_of(src_geometry.data) + "_" + str(material_index)
         dst.name = src_geometry.data.name + "_" + str(material_index)
         dst_mesh=dst
+        if cfg.snapshot is not None:
+            cfg.snapshot.add_mesh(dst_mesh,source,material_index)
+            if data is not None:
+                corners=arrays["poly_loops"][arrays["poly_material"]==material_index].ravel()
+                export_mesh_bounds(dst.id,arrays["positions"][corners],data,cfg)
+            continue
 
-        #Collect mesh data 
-        mesh=extract_meshdata(src_mesh,src_geometry,material_index,cfg.export_tangents,cfg.remove_doubles)   
-
-        positions = dst_mesh.vertexArrays.add()
-        positions.attrib = f3b.datas_pb2.VertexArray.position
-        positions.floats.step = 3
-        
-        normals = dst_mesh.vertexArrays.add()
-        normals.attrib = f3b.datas_pb2.VertexArray.normal
-        normals.floats.step = 3
-        
-        indexes = dst_mesh.indexArrays.add()
-        indexes.ints.step = 3
-
-        texcoords=[]
-        texcoords_ids=[f3b.datas_pb2.VertexArray.texcoord,f3b.datas_pb2.VertexArray.texcoord2,f3b.datas_pb2.VertexArray.texcoord3,f3b.datas_pb2.VertexArray.texcoord4,f3b.datas_pb2.VertexArray.texcoord5,f3b.datas_pb2.VertexArray.texcoord6,f3b.datas_pb2.VertexArray.texcoord7,f3b.datas_pb2.VertexArray.texcoord8]
-
-        if mesh.verts[0].tg: 
-            tangents_ids=[f3b.datas_pb2.VertexArray.tangent,f3b.datas_pb2.VertexArray.tangent2,f3b.datas_pb2.VertexArray.tangent3,f3b.datas_pb2.VertexArray.tangent4,f3b.datas_pb2.VertexArray.tangent5,f3b.datas_pb2.VertexArray.tangent6,f3b.datas_pb2.VertexArray.tangent7,f3b.datas_pb2.VertexArray.tangent8]
-            tangents=[]
-
-        print("Found ",len(mesh.verts[0].tx)," uvs")
-        for i in range(0,min(9, len(mesh.verts[0].tx))):
-            texcoords.append(dst_mesh.vertexArrays.add())
-            texcoords[i].attrib=texcoords_ids[i]
-            texcoords[i].floats.step = 2
-            if mesh.verts[0].tg: 
-                tangents.append(dst_mesh.vertexArrays.add())
-                tangents[i].attrib = tangents_ids[i]
-                tangents[i].floats.step = 4
-            
-
-        if mesh.verts[0].c:
-            colors = dst_mesh.vertexArrays.add()
-            colors.attrib = f3b.datas_pb2.VertexArray.color
-            colors.floats.step = 4
-
-
-
-        indexes.ints.values.extend(mesh.indexes)
-        for v in mesh.verts:
-            positions.floats.values.extend(v.p)
-            normals.floats.values.extend(v.n)
-            if v.c:
-                colors.floats.values.extend(v.c)
-            if v.tx:
-                for i,tx in enumerate(v.tx):
-                    texcoords[i].floats.values.extend(tx)
-                    if v.tg:
-                        tangents[i].floats.values.extend(v.tg[i])            
-
-        if mesh.has_skin:
-            dst_skin=dst_mesh.skin
-            dst_skin.boneCount.extend(mesh.skin.boneCount)
-            dst_skin.boneIndex.extend(mesh.skin.boneIndex)
-            dst_skin.boneWeight.extend(mesh.skin.boneWeight)
+        if submeshes is not None:
+            mesh=submeshes.pop(material_index)
+        else:
+            with cfg.profiler.phase("extract_meshdata"):
+                mesh=extract_meshdata(src_mesh,src_geometry,material_index,cfg.export_tangents,cfg.remove_doubles,cfg.weld_epsilon,cfg.log,cfg.max_influences)
+        if cfg.log.debug_enabled:
+            cfg.log.debug("Mesh %s: %d indices, %d unique vertices", dst.name, len(mesh.indexes), mesh.vertex_count())
+        if data is not None:
+            export_mesh_bounds(dst.id,mesh.positions,data,cfg)
+        if cfg.vertex_cache is not None:
+            mesh=optimize_vertex_cache(mesh,dst.name,cfg)
+        clusters=None
+        if data is not None and cfg.cluster_threshold>0 and len(mesh.indexes)//3>cfg.cluster_threshold:
+            with cfg.profiler.phase("cluster_mesh"):
+                mesh,clusters,bounds=cluster_mesh(mesh,cfg.cluster_max_vertices,cfg.cluster_max_triangles)
+                body=pack_clusters(clusters,bounds)
+                rpath=cfg.assets.write_bytes(body,clusters_rpath(body),"clusters")
+                params=export_clusters(data,dst.id,len(clusters)-1,rpath)
+            if cfg.cache is not None:
+                cfg.cluster_params[dst.id]=(params,rpath)
+            cfg.profiler.count("clusters", len(clusters)-1)
+            if cfg.log.debug_enabled:
+                cfg.log.debug("Mesh %s: %d clusters", dst.name, len(clusters)-1)
+        cfg.profiler.count("meshes")
+        cfg.profiler.count("vertices", mesh.vertex_count())
+        cfg.profiler.count("indices", len(mesh.indexes))
+        with cfg.profiler.phase("export_mesh_arrays"):
+            export_mesh_arrays(mesh,dst_mesh)
+        if data is not None and cfg.lods is not None:
+            cfg.lods.submit((dst.id, dst.name, material_index, cfg.id_of(src_geometry.data)), mesh)
+        mesh=None
 
     for m in tmp_modifier:
         src_geometry.modifiers.remove(m)
@@ -621,6 +714,76 @@ def export_meshes(src_geometry, meshes, scene, cfg):
     return dstMap
 
 
+def export_mesh_bounds(mesh_id, positions, data, cfg):
+    """Bounds of the mesh mesh_id from its positions, kept in cfg.mesh_bounds for the bounds of its objects"""
+    bounds = points_bounds(positions)
+    if bounds is None:
+        return
+    cfg.mesh_bounds[mesh_id] = bounds
+    if cfg.export_bounds:
+        export_bounds(data, mesh_id, bounds)
+
+
+def optimize_vertex_cache(mesh, name, cfg):
+    """mesh with its triangles and vertices reordered for the vertex caches, see vertex_cache.py"""
+    with cfg.profiler.phase("optimize_vertex_cache"):
+        mesh, before, after = cfg.vertex_cache.optimize(mesh)
+    if cfg.log.debug_enabled:
+        cfg.log.debug("Mesh %s: ACMR %.3f -> %.3f", name, before, after)
+    return mesh
+
+
+def export_meshes_cached(src_geometry, data, scene, cfg):
+    """export_meshes, but reuse the meshes encoded by a previous run if src_geometry didn't change"""
+    if cfg.cache is None:
+        return export_meshes(src_geometry, data.meshes, scene, cfg, data=data)
+    key = mesh_fingerprint(src_geometry, cfg)
+    if key is None:
+        cfg.log.debug("Meshes of %s not cached, its modifiers reference data-blocks that can't be fingerprinted", src_geometry.name)
+        return export_meshes(src_geometry, data.meshes, scene, cfg, data=data)
+    cached = cfg.cache.get(key)
+    if cached is not None:
+        cfg.log.debug("Reuse cached meshes of %s", src_geometry.name)
+        meshes = {}
+        for part, body in cached:
+            if isinstance(part, str):
+                # "<material index>_bounds", "<material index>_clusters" or "<material index>_lod<level>"
+                material_index, kind = part.split("_")
+                base_id = cfg.id_of(src_geometry.data) + "_" + material_index
+                if kind == "bounds":
+                    cfg.mesh_bounds[base_id] = unpack_bounds(body)
+                    if cfg.export_bounds:
+                        export_bounds(data, base_id, cfg.mesh_bounds[base_id])
+                    continue
+                if kind == "clusters":
+                    splice_with_id(data, "custom_params", body, clusters_id(base_id))
+                    add_relation_raw(data.relations, clusters_id(base_id), base_id, cfg)
+                    continue
+                level = int(kind[len("lod"):])
+                splice_with_id(data, "meshes", body, lod_id(base_id, level))
+                link_lod(data, base_id, level, lod_screen_size(cfg.lod_screen_size, cfg.lod_ratio, level))
+                continue
+            mesh_id = cfg.id_of(src_geometry.data) + "_" + str(part)
+            meshes[part] = splice_with_id(data, "meshes", body, mesh_id)
+        return meshes
+    meshes = export_meshes(src_geometry, data.meshes, scene, cfg, data=data)
+    fragments = [(material_index, encode_without_id(mesh)) for material_index, mesh in meshes.items()]
+    files = []
+    for material_index, mesh in meshes.items():
+        if mesh.id in cfg.mesh_bounds:
+            fragments.append(("%d_bounds" % material_index, pack_bounds(cfg.mesh_bounds[mesh.id])))
+        if mesh.id in cfg.cluster_params:
+            params, rpath = cfg.cluster_params.pop(mesh.id)
+            fragments.append(("%d_clusters" % material_index, encode_without_id(params)))
+            files.append(rpath)
+    if cfg.lods is not None and lods_pending(cfg, cfg.id_of(src_geometry.data)):
+        # Stored once the LODs are done, see export_all_lods
+        cfg.lod_cache_entries[cfg.id_of(src_geometry.data)] = (key, fragments, files)
+    else:
+        cfg.cache.put(key, fragments, files)
+    return meshes
+
+
 # FIXME side effect on the original scene (selection, and transform of the src_geometry)
 def apply_transform(src_geometry):
     # bpy.ops.object.select_all(action='DESELECT') # deselect everything to avoid a mess
@@ -669,7 +832,7 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
         prop=dst_mat.properties.add()
         prop.id=input_label
         cnv_color(input_node.outputs[0].default_value,prop.vcolor)
-        print("Found color",prop.vcolor)
+        cfg.log.debug("Found color %s", prop.vcolor)
     # Deprecated:  Use custom Fload and Int nodes instead
     #elif input_type=="VALUE":
     #    prop=dst_mat.properties.add()
@@ -681,7 +844,7 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
         prop.id=input_label
         solid=len(input_node.outputs[1].links)==0 #If alpha is not connected= solid
         export_tex(solid,args,input_node.image,prop.texture,cfg)
-        print("Found texture")
+        cfg.log.debug("Found texture")
     elif input_type=="GROUP": # Custom nodes groups as input
         name=input_node.node_tree.name
         name=CYCLES_CUSTOM_NODEINPUT_PATTERN.match(name)
@@ -695,7 +858,7 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
                 prop=dst_mat.properties.add()
                 prop.id=input_label
                 cnv_vec3((x,y,z), prop.vvec3)
-                print("Found vec3",prop.vvec3)
+                cfg.log.debug("Found vec3 %s", prop.vvec3)
             elif name == "VEC2":
                 x,y=input_node.inputs
                 x=x.default_value
@@ -703,7 +866,7 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
                 prop=dst_mat.properties.add()
                 prop.id=input_label
                 cnv_vec2((x,y), prop.vvec2)
-                print("Found vec2",prop.vvec2)
+                cfg.log.debug("Found vec2 %s", prop.vvec2)
             elif name == "VEC4" or name == "QTR":
                 x,y,z,w=input_node.inputs
                 x=x.default_value
@@ -713,7 +876,7 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
                 prop=dst_mat.properties.add()
                 prop.id=input_label
                 cnv_vec4((x,y,z,w), prop.vvec4 if name == "QTR" else prop.vqtr)
-                print("Found vec4",prop.vvec4)
+                cfg.log.debug("Found vec4 %s", prop.vvec4)
             elif name=="RGBA":
                 r,g,b,a=input_node.inputs
                 
@@ -725,41 +888,59 @@ def parseNode(input_node,input_type,dst_mat,input_label,cfg):
                 prop=dst_mat.properties.add()
                 prop.id=input_label
                 cnv_color((r,g,b,a),prop.vcolor)
-                print("Found color",prop.vcolor)
+                cfg.log.debug("Found color %s", prop.vcolor)
             elif name == "FLOAT":
                 prop=dst_mat.properties.add()
                 prop.id=input_label            
                 prop.vfloat=float(input_node.inputs[0].default_value)
-                print("Found Float",prop.vfloat)
+                cfg.log.debug("Found Float %s", prop.vfloat)
             elif name == "INT":
                 prop=dst_mat.properties.add()
                 prop.id=input_label            
                 prop.vint=int(input_node.inputs[0].default_value)
-                print("Found Int",prop.vint)
+                cfg.log.debug("Found Int %s", prop.vint)
             elif name == "TRUE":
                 prop=dst_mat.properties.add()
                 prop.id=input_label            
                 prop.vbool=True
-                print("Found boolean TRUE")
+                cfg.log.debug("Found boolean TRUE")
             elif name == "FALSE":
                 prop=dst_mat.properties.add()
                 prop.vbool=False     
                 prop.id=input_label     
-                print("Found boolean FALSE")          
+                cfg.log.debug("Found boolean FALSE")
             elif name == "PRESET":
                 for n in input_node.outputs[0].links[0].from_node.node_tree.nodes:
                     if n.type=="GROUP_OUTPUT":
                         input_node=n.inputs[0].links[0].from_node
                         input_type=input_node.type
-                        print("Found preset")
+                        cfg.log.debug("Found preset")
                         parseNode(input_node,input_type,dst_mat,input_label,cfg)
-                        print("Preset end")
+                        cfg.log.debug("Preset end")
                         break    
             else: 
-                print(input_type,"not supported [1]",name)
+                cfg.log.warning("%s not supported [1] %s", input_type, name)
     else: 
-        print(input_type,"not supported")
+        cfg.log.warning("%s not supported", input_type)
     
+def export_material_cached(src_mat, data, cfg):
+    """Add src_mat to data.materials, reusing the material encoded by a previous run if it didn't change"""
+    if cfg.cache is not None:
+        key = material_fingerprint(src_mat, cfg)
+        cached = cfg.cache.get(key)
+        if cached is not None:
+            cfg.log.debug("Reuse cached material %s", src_mat.name)
+            for _, body in cached:
+                splice_with_id(data, "materials", body, cfg.id_of(src_mat))
+            return
+    dst_mat = data.materials.add()
+    export_material(src_mat, dst_mat, cfg)
+    if cfg.cache is not None:
+        textures = [p.texture.rpath for p in dst_mat.properties if p.HasField("texture")]
+        cfg.cache.put(key, [(0, encode_without_id(dst_mat))], textures)
+
+
+@profiled
 def export_material(src_mat, dst_mat, cfg):
     dst_mat.id = cfg.id_of(src_mat)
     dst_mat.name = src_mat.name
@@ -772,82 +953,49 @@ def export_material(src_mat, dst_mat, cfg):
             input_label=input.name
             input_label=CYCLES_MAT_INPUT_PATTERN.match(input_label)
             if input_label == None:
-               print("Skip ",input.name)                
+               cfg.log.debug("Skip %s", input.name)
             else:
                 input_label=input_label.group(1)
-                print("Export ",input_label)
+                cfg.log.debug("Export %s", input_label)
                 input_label=input_label.strip()
                 if len(input.links) > 0: 
                     input_node=input.links[0].from_node
                     input_type=input_node.type    
                     parseNode(input_node,input_type,dst_mat,input_label,cfg)
                 
-CONVERT_TO_DDS_QUEUE=[]       
-
-def exportDDSs():
-    BATCH_SIZE=16
-    CONCURRENT_EXPORTS=1
-    IS_FIRST=True
-    XMX="2000M"
-    if XMX!="":
-        XMX="-Xmx"+XMX
-    if CONCURRENT_EXPORTS>1:
-        export_pool= ThreadPoolExecutor(max_workers=CONCURRENT_EXPORTS)
-        export_poolw=[]
-    ii=0
-    while True:
-        xinputs=""
-        xoutputs=""
-        xformats=""
-        # r=range(ii,len(CONVERT_TO_DDS_QUEUE))
-        n=BATCH_SIZE
-        if len(CONVERT_TO_DDS_QUEUE)<n:
-            n=len(CONVERT_TO_DDS_QUEUE)
-        for fi in range(0,n):
-            f=CONVERT_TO_DDS_QUEUE[ii]
-            if xinputs!="":
-                xinputs+=","
-            xinputs+=f[1]
-            if xoutputs!="":
-                xoutputs+=","
-            xoutputs+=f[2]
-            if xformats!="":
-                xformats+=","
-            xformats+=f[0]
-            ii+=1
-            if ii==len(CONVERT_TO_DDS_QUEUE):
-                break;
-        MULTIRES="--multires :100%,-low:50%,-lower:50%,-lowest:16px"
-        # command=DDS_WRITER_PATH+" --use-opengl --gen-mipmaps --format "+xformats+" --inlist "+xinputs+"  --outlist "+xoutputs+" "+ MULTIRES
-        command=[DDS_WRITER_PATH,"--use-opengl","--gen-mipmaps","--format ",xformats,"--inlist ",xinputs,"--outlist",xoutputs]
-        if MULTIRES!="":
-            command.append("--multires")
-            command.append(MULTIRES)
-        print("Run",command)
-        if CONCURRENT_EXPORTS>1:
-            c=export_pool.submit(  subprocess.call,command)
-            export_poolw.append(c)
-            if IS_FIRST: #Always wait for the first call to ensure all resources are extracted properly
-                c.result()
-                IS_FIRST=False
-        else:
-            subprocess.call(command)
-            # )
-        if ii==len(CONVERT_TO_DDS_QUEUE):
-            break;
- 
-    if CONCURRENT_EXPORTS>1: 
-        for s  in  export_poolw:
-            s.result()
-        export_pool.shutdown(True)
-    # 
-    # print(subprocess.getoutput(command))
-    for f in CONVERT_TO_DDS_QUEUE:
-        try:
-            os.remove(f[1]) 
-        except: pass
-                
 EXT_FORMAT_MAP={"targa":"tga","jpeg":"jpg","targa_raw":"tga"}
+
+def dds_format(solid,args):
+    """DDSWriter format of a texture, from the dds{solid=...,alpha=...} args of its node"""
+    dds_args=args
+    format =None
+    if "dds{" in dds_args:
+        dds_args=dds_args[dds_args.index("dds{")+4:]
+        dds_args=dds_args[:dds_args.index("}")]
+        dds_args=dds_args.split(",")
+        for dds_arg in dds_args:
+            key,value=dds_arg.split("=")
+            key=key.strip()
+            if key=="solid" and solid and value!=None:      
+                format=value.replace("'","").strip()
+                break
+            elif key=="alpha" and not solid and value!=None:
+                format=value.replace("'","").strip()
+
+    if format==None:
+        format="UNCOMPRESSED"
+
+    format=format.upper()
+   
+    if format=="ATI2" or format=="3DC":
+        format="ATI_3DC"
+    elif format=="DXT1" or format=="DXT3" or format=="DXT5":
+        format="S3TC_"+format
+    elif format=="UNCOMPRESSED":
+        format="ARGB8"
+    return format
+
+@profiled
 def export_tex(solid,args,src, dst, cfg):
     base_name=src.name
     ext="."+src.file_format.lower()
@@ -862,76 +1010,50 @@ def export_tex(solid,args,src, dst, cfg):
         ext="."+EXT_FORMAT_MAP[pext]
 
     origin_file=bpy.path.abspath(src.filepath)
-    print("Base texture name",base_name,"assets path",cfg.assets_path)
-    output_file=os.path.join(cfg.assets_path,"Textures",base_name)+ext  
-    print("Write texture in",output_file)
+    rpath="Textures/"+base_name+ext
+    cfg.log.debug("Write texture %s in %s", base_name, rpath)
 
-    output_parent=os.path.dirname(output_file)
-        
     is_packed=src.packed_file
     dst.id = cfg.id_of(src)
 
     if cfg.need_update(src):       
-    
-        if not os.path.exists(output_parent):
-            os.makedirs(output_parent)
-          
-        if is_packed:
-            print(base_name,"is packed inside the blend file. It will be extracted in",output_file)
-            with open(output_file, 'wb') as f:
-                f.write(src.packed_file.data)
+        dds_key=None
+        cached=None
+        if not ext==".dds" and cfg.textures_to_dds and DDS_SUPPORT: 
+            format=dds_format(solid,args)
+            if is_packed:
+                source_hash=hashlib.sha1(src.packed_file.data).hexdigest()
+            else:
+                source_hash=cfg.assets.source_hash(origin_file)
+            dds_key=cfg.dds_cache.key_of(source_hash,format,cfg.dds_queue.mipmaps,cfg.dds_queue.multires)
+            cached=cfg.dds_cache.get(dds_key)
+
+        if cached is not None:
+            cfg.log.debug("%s already converted to DDS in %s", base_name, cached)
+            own=os.path.splitext(rpath)[0]+".dds"
+            if cached!=own:
+                # The conversion of another texture with the same content, that might be converted again in this export
+                cfg.dds_cache.share(dds_key,own)
         else:
-            print(origin_file,"will be copied in",output_file)
-            import shutil
-            if origin_file != output_file:
-                shutil.copyfile(origin_file, output_file)            
+            if is_packed:
+                cfg.log.debug("%s is packed inside the blend file. It will be extracted in %s", base_name, rpath)
+                rpath=cfg.assets.write_bytes(src.packed_file.data,rpath,base_name)
+            else:
+                cfg.log.debug("%s will be copied in %s", origin_file, rpath)
+                rpath=cfg.assets.copy_file(origin_file,rpath)
         
-        if not ext==".dds" and cfg.textures_to_dds and DDS_SUPPORT: 
-            print("Convert to DDS")
-              
-            expected_mipmaps= 1 + int(math.ceil(math.log(src.size[0] if src.size[0] >src.size[1] else src.size[1]) / math.log(2)))  
-            dds_file=os.path.join(cfg.assets_path,"Textures",base_name)+".dds"    
-       #     command="\
-        #    "+IMAGEMAGICK_CONVERT_PATH+"\
-         #    -format dds \
-          #   -filter Mitchell \
-           #  -define dds:compression=dxt5 \
-            # -define dds:mipmaps="+str(expected_mipmaps)+" \
-            # "+output_file+" "+dds_file
-            dds_args=args
-            format =None
-            if "dds{" in dds_args:
-                dds_args=dds_args[dds_args.index("dds{")+4:]
-                dds_args=dds_args[:dds_args.index("}")]
-                dds_args=dds_args.split(",")
-                for dds_arg in dds_args:
-                    key,value=dds_arg.split("=")
-                    key=key.strip()
-                    if key=="solid" and solid and value!=None:      
-                        format=value.replace("'","").strip()
-                        break
-                    elif key=="alpha" and not solid and value!=None:
-                        format=value.replace("'","").strip()
-
-            if format==None:
-                format="UNCOMPRESSED"
-
-            format=format.upper()
-           
-            if format=="ATI2" or format=="3DC":
-                format="ATI_3DC"
-            elif format=="DXT1" or format=="DXT3" or format=="DXT5":
-                format="S3TC_"+format
-            elif format=="UNCOMPRESSED":
-                format="ARGB8"
-
-            CONVERT_TO_DDS_QUEUE.append((format,output_file,dds_file));
+            if dds_key is not None:
+                cfg.log.debug("Convert %s to DDS", rpath)
+                output_file=os.path.join(cfg.assets_path,rpath)
+                dds_file=os.path.splitext(output_file)[0]+".dds"
+                cfg.dds_queue.add(format,output_file,dds_file,src.size[0]*src.size[1],dds_key)
           
     else:
-        print(base_name,"already up to date")
-    if cfg.textures_to_dds and DDS_SUPPORT:  ext=".dds"
-    dst.rpath = "Textures/"+base_name+ext
-    print("Set rpath to", dst.rpath)
+        cfg.log.debug("%s already up to date", base_name)
+        rpath=cfg.assets.resolve(rpath)
+    if cfg.textures_to_dds and DDS_SUPPORT:  rpath=os.path.splitext(rpath)[0]+".dds"
+    dst.rpath = rpath
+    cfg.log.debug("Set rpath to %s", dst.rpath)
         
     # TODO use md5 (hashlib.md5().update(...)) to name or to check change ??
     # TODO If the texture has a scale and/or offset, then export a coordinate transform.
@@ -996,16 +1118,16 @@ def export_light(src, dst, cfg):
             dst.radial_distance.linear.end = 1.0
 
 
+@profiled
 def export_all_skeletons(scene, data, cfg):
-    for obj in scene.objects:
-        if obj.type == 'ARMATURE':
-            src_skeleton = obj.data
-            # src_skeleton = obj.pose
-            if cfg.need_update(src_skeleton):
-                dst_skeleton = data.skeletons.add()
-                export_skeleton(src_skeleton, dst_skeleton, cfg)
-            add_relation_raw(data.relations, cfg.id_of(obj), 
-             cfg.id_of(src_skeleton), cfg)
+    for obj in index_of(scene, cfg).armatures:
+        src_skeleton = obj.data
+        # src_skeleton = obj.pose
+        if cfg.need_update(src_skeleton):
+            dst_skeleton = data.skeletons.add()
+            export_skeleton(src_skeleton, dst_skeleton, cfg)
+        add_relation_raw(data.relations, cfg.id_of(obj), 
+         cfg.id_of(src_skeleton), cfg)
 
 
 def export_skeleton(src, dst, cfg):
@@ -1039,124 +1161,168 @@ def export_skeleton(src, dst, cfg):
             rel.ref2 = dst_bone.id
 
 
+@profiled
 def export_all_actions(scene, dst_data, cfg):
     fps = max(1.0, float(scene.render.fps))
 #    for action in bpy.data.actions:
     frame_current = scene.frame_current
     frame_subframe = scene.frame_subframe
-    for obj in scene.objects:
-        if obj.animation_data:
-            action_current = obj.animation_data.action
-            for tracks in obj.animation_data.nla_tracks:
-                for strip in tracks.strips:
-                    action = strip.action
-                    if action == None: continue
-                    if cfg.need_update(action):
-                        #dst = dst_data.Extensions[f3b.animations_kf_pb2.animations_kf].add()
-                        dst = dst_data.animations_kf.add()
-                        # export_action(action, dst, fps, cfg)
-                        export_obj_action(tracks.name,scene, obj, action, dst, fps, cfg)
-                        # relativize_bones(dst, obj)
-                    add_relation_raw(
-                        dst_data.relations,
-                  
-                 cfg.id_of(action), cfg.id_of(obj),
-                        cfg)
-            obj.animation_data.action = action_current
-    scene.frame_set(frame_current, frame_subframe)
+    animated = index_of(scene, cfg).animated
+    jobs = []
+    for obj in animated:
+        for tracks in obj.animation_data.nla_tracks:
+            for strip in tracks.strips:
+                action = strip.action
+                if action == None: continue
+                if cfg.need_update(action):
+                    job = export_obj_action_cached(tracks.name,scene, obj, action, dst_data, fps, cfg)
+                    if job is not None:
+                        jobs.append(job)
+                add_relation_raw(
+                    dst_data.relations,
+              
+             cfg.id_of(action), cfg.id_of(obj),
+                    cfg)
+    try:
+        if len(jobs) > 0:
+            with cfg.profiler.phase("bake"):
+                frames = bake(scene, jobs, animated, fps, cfg.log)
+            cfg.profiler.count("animations", len(jobs))
+            cfg.profiler.count("frames_evaluated", frames)
+    finally:
+        scene.frame_set(frame_current, frame_subframe)
+
+
+def export_obj_action_cached(name, scene, obj, src, dst_data, fps, cfg):
+    """
+    Add the action src of obj to dst_data.animations_kf, reusing the one encoded by a previous run if it didn't change.
+    Returns the BakeJob that samples it, or None if there is nothing to sample
+    """
+    cache = cfg.cache
+    if cache is not None and depends_on_others(obj, index_of(scene, cfg).animated_set):
+        # Sampled with the actions of other objects, that the fingerprint doesn't cover
+        cfg.log.debug("Animation %s not cached, %s depends on other animated objects", name, obj.name)
+        cache = None
+    if cache is not None:
+        key = action_fingerprint(obj, src, name, fps, cfg)
+        cached = cache.get(key)
+        if cached is not None:
+            cfg.log.debug("Reuse cached animation %s", name)
+            for _, body in cached:
+                splice_with_id(dst_data, "animations_kf", body, cfg.id_of(src))
+            return None
+    #dst = dst_data.Extensions[f3b.animations_kf_pb2.animations_kf].add()
+    dst = cfg.new_entry(dst_data, "animations_kf")
+    # export_action(action, dst, fps, cfg)
+    job = export_obj_action(name,scene, obj, src, dst, fps, cfg)
+    # relativize_bones(dst, obj)
+    if job is None:
+        cfg.entry_done(dst_data, "animations_kf", dst)
+        return None
+    finish = job.done
+    def done():
+        finish()
+        if cache is not None:
+            cache.put(key, [(0, encode_without_id(dst))])
+        cfg.entry_done(dst_data, "animations_kf", dst)
+    job.done = done
+    return job
 
 
 def export_obj_action(name,scene, obj, src, dst, fps, cfg):
     """
     export action by sampling matrixes of obj over frame.
-    side effects :
-    * change the current action of obj
-    * change the scene.frame (when looping over frame of the animation) by scene.frame_set
+    Returns the BakeJob that fills dst once it is baked (see bake_scheduler), None if the action is not supported
     """
-    def to_time(frame):
-        return int((frame * 1000) / fps)
-
-    obj.animation_data.action = src
     dst.id = cfg.id_of(src)
-    print("Export animation "+name)
+    cfg.log.debug("Export animation %s", name)
     dst.name = name
     frame_start = int(src.frame_range.x)
     frame_end = int(src.frame_range.y + 1)
-    dst.duration = to_time(max(1, float(frame_end - frame_start)))
+    dst.duration = frame_to_time(max(1, float(frame_end - frame_start)), fps)
+    frame_count = frame_end - frame_start
+    store = cfg.snapshot.store_sampled_transform if cfg.snapshot is not None else store_sampled_transform
     samplers = []
     if src.id_root == 'OBJECT':
         dst.target_kind = f3b.animations_kf_pb2.AnimationKF.tobject
-        samplers.append(Sampler(obj, dst))
+        samplers.append(Sampler(obj, dst, frame_count, store))
         if obj.type == 'ARMATURE':
-            for i in range(0, len(obj.pose.bones)):
-                samplers.append(Sampler(obj, dst, i))
+            samplers.append(PoseSampler(obj, dst, frame_count, store))
     elif src.id_root == 'ARMATURE':
         dst.target_kind = f3b.animations_kf_pb2.AnimationKF.skeleton
-        for i in range(0, len(obj.pose.bones)):
-            samplers.append(Sampler(obj, dst, i))
+        samplers.append(PoseSampler(obj, dst, frame_count, store))
     else:
-        cfg.warning("unsupported id_roor => target_kind : " + src.id_root)
-        return
+        cfg.log.warning("unsupported id_roor => target_kind : %s", src.id_root)
+        return None
 
-    for f in range(frame_start, frame_end):
-        scene.frame_set(f)
+    def done():
         for sampler in samplers:
-            sampler.capture(to_time(f))
+            cfg.profiler.count("keys", sampler.finish(cfg.keyframe_tolerances))
+    return BakeJob(obj, src, frame_start, frame_end, samplers, done)
 
 
 class Sampler:
+    """
+    Samples the local matrix of obj in a preallocated buffer, written to a sampled_transform clip by finish()
+    with store (store_sampled_transform, or the one of the snapshot being captured)
+    """
 
-    def __init__(self, obj, dst, pose_bone_idx=None):
+    def __init__(self, obj, dst, frame_count, store=store_sampled_transform):
         self.obj = obj
-        self.pose_bone_idx = pose_bone_idx
+        self.store = store
         self.clip = dst.clips.add()
-        if pose_bone_idx is not None:
-            self.clip.sampled_transform.bone_name = self.obj.pose.bones[self.pose_bone_idx].name
-            self.rest_bone = obj.data.bones[self.pose_bone_idx]
-            self.rest_matrix_inverted = self.rest_bone.matrix_local.copy().inverted()
-        self.previous_mat4 = None
-        self.last_equals = None
-        self.cnv_mat = bpy_extras.io_utils.axis_conversion(from_forward='-Y', from_up='Z', to_forward='Z', to_up='Y').to_4x4()
+        self.times = np.empty(frame_count, dtype=np.int64)
+        self.samples = np.empty((frame_count, 4, 4), dtype=np.float64)
+        self.count = 0
 
     def capture(self, t):
-        if self.pose_bone_idx is not None:
-            pbone = self.obj.pose.bones[self.pose_bone_idx]
-            mat4 = pbone.matrix
-            if pbone.parent:
-                mat4 = pbone.parent.matrix.inverted() * mat4
-        else:
-            mat4 = self.obj.matrix_local
-        if self.previous_mat4 is None or not equals_mat4(mat4, self.previous_mat4, 0.000001):
-            if self.last_equals is not None:
-                self._store(self.last_equals, self.previous_mat4)
-                self.last_equals = None
-            self.previous_mat4 = mat4.copy()
-            self._store(t, mat4)
-        else:
-            self.last_equals = t
-
-    def _store(self, t, mat4):
-        loc, quat, sca = mat4.decompose()
-        dst_clip = self.clip
-        dst_clip.sampled_transform.at.append(t)
-        dst_clip.sampled_transform.translation_x.append(loc.x)
-        dst_clip.sampled_transform.translation_y.append(loc.z)
-        dst_clip.sampled_transform.translation_z.append(-loc.y)
-        dst_clip.sampled_transform.scale_x.append(sca.x)
-        dst_clip.sampled_transform.scale_y.append(sca.z)
-        dst_clip.sampled_transform.scale_z.append(sca.y)
-        dst_clip.sampled_transform.rotation_w.append(quat.w)
-        dst_clip.sampled_transform.rotation_x.append(quat.x)
-        dst_clip.sampled_transform.rotation_y.append(quat.z)
-        dst_clip.sampled_transform.rotation_z.append(-quat.y)
-
-def equals_mat4(m0, m1, max_cell_delta):
-    for i in range(0, 4):
-        for j in range(0, 4):
-            d = m0[i][j] - m1[i][j]
-            if d > max_cell_delta or d < -max_cell_delta:
-                return False
-    return True
+        self.times[self.count] = t
+        self.samples[self.count] = self.obj.matrix_local
+        self.count += 1
+
+    def finish(self, tolerances=None):
+        return self.store(self.clip.sampled_transform, self.times[:self.count], self.samples[:self.count], tolerances)
+
+
+class PoseSampler:
+    """Samples the matrices of all the pose bones of obj at once, one sampled_transform clip per bone"""
+
+    def __init__(self, obj, dst, frame_count, store=store_sampled_transform):
+        self.obj = obj
+        self.store = store
+        bones = obj.pose.bones
+        self.clips = []
+        for pbone in bones:
+            clip = dst.clips.add()
+            clip.sampled_transform.bone_name = pbone.name
+            self.clips.append(clip)
+        names = [pbone.name for pbone in bones]
+        self.parents = np.array([names.index(pbone.parent.name) if pbone.parent else -1 for pbone in bones], dtype=np.int64)
+        self.buffer = np.empty(len(bones) * 16, dtype=np.float32)
+        self.times = np.empty(frame_count, dtype=np.int64)
+        self.samples = np.empty((frame_count, len(bones), 4, 4), dtype=np.float64)
+        self.count = 0
+
+    def capture(self, t):
+        self.obj.pose.bones.foreach_get("matrix", self.buffer)
+        self.times[self.count] = t
+        # foreach_get reads the matrices column by column
+        self.samples[self.count] = self.buffer.reshape(-1, 4, 4).transpose(0, 2, 1)
+        self.count += 1
+
+    def finish(self, tolerances=None):
+        mats = self.samples[:self.count]
+        times = self.times[:self.count]
+        child = np.flatnonzero(self.parents >= 0)
+        if len(child) > 0 and len(mats) > 0:
+            # Relative to the parent bone
+            mats = mats.copy()
+            mats[:, child] = np.matmul(np.linalg.inv(self.samples[:self.count, self.parents[child]]), mats[:, child])
+        keys = 0
+        for i, clip in enumerate(self.clips):
+            keys += self.store(clip.sampled_transform, times, mats[:, i], tolerances)
+        return keys
+
 
 def export_obj_customproperties(src, dst_node, dst_data, cfg):
     keys = [k for k in src.keys() if not (k.startswith('_') or k.startswith('cycles'))]
@@ -1191,6 +1357,70 @@ def update_path(self, context):
     context.scene.f3b.assets_path = self.assets_path
 
 
+def export_file(scene, filepath, options):
+    """
+    Export scene to filepath, with the assets next to it.
+    options holds the option_* attributes of f3bExporter (the operator itself, or the batch exporter arguments).
+    With option_snapshot, the scene is captured next to filepath instead (see snapshot.py).
+    Returns the summary of the profiler, if enabled
+    """
+    assets_path = os.path.dirname(filepath)
+    log = Logger(LEVELS[options.option_log_level], os.path.splitext(filepath)[0] + ".log")
+    log.info("Export in %s", assets_path)
+
+    data = f3b.datas_pb2.Data()
+    keyframe_tolerances = None
+    if options.option_reduce_keyframes:
+        keyframe_tolerances = Tolerances(options.option_translation_tolerance, options.option_rotation_tolerance, options.option_scale_tolerance)
+    cfg = ExportCfg(is_preview=False, assets_path=assets_path,option_export_selection=options.option_export_selection,textures_to_dds=options.option_convert_texture_dds,export_tangents=options.option_export_tangents,mikktspace_tangents=options.option_mikktspace_tangents,remove_doubles=options.option_remove_doubles,weld_epsilon=options.option_weld_epsilon,max_influences=options.option_max_influences,lod_levels=options.option_lod_levels,lod_ratio=options.option_lod_ratio,lod_screen_size=options.option_lod_screen_size,optimize_vertex_cache=options.option_optimize_vertex_cache,cluster_threshold=options.option_cluster_threshold,cluster_max_vertices=options.option_cluster_vertices,cluster_max_triangles=options.option_cluster_triangles,export_bounds=options.option_export_bounds,bulk_extraction=options.option_bulk_extraction,dds_workers=options.option_dds_workers,dds_memory=options.option_dds_memory,keyframe_tolerances=keyframe_tolerances,log=log)
+    cfg.profiler = Profiler(enabled=options.option_profile, trace_memory=options.option_profile_memory)
+    if options.option_snapshot:
+        # The meshes and animations are left to the snapshot converter, the whole data is kept until it is saved
+        cfg.snapshot = SnapshotWriter()
+    else:
+        if options.option_incremental:
+            cfg.cache = ExportCache(os.path.splitext(filepath)[0] + ".f3bcache", cfg.assets_path, log)
+        cfg.writer = DataWriter(filepath, options.option_streaming)
+    try:
+        export(scene, data, cfg)
+        with cfg.profiler.phase("write"):
+            if cfg.snapshot is not None:
+                settings = {"remove_doubles": cfg.remove_doubles, "weld_epsilon": cfg.weld_epsilon,
+                            "lod_levels": cfg.lod_levels, "lod_ratio": cfg.lod_ratio, "lod_screen_size": cfg.lod_screen_size,
+                            "optimize_vertex_cache": cfg.optimize_vertex_cache, "cluster_threshold": cfg.cluster_threshold,
+                            "cluster_max_vertices": cfg.cluster_max_vertices, "cluster_max_triangles": cfg.cluster_max_triangles,
+                            "keyframe_tolerances": list(keyframe_tolerances) if keyframe_tolerances is not None else None}
+                cfg.snapshot.save(snapshot_path(filepath), data, settings, log)
+            else:
+                cfg.writer.close(data)
+    except:
+        if cfg.writer is not None:
+            cfg.writer.abort()
+        if cfg.lods is not None:
+            cfg.lods.close()
+        cfg.profiler.close()
+        log.error("Export failed")
+        log.close()
+        raise
+    if cfg.lods is not None:
+        cfg.lods.close()
+    cfg.assets.save()
+    cfg.dds_cache.save()
+    if cfg.cache is not None:
+        cfg.cache.save()
+    summary = None
+    if cfg.profiler.enabled:
+        if cfg.writer is not None:
+            cfg.profiler.count("bytes_written", cfg.writer.bytes_written)
+        cfg.profiler.count("asset_bytes_copied", cfg.assets.bytes_copied)
+        cfg.profiler.count("asset_bytes_skipped", cfg.assets.bytes_skipped)
+        cfg.profiler.write(os.path.splitext(filepath)[0] + ".profile.json")
+        summary = cfg.profiler.summary()
+    cfg.profiler.close()
+    log.close()
+    return summary
+
+
 class f3bExporter(bpy.types.Operator, ExportHelper):
     """Export to f3b format"""
     bl_idname = "export_scene.f3b"
@@ -1200,30 +1430,46 @@ class f3bExporter(bpy.types.Operator, ExportHelper):
     # settings = bpy.props.PointerProperty(type=f3bSettingsScene)
     option_export_selection = bpy.props.BoolProperty(name = "Export Selection", description = "Export only selected objects", default = True)
     option_export_tangents = bpy.props.BoolProperty(name = "Export Tangents", description = "", default = False)
+    option_mikktspace_tangents = bpy.props.BoolProperty(name = "MikkTSpace Tangents", description = "Compute the tangents with blender (MikkTSpace), as the normal maps baked in blender expect. Otherwise they are computed by the exporter: faster, but only close to MikkTSpace", default = True)
     option_remove_doubles = bpy.props.BoolProperty(name = "Remove Doubles", description = "", default = True)
+    option_weld_epsilon = bpy.props.FloatProperty(name = "Remove Doubles Threshold", description = "Vertices whose attributes differ less than this are merged (0 = exact match)", default = 0.0, min = 0.0, precision = 6)
+    option_max_influences = bpy.props.IntProperty(name = "Max Bone Influences", description = "Keep only the largest bone weights of each vertex, renormalized (0 = keep all)", default = 0, min = 0)
+    option_lod_levels = bpy.props.IntProperty(name = "LOD Levels", description = "Simplified meshes exported after each mesh, related to it (0 = no LODs)", default = 0, min = 0, max = 8)
+    option_lod_ratio = bpy.props.FloatProperty(name = "LOD Ratio", description = "Triangles of each LOD level, relative to the previous one", default = 0.5, min = 0.05, max = 0.95)
+    option_lod_screen_size = bpy.props.FloatProperty(name = "LOD Screen Size", description = "Fraction of the screen height below which the first LOD level is used, scaled for the next ones", default = 0.5, min = 0.0, max = 1.0)
+    option_optimize_vertex_cache = bpy.props.BoolProperty(name = "Optimize Vertex Cache", description = "Reorder the triangles and vertices of the meshes for the GPU vertex caches", default = False)
+    option_cluster_threshold = bpy.props.IntProperty(name = "Cluster Meshes Above", description = "Split the meshes with more triangles than this in clusters with their own bounds, for culling (0 = never)", default = 0, min = 0)
+    option_cluster_vertices = bpy.props.IntProperty(name = "Cluster Vertices", description = "Max vertices of a cluster", default = 64, min = 3)
+    option_cluster_triangles = bpy.props.IntProperty(name = "Cluster Triangles", description = "Max triangles of a cluster", default = 124, min = 1)
+    option_export_bounds = bpy.props.BoolProperty(name = "Export Bounds", description = "Write the AABB and bounding sphere of the meshes, objects and scene as custom params", default = True)
+    option_incremental = bpy.props.BoolProperty(name = "Incremental Export", description = "Keep a cache next to the exported file and reuse the meshes, materials and animations that didn't change", default = False)
+    option_reduce_keyframes = bpy.props.BoolProperty(name = "Reduce Keyframes", description = "Remove the sampled keys that can be interpolated from the ones around them", default = False)
+    option_translation_tolerance = bpy.props.FloatProperty(name = "Translation Tolerance", description = "Max distance between a removed key and its interpolated translation", default = 0.001, min = 0.0, precision = 5)
+    option_rotation_tolerance = bpy.props.FloatProperty(name = "Rotation Tolerance", description = "Max angle between a removed key and its interpolated rotation", default = math.radians(0.1), min = 0.0, subtype = 'ANGLE')
+    option_scale_tolerance = bpy.props.FloatProperty(name = "Scale Tolerance", description = "Max difference between a removed key and its interpolated scale", default = 0.001, min = 0.0, precision = 5)
+    option_streaming = bpy.props.BoolProperty(name = "Streaming Output", description = "Write each mesh, material and animation to the file as soon as it is exported, to bound the memory used by large scenes", default = False)
+    option_profile = bpy.props.BoolProperty(name = "Profile", description = "Write a report of the time used by each export phase next to the exported file", default = False)
+    option_profile_memory = bpy.props.BoolProperty(name = "Profile Memory", description = "Also trace the memory used by each export phase (slower, the times are not comparable with the ones of profiles without it)", default = False)
+    option_bulk_extraction = bpy.props.BoolProperty(name = "Fast Mesh Extraction", description = "Read mesh attributes in bulk. Disable to use the per vertex path", default = True)
+    option_snapshot = bpy.props.BoolProperty(name = "Snapshot Only", description = "Write the raw scene data to a .f3bsnap.npz file, converted to f3b without blender by snapshot_convert.py", default = False)
+    option_log_level = bpy.props.EnumProperty(name = "Log Level", description = "Messages written to the log file next to the exported file", items = [('QUIET', "Quiet", "Only warnings and errors"), ('INFO', "Info", "Progress of the export"), ('DEBUG', "Debug", "Every exported entity")], default = 'INFO')
 
     if DDS_SUPPORT:
         option_convert_texture_dds = bpy.props.BoolProperty(name = "Convert textures to dds", description = "", default = True)
+        option_dds_workers = bpy.props.IntProperty(name = "DDS Workers", description = "Number of DDSWriter processes running at once", default = default_workers(), min = 1)
+        option_dds_memory = bpy.props.IntProperty(name = "DDS Memory Budget (MB)", description = "Memory available to each DDSWriter process, textures are batched to fit it", default = 2000, min = 512)
     else: 
         option_convert_texture_dds=False
+        option_dds_workers=1
+        option_dds_memory=2000
         
     def __init__(self):
         pass
 
     def execute(self, context):
-        scene = context.scene
-       
-        assets_path =   os.path.dirname(self.filepath)
-        print("Export in", assets_path)
-
-        data = f3b.datas_pb2.Data()
-        cfg = ExportCfg(is_preview=False, assets_path=assets_path,option_export_selection=self.option_export_selection,textures_to_dds=self.option_convert_texture_dds,export_tangents=self.option_export_tangents,remove_doubles=self.option_remove_doubles)
-        export(scene, data, cfg)
-
-        file = open(self.filepath, "wb")
-        file.write(data.SerializeToString())
-        file.close()
-
+        summary = export_file(context.scene, self.filepath, self)
+        if summary is not None:
+            self.report({'INFO'}, summary)
         return {'FINISHED'}
 
     @classmethod
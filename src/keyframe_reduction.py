@@ -0,0 +1,97 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Error bounded reduction of sampled transforms.
+
+A key is removed when the transform at its time can be rebuilt from the kept
+keys around it (lerp for translation and scale, slerp for rotation) within
+the given tolerances. Segments are split at their worst key until every
+removed key fits, like the Douglas-Peucker simplification of a polyline.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# translation and scale: max distance, rotation: max angle in radians
+Tolerances = namedtuple("Tolerances", "translation rotation scale")
+
+
+def lerp(a, b, u):
+    """Interpolate the rows a and b for each u"""
+    return a + (b - a) * u[:, None]
+
+
+def slerp(q0, q1, u):
+    """Spherical interpolation of the unit quaternions q0 and q1 (w, x, y, z) for each u"""
+    d = float(np.dot(q0, q1))
+    if d < 0.0:
+        # Shortest path
+        q1 = -q1
+        d = -d
+    if d > 0.9995:
+        out = lerp(q0, q1, u)
+    else:
+        theta = np.arccos(d)
+        s = np.sin(theta)
+        out = (np.sin((1.0 - u) * theta) / s)[:, None] * q0 + (np.sin(u * theta) / s)[:, None] * q1
+    return out / np.linalg.norm(out, axis=1)[:, None]
+
+
+def rotation_error(a, b):
+    """Angle between the rotations of the rows of a and b"""
+    d = np.abs(np.sum(a * b, axis=1))
+    return 2.0 * np.arccos(np.clip(d, 0.0, 1.0))
+
+
+def segment_errors(times, translations, rotations, scales, i, j, tolerances):
+    """For the keys between i and j (excluded): how much each one exceeds the tolerances once interpolated"""
+    u = (times[i + 1:j] - times[i]) / float(times[j] - times[i])
+    err = np.linalg.norm(lerp(translations[i], translations[j], u) - translations[i + 1:j], axis=1) / max(tolerances.translation, 1e-12)
+    err = np.maximum(err, rotation_error(slerp(rotations[i], rotations[j], u), rotations[i + 1:j]) / max(tolerances.rotation, 1e-12))
+    err = np.maximum(err, np.linalg.norm(lerp(scales[i], scales[j], u) - scales[i + 1:j], axis=1) / max(tolerances.scale, 1e-12))
+    return err
+
+
+def reduce_keys(times, translations, rotations, scales, tolerances):
+    """
+    Indexes of the keys to keep (sorted, first and last always kept).
+    times [n], translations [n,3], rotations [n,4] unit quaternions, scales [n,3]
+    """
+    n = len(times)
+    if n <= 2:
+        return np.arange(n)
+    times = np.asarray(times, dtype=np.float64)
+    translations = np.asarray(translations, dtype=np.float64)
+    rotations = np.asarray(rotations, dtype=np.float64)
+    scales = np.asarray(scales, dtype=np.float64)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[n - 1] = True
+    segments = [(0, n - 1)]
+    while segments:
+        i, j = segments.pop()
+        if j - i < 2:
+            continue
+        err = segment_errors(times, translations, rotations, scales, i, j, tolerances)
+        worst = int(np.argmax(err))
+        if err[worst] > 1.0:
+            k = i + 1 + worst
+            keep[k] = True
+            segments.append((i, k))
+            segments.append((k, j))
+    return np.flatnonzero(keep)
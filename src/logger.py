@@ -0,0 +1,131 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Leveled logger of the exporter.
+
+Messages are %-format strings with their arguments passed apart, they are
+formatted only if their level is enabled. Hot loops should also check the
+*_enabled flags before building the arguments. Enabled messages are buffered
+and written to a log file (or stdout when there is none), the console only
+gets one summary line per export stage when the logger is closed.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "QUIET": WARNING, "WARNING": WARNING, "ERROR": ERROR}
+
+
+class _Stage:
+
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def __enter__(self):
+        self.parent = self.log._stage
+        self.log._stage = self.log._stage_stats(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.log._stage["seconds"] += time.perf_counter() - self.start
+        self.log._stage = self.parent
+        return False
+
+
+class Logger:
+    """Leveled, buffered output of the exporter, with per stage counts of warnings and errors"""
+
+    def __init__(self, level=INFO, path=None, buffer_size=1 << 16):
+        self.level = level
+        self.debug_enabled = level <= DEBUG
+        self.info_enabled = level <= INFO
+        self.warning_enabled = level <= WARNING
+        self.path = path
+        self._file = open(path, "w", buffering=buffer_size) if path is not None else None
+        self.stages = OrderedDict()  # name -> {"seconds", "warnings", "errors"}
+        self._stage = self._stage_stats("export")
+
+    def _stage_stats(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = {"seconds": 0.0, "warnings": 0, "errors": 0}
+        return stats
+
+    def _write(self, level, msg, args):
+        if args:
+            msg = msg % args
+        out = self._file if self._file is not None else sys.stdout
+        out.write(LEVEL_NAMES[level] + ": " + msg + "\n")
+
+    def debug(self, msg, *args):
+        if self.debug_enabled:
+            self._write(DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        if self.info_enabled:
+            self._write(INFO, msg, args)
+
+    def warning(self, msg, *args):
+        self._stage["warnings"] += 1
+        if self.warning_enabled:
+            self._write(WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self._stage["errors"] += 1
+        self._write(ERROR, msg, args)
+
+    def stage(self, name):
+        """with log.stage(name): ... time the stage and count its warnings and errors"""
+        return _Stage(self, name)
+
+    def summary(self):
+        """One line per stage"""
+        lines = []
+        for name, stats in self.stages.items():
+            if name == "export" and stats["warnings"] == 0 and stats["errors"] == 0:
+                continue
+            line = "f3b: %s %.2fs" % (name, stats["seconds"])
+            if stats["warnings"]:
+                line += ", %d warnings" % stats["warnings"]
+            if stats["errors"]:
+                line += ", %d errors" % stats["errors"]
+            lines.append(line)
+        if self.path is not None:
+            lines.append("f3b: log written in " + self.path)
+        return lines
+
+    def close(self):
+        """Write the summary, to the log and to the console, and close the log file"""
+        lines = self.summary()
+        if self._file is not None:
+            for line in lines:
+                self._file.write(line + "\n")
+            self._file.close()
+            self._file = None
+        for line in lines:
+            sys.stdout.write(line + "\n")
+        sys.stdout.flush()
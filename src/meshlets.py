@@ -0,0 +1,147 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Splitting of the large exported meshes in spatially coherent clusters, for culling.
+
+The triangles are split by recursive bisection: every cluster with too many
+triangles or vertices is cut in two at the median of the triangle centroids
+along the longest axis of their bounds, all the clusters of a level at once.
+The triangles of a cluster keep their relative order (eg. the one of
+vertex_cache.py) and the vertices are renumbered in first use order, so the
+vertices of a cluster are mostly contiguous.
+
+The mesh keeps its vertex arrays and its one index array, with the triangles
+of each cluster contiguous: the ranges are written with the bounds in the
+cluster files (see f3b_encode.pack_clusters), so loaders that ignore the
+clusters still get the whole mesh.
+The bounds of each cluster are: an AABB, a bounding sphere and a normal cone
+(axis, cutoff and apex, as in meshoptimizer): the cluster faces away from a
+viewer at v if dot(normalize(v - apex), axis) < -sqrt(1 - cutoff^2). A cutoff
+<= 0 means the normals don't fit in a cone and the cluster can't be culled by
+them. Only numpy, so the clusters can be built and tested without blender.
+"""
+
+import numpy as np
+
+from .vertex_cache import first_use_order, reorder_vertices
+
+# Clusters of the size of the GPU meshlets
+MAX_VERTICES = 64
+MAX_TRIANGLES = 124
+
+
+def _segment_ids(starts, n):
+    """Segment of each of n items, for the segments starting at starts"""
+    ids = np.zeros(n, dtype=np.int64)
+    ids[starts[1:]] = 1
+    return np.cumsum(ids)
+
+
+def _vertex_counts(tris, segment, n_segments, n_verts):
+    """Distinct vertices of the triangles tris of each segment"""
+    keys = np.unique(segment[:, None] * n_verts + tris)
+    return np.bincount(keys // n_verts, minlength=n_segments)
+
+
+def build_clusters(positions, tris, max_vertices=MAX_VERTICES, max_triangles=MAX_TRIANGLES):
+    """
+    Clusters of the triangles tris [t,3], with at most max_vertices vertices and max_triangles triangles each.
+    Returns the triangles in cluster order [t] and the offsets of the clusters in it [c+1]
+    """
+    n_tris = len(tris)
+    n_verts = len(positions)
+    centroids = positions[tris].mean(axis=1)
+    order = np.arange(n_tris)
+    starts = np.zeros(1, dtype=np.int64)
+    while True:
+        sizes = np.diff(np.append(starts, n_tris))
+        split = sizes > max_triangles
+        # The vertices are counted only where the triangles fit, the other clusters are split anyway
+        check = np.flatnonzero(~split & (sizes > 1))
+        if len(check) > 0:
+            segment = _segment_ids(starts, n_tris)
+            counts = np.zeros(len(starts), dtype=np.int64)
+            checked = np.isin(segment, check)
+            counts[check] = _vertex_counts(tris[order[checked]], segment[checked], len(starts), n_verts)[check]
+            split |= counts > max_vertices
+        if not split.any():
+            break
+
+        segment = _segment_ids(starts, n_tris)
+        c = centroids[order]
+        extent = np.maximum.reduceat(c, starts) - np.minimum.reduceat(c, starts)
+        axis = np.argmax(extent, axis=1)
+        # Sort the triangles of the split clusters along their axis, the others keep their order
+        key = np.where(split[segment], c[np.arange(n_tris), axis[segment]], 0.0)
+        resort = np.lexsort((key, segment))
+        order = order[resort]
+        halves = starts[split] + sizes[split] // 2
+        starts = np.sort(np.concatenate((starts, halves)))
+
+    # Back to the original order inside each cluster
+    segment = _segment_ids(starts, n_tris)
+    order = order[np.lexsort((order, segment))]
+    return order, np.append(starts, n_tris)
+
+
+def cluster_bounds(positions, tris, offsets):
+    """
+    Bounds of the clusters of the triangles tris [t,3] (in cluster order), at offsets [c+1].
+    Returns a dict of arrays, one row per cluster: aabb_min, aabb_max, sphere_center [c,3], sphere_radius [c],
+    cone_axis, cone_apex [c,3], cone_cutoff [c]
+    """
+    starts = offsets[:-1]
+    segment = _segment_ids(starts, len(tris))
+    p = positions[tris].astype(np.float64)
+    lo = np.minimum.reduceat(p.min(axis=1), starts)
+    hi = np.maximum.reduceat(p.max(axis=1), starts)
+    center = (lo + hi) * 0.5
+    d = p - center[segment][:, None, :]
+    radius = np.sqrt(np.maximum.reduceat(np.einsum("tcj,tcj->tc", d, d).max(axis=1), starts))
+
+    n = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    length = np.sqrt(np.einsum("ij,ij->i", n, n))
+    valid = length > 0.0
+    n /= np.where(valid, length, 1.0)[:, None]
+    axis = np.add.reduceat(n, starts)
+    axis_length = np.sqrt(np.einsum("ij,ij->i", axis, axis))
+    axis /= np.where(axis_length > 0.0, axis_length, 1.0)[:, None]
+    # Degenerate triangles have no normal, they don't widen the cone
+    dn = np.where(valid, np.einsum("ij,ij->i", n, axis[segment]), 1.0)
+    cutoff = np.minimum.reduceat(dn, starts)
+    cutoff[axis_length == 0.0] = -1.0
+
+    # The apex is moved back along the axis until it is behind the planes of all the triangles
+    dc = np.einsum("ij,ij->i", -d[:, 0], n)
+    t = np.where(valid & (dn > 0.0), dc / np.where(dn > 0.0, dn, 1.0), 0.0)
+    apex = center - axis * np.maximum.reduceat(t, starts)[:, None]
+    apex[cutoff <= 0.0] = center[cutoff <= 0.0]
+    return {"aabb_min": lo, "aabb_max": hi, "sphere_center": center, "sphere_radius": radius,
+            "cone_axis": axis, "cone_apex": apex, "cone_cutoff": cutoff}
+
+
+def cluster_mesh(mesh, max_vertices=MAX_VERTICES, max_triangles=MAX_TRIANGLES):
+    """
+    Mesh with the triangles of mesh in cluster order and its vertices in first use order.
+    Returns the mesh, the offsets of the clusters in its triangles [c+1] and their bounds (see cluster_bounds)
+    """
+    tris = mesh.indexes.reshape(-1, 3)
+    order, offsets = build_clusters(mesh.positions, tris, max_vertices, max_triangles)
+    indexes = tris[order].ravel()
+    out = reorder_vertices(mesh, first_use_order(indexes, mesh.vertex_count()), indexes)
+    return out, offsets, cluster_bounds(out.positions, out.indexes.reshape(-1, 3), offsets)
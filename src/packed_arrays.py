@@ -0,0 +1,153 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Bulk writers for repeated scalar fields.
+
+The pure python protobuf bundled in libs/ type checks every element on
+extend() and struct.pack()s every element on serialization. write_array()
+encodes a whole numpy array as one packed field instead and attaches the
+bytes to the message, so they are written verbatim by SerializeToString().
+splice_message() does the same for whole messages that are already encoded.
+"""
+
+import numpy as np
+from google.protobuf.descriptor import FieldDescriptor
+
+WIRETYPE_LENGTH_DELIMITED = 2
+
+# field type -> (little endian dtype of the fixed size encoding, or None for varints, zigzag)
+_ENCODINGS = {
+    FieldDescriptor.TYPE_FLOAT: ("<f4", False),
+    FieldDescriptor.TYPE_DOUBLE: ("<f8", False),
+    FieldDescriptor.TYPE_FIXED32: ("<u4", False),
+    FieldDescriptor.TYPE_SFIXED32: ("<i4", False),
+    FieldDescriptor.TYPE_FIXED64: ("<u8", False),
+    FieldDescriptor.TYPE_SFIXED64: ("<i8", False),
+    FieldDescriptor.TYPE_INT32: (None, False),
+    FieldDescriptor.TYPE_INT64: (None, False),
+    FieldDescriptor.TYPE_UINT32: (None, False),
+    FieldDescriptor.TYPE_UINT64: (None, False),
+    FieldDescriptor.TYPE_BOOL: (None, False),
+    FieldDescriptor.TYPE_ENUM: (None, False),
+    FieldDescriptor.TYPE_SINT32: (None, True),
+    FieldDescriptor.TYPE_SINT64: (None, True),
+}
+
+
+def encode_varints(values):
+    """Encode an integer array as concatenated varints (negative values take 10 bytes, like protobuf)"""
+    v = np.asarray(values).astype(np.int64).view(np.uint64).ravel()
+    lengths = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += (v >> np.uint64(7 * k)) != 0
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(0, 10):
+        sel = np.flatnonzero(lengths > k)
+        if len(sel) == 0:
+            break
+        byte = (v[sel] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(lengths[sel] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[sel] + k] = byte
+    return out.tobytes()
+
+
+def encode_packed(field_type, values):
+    """Payload of a packed repeated field of type field_type holding values"""
+    dtype, zigzag = _ENCODINGS[field_type]
+    if dtype is not None:
+        return np.ascontiguousarray(values, dtype=dtype).tobytes()
+    values = np.asarray(values).astype(np.int64).ravel()
+    if zigzag:
+        values = (values << 1) ^ (values >> 63)
+    return encode_varints(values)
+
+
+def packed_field_bytes(field_number, field_type, values):
+    """Tag and length delimited body of a packed repeated field"""
+    return length_delimited(field_number, encode_packed(field_type, values))
+
+
+def write_array(msg, field_name, values):
+    """Append all values (any numpy array, flattened) to the repeated field msg.<field_name>"""
+    values = np.asarray(values).ravel()
+    if len(values) == 0:
+        return
+    field = msg.DESCRIPTOR.fields_by_name[field_name]
+    if isinstance(getattr(msg, "_unknown_fields", None), (list, tuple)) and field.type in _ENCODINGS:
+        # Pure python implementation: store the encoded field, it will be written as is
+        if not msg._unknown_fields:
+            msg._unknown_fields = []
+        msg._unknown_fields.append(packed_field_bytes(field.number, field.type, values))
+        msg._Modified()
+    else:
+        getattr(msg, field_name).extend(values.tolist())
+
+
+def decode_varint(data, pos):
+    """Decode the varint at data[pos], return (value, position after it)"""
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        result |= (b & 0x7f) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def strip_field(data, field_number):
+    """Remove every occurrence of the top level field field_number from an encoded message"""
+    out = []
+    pos = 0
+    while pos < len(data):
+        start = pos
+        tag, pos = decode_varint(data, pos)
+        wire_type = tag & 7
+        if wire_type == 0:
+            _, pos = decode_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            size, pos = decode_varint(data, pos)
+            pos += size
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type %d" % wire_type)
+        if tag >> 3 != field_number:
+            out.append(data[start:pos])
+    return b"".join(out)
+
+
+def length_delimited(field_number, body):
+    """Tag and body of a length delimited field (string, bytes or message)"""
+    return encode_varints([(field_number << 3) | WIRETYPE_LENGTH_DELIMITED]), encode_varints([len(body)]) + body
+
+
+def splice_message(msg, field_name, body):
+    """Append an already encoded message to the repeated message field msg.<field_name>"""
+    field = msg.DESCRIPTOR.fields_by_name[field_name]
+    if isinstance(getattr(msg, "_unknown_fields", None), (list, tuple)):
+        if not msg._unknown_fields:
+            msg._unknown_fields = []
+        msg._unknown_fields.append(length_delimited(field.number, body))
+        msg._Modified()
+    else:
+        getattr(msg, field_name).add().MergeFromString(body)
@@ -0,0 +1,148 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+import functools
+import inspect
+import json
+import os
+import time
+import tracemalloc
+from collections import OrderedDict
+
+PROFILE_VERSION = 2
+
+
+class _NoPhase:
+    """Context manager used when profiling is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        growth = tracemalloc.get_traced_memory()[0] - self.memory if self.profiler.trace_memory else 0
+        self.profiler._end(self.name, seconds, growth)
+        return False
+
+
+def profiled(fn):
+    """Profile each call of fn as a phase named after it, fn takes the ExportCfg as its cfg argument"""
+    name = fn.__name__
+    position = list(inspect.signature(fn).parameters).index("cfg")
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profiler = (kwargs["cfg"] if "cfg" in kwargs else args[position]).profiler
+        if not profiler.enabled:
+            return fn(*args, **kwargs)
+        with profiler.phase(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class Profiler:
+    """
+    Wall time and call count of the export phases and counters of the exported
+    entities. With trace_memory, also the peak memory traced while exporting and
+    the memory each phase keeps allocated (the largest growth of the traced memory
+    from the start to the end of one call). Tracing slows down the allocations,
+    so the times are only comparable between runs with the same trace_memory.
+    Phases can nest, the time of a phase includes the time of the ones it contains.
+    """
+
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.phases = OrderedDict()  # name -> {"calls", "seconds"[, "memory_growth"]}
+        self.counters = OrderedDict()
+        self.start = time.perf_counter()
+        self._started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def phase(self, name):
+        """with profiler.phase(name): ..."""
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    def _end(self, name, seconds, memory_growth):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {"calls": 0, "seconds": 0.0}
+            if self.trace_memory:
+                stats["memory_growth"] = 0
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        if self.trace_memory:
+            stats["memory_growth"] = max(stats["memory_growth"], memory_growth)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        report = OrderedDict()
+        report["version"] = PROFILE_VERSION
+        report["seconds"] = time.perf_counter() - self.start
+        report["phases"] = self.phases
+        report["counters"] = self.counters
+        if self.trace_memory:
+            report["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    def summary(self, top=3):
+        """One line: total time, slowest phases and peak memory"""
+        report = self.report()
+        slowest = sorted(self.phases.items(), key=lambda p: p[1]["seconds"], reverse=True)[:top]
+        text = "Exported in %.2fs (%s)" % (report["seconds"], ", ".join("%s %.2fs" % (name, s["seconds"]) for name, s in slowest))
+        if self.trace_memory:
+            text += ", peak memory %.1fMB" % (report["peak_memory"] / (1024.0 * 1024.0))
+        return text
+
+    def write(self, path):
+        if not self.enabled:
+            return
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp, path)
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -0,0 +1,75 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+
+class SceneIndex:
+    """Objects of a scene classified in a single pass, shared by all the export_all_* stages"""
+
+    def __init__(self, scene, cfg):
+        self.scene = scene
+        self.objects = []  # exportable objects (not hidden from render, selected if needed), in scene order
+        self.by_type = {}  # obj.type -> exportable objects
+        self.armatures = []  # all the armatures of the scene, exportable or not
+        self.animated = []  # all the objects with animation data
+        self.animated_set = set()  # the same, for membership tests
+        self.data_users = {}  # data-block -> all the objects using it
+        self.materials = []  # materials of the exportable meshes, in first use order
+        self.colliders = []  # exportable meshes with a collision modifier
+        self.emitters = []  # exportable objects with particle systems
+        self.physics = []  # exportable objects with a rigid body or a rigid body constraint
+
+        seen_materials = set()
+        for obj in scene.objects:
+            if obj.type == 'ARMATURE':
+                self.armatures.append(obj)
+            if obj.animation_data:
+                self.animated.append(obj)
+                self.animated_set.add(obj)
+            if obj.data is not None:
+                self.data_users.setdefault(obj.data, []).append(obj)
+
+            if obj.hide_render or (cfg.option_export_selection and not obj.select):
+                continue
+            self.objects.append(obj)
+            self.by_type.setdefault(obj.type, []).append(obj)
+
+            if obj.type == 'MESH':
+                for slot in obj.material_slots:
+                    material = slot.material
+                    if material is not None and material not in seen_materials:
+                        seen_materials.add(material)
+                        self.materials.append(material)
+                if any(m.type == "COLLISION" for m in obj.modifiers):
+                    self.colliders.append(obj)
+            if len(obj.particle_systems) > 0:
+                self.emitters.append(obj)
+            if obj.rigid_body or obj.rigid_body_constraint:
+                self.physics.append(obj)
+
+    def of_type(self, obj_type):
+        return self.by_type.get(obj_type, [])
+
+    def users_of(self, data):
+        return self.data_users.get(data, [])
+
+
+def index_of(scene, cfg):
+    """Return the SceneIndex of scene, built on first use and kept in cfg"""
+    index = cfg.scene_index
+    if index is None or index.scene != scene:
+        index = cfg.scene_index = SceneIndex(scene, cfg)
+    return index
@@ -0,0 +1,353 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Simplification of the exported meshes, for the LOD chains.
+
+Quadric error edge collapses, done in passes over the whole mesh with numpy:
+each pass computes the cost of moving every point onto each of its
+neighbours where it flips no triangle, takes the collapses in cost order
+skipping the ones next to a point already moving (so no triangle has two
+moving points) and applies them all at once. A pass moves a large part of
+the points, so a level takes a few passes.
+
+Collapses are half edge collapses: the removed vertex takes the attributes of
+the one it is collapsed onto, nothing is interpolated, so normals, uvs,
+tangents and skin weights stay the ones of the exported vertices. They are
+done on points (the vertices at the same position), so the vertices split by
+uv seams and hard edges move together, and only along the seam: a point is
+moved only if each of its vertices has a neighbour at the target point. Open
+borders are never moved, and a point is only moved onto one that its main
+bone influences, so the skin weights don't bleed across bones.
+"""
+
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .Mesh import Mesh
+from .mesh_builder import gather_skin
+from .weld import pack_keys, dedup_keys
+
+# Candidate collapses evaluated at once, bounds the memory of the quadric gathers
+COST_CHUNK = 1 << 20
+# Candidate collapses checked for flips at once, each one checks the triangles around its point
+FLIP_CHUNK = 1 << 17
+# Cosine between the normals of a triangle before and after a collapse below which it is considered flipped
+MIN_FLIP_COSINE = 0.2
+# The LOD chain stops when a level would have fewer triangles than this
+MIN_LOD_TRIANGLES = 32
+
+# Components of the symmetric 4x4 quadric stored per vertex, and their weight in v^T Q v
+_QI, _QJ = np.triu_indices(4)
+_QWEIGHT = np.where(_QI == _QJ, 1.0, 2.0)
+
+
+def face_quadrics(positions, tris):
+    """Area weighted plane quadric of every triangle, as the 10 upper components [t,10]"""
+    p = positions[tris]
+    n = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    double_area = np.sqrt(np.einsum("ij,ij->i", n, n))
+    n /= np.where(double_area > 0.0, double_area, 1.0)[:, None]
+    plane = np.column_stack((n, -np.einsum("ij,ij->i", n, p[:, 0])))
+    return plane[:, _QI] * plane[:, _QJ] * (0.5 * double_area)[:, None]
+
+
+def vertex_quadrics(positions, tris):
+    """Sum of the quadrics of the triangles around every vertex [v,10]"""
+    fq = face_quadrics(positions, tris)
+    corners = tris.ravel()
+    per_corner = np.repeat(fq, 3, axis=0)
+    return np.column_stack([np.bincount(corners, per_corner[:, c], minlength=len(positions)) for c in range(10)])
+
+
+def quadric_cost(quadrics, src, dst, positions):
+    """Error of moving src onto dst, (Q[src] + Q[dst]) evaluated at the position of dst"""
+    cost = np.empty(len(src))
+    for start in range(0, len(src), COST_CHUNK):
+        s = src[start:start + COST_CHUNK]
+        d = dst[start:start + COST_CHUNK]
+        v = np.column_stack((positions[d], np.ones(len(d))))
+        monomials = v[:, _QI] * v[:, _QJ] * _QWEIGHT
+        cost[start:start + COST_CHUNK] = np.einsum("ij,ij->i", quadrics[s] + quadrics[d], monomials)
+    return np.maximum(cost, 0.0)
+
+
+def edges_of(tris, n_verts):
+    """Unique undirected edges [e,2] of the triangles, and the number of triangles on each"""
+    a = tris.ravel()
+    b = tris[:, [1, 2, 0]].ravel()
+    keys = np.minimum(a, b) * n_verts + np.maximum(a, b)
+    keys, counts = np.unique(keys, return_counts=True)
+    return np.column_stack((keys // n_verts, keys % n_verts)), counts
+
+
+def flips(positions, gtris, src, dst):
+    """
+    Whether moving the point src onto dst flips one of the triangles gtris around src, for each collapse.
+    src is sorted, the other points of the triangles don't move
+    """
+    n_points = len(positions)
+    flat = gtris.ravel()
+    corners = np.argsort(flat, kind="stable")
+    starts = np.searchsorted(flat[corners], np.arange(n_points + 1))
+    # The two other points of every corner, in the order of the triangle
+    others = np.column_stack((gtris[:, [1, 2, 0]].ravel(), gtris[:, [2, 0, 1]].ravel()))[corners]
+    p = positions[gtris]
+    n_old = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])[corners // 3]
+    # By component, the gathers of single columns are much faster than the ones of rows
+    x, y, z = np.array(positions.T)
+    ox, oy, oz = np.array(n_old.T)
+    old_norms = ox * ox + oy * oy + oz * oz
+    bad = np.zeros(len(src), dtype=bool)
+    for start in range(0, len(src), FLIP_CHUNK):
+        s = src[start:start + FLIP_CHUNK]
+        counts = starts[s + 1] - starts[s]
+        collapse = np.repeat(np.arange(len(s)), counts)
+        corner = np.arange(len(collapse)) - np.repeat(np.cumsum(counts) - counts - starts[s], counts)
+        u = others[corner, 0]
+        v = others[corner, 1]
+        d = dst[start:start + FLIP_CHUNK][collapse]
+        # The triangles with both points are removed by the collapse
+        alive = (u != d) & (v != d)
+        collapse = collapse[alive]
+        corner = corner[alive]
+        u = u[alive]
+        v = v[alive]
+        d = d[alive]
+        ax, ay, az = x[u] - x[d], y[u] - y[d], z[u] - z[d]
+        bx, by, bz = x[v] - x[d], y[v] - y[d], z[v] - z[d]
+        nx, ny, nz = ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx
+        dot = ox[corner] * nx + oy[corner] * ny + oz[corner] * nz
+        norms = np.sqrt(old_norms[corner] * (nx * nx + ny * ny + nz * nz))
+        bad[start + collapse[dot <= MIN_FLIP_COSINE * norms]] = True
+    return bad
+
+
+def influence_table(mesh):
+    """
+    Bones influencing every vertex [v,k], by decreasing weight and padded with -2, -1 for the vertices
+    without influences. None if the mesh is not skinned
+    """
+    if not mesh.has_skin:
+        return None
+    counts = mesh.skin.boneCount
+    table = np.full((len(counts), max(1, int(counts.max()) if len(counts) else 1)), -2, dtype=np.int32)
+    table[counts == 0, 0] = -1
+    rows = np.repeat(np.arange(len(counts)), counts)
+    columns = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    table[rows, columns] = mesh.skin.boneIndex
+    return table
+
+
+def collapse_pass(tris, geo, positions, normals, quadrics, bones, max_collapses):
+    """
+    Choose up to max_collapses independent collapses of the triangles tris.
+    geo maps the vertices to the points they are at, positions, normals (of one of their vertices),
+    quadrics and bones (see influence_table) are per point.
+    Returns the map of every vertex to the one it is collapsed onto and the collapsed points (src, dst)
+    """
+    n_verts = len(geo)
+    n_points = len(positions)
+    gtris = geo[tris]
+    edges, counts = edges_of(gtris, n_points)
+    # Open borders and non manifold edges don't move
+    locked = np.zeros(n_points, dtype=bool)
+    locked[edges[counts != 2].ravel()] = True
+
+    # The neighbour vertices of every vertex, by point: (a, point of b) -> the first b
+    a = np.concatenate((tris.ravel(), tris[:, [1, 2, 0]].ravel()))
+    b = np.concatenate((tris[:, [1, 2, 0]].ravel(), tris.ravel()))
+    order = np.lexsort((b, geo[b], a))
+    a = a[order]
+    b = b[order]
+    first = np.ones(len(a), dtype=bool)
+    first[1:] = (a[1:] != a[:-1]) | (geo[b[1:]] != geo[b[:-1]])
+    a = a[first]
+    b = b[first]
+
+    # A point can move onto a neighbour only if all its vertices (eg. both sides of a uv seam) are next
+    # to a vertex of the neighbour, they are moved onto it and the seam is kept
+    copies = np.bincount(geo[np.unique(tris)], minlength=n_points)
+    pair, adjacent = np.unique(geo[a] * n_points + geo[b], return_counts=True)
+    src = pair // n_points
+    dst = pair % n_points
+    ok = (adjacent == copies[src]) & ~locked[src]
+    if bones is not None:
+        # The point moved onto must be influenced by the main bone of the removed one
+        ok &= (bones[dst] == bones[src, :1]).any(axis=1)
+    src = src[ok]
+    dst = dst[ok]
+    ok = ~flips(positions, gtris, src, dst)
+    src = src[ok]
+    dst = dst[ok]
+    if len(src) == 0:
+        return None, src, dst
+
+    d = positions[src] - positions[dst]
+    bend = 1.0 - np.einsum("ij,ij->i", normals[src], normals[dst])
+    cost = quadric_cost(quadrics, src, dst, positions) + bend * np.einsum("ij,ij->i", d, d)
+    order = np.argsort(cost, kind="stable")
+    src = src[order]
+    dst = dst[order]
+
+    # Queue of the collapses in cost order: one is taken if its point is not next to a point already
+    # moving, so there is at most one moving point per triangle and the flips checked above stay valid
+    neighbours = np.concatenate((edges, edges[:, ::-1]))
+    neighbours = neighbours[np.argsort(neighbours[:, 0], kind="stable")]
+    starts = np.searchsorted(neighbours[:, 0], np.arange(n_points + 1)).tolist()
+    neighbours = neighbours[:, 1].tolist()
+    frozen = bytearray(n_points)
+    chosen = []
+    for i, p in enumerate(src.tolist()):
+        if frozen[p]:
+            continue
+        chosen.append(i)
+        if len(chosen) >= max_collapses:
+            break
+        frozen[p] = 1
+        for k in range(starts[p], starts[p + 1]):
+            frozen[neighbours[k]] = 1
+    src = src[chosen]
+    dst = dst[chosen]
+    moving = np.zeros(n_points, dtype=bool)
+    moving[src] = True
+    target = np.arange(n_points)
+    target[src] = dst
+    # Every vertex of a moving point goes onto its neighbour vertex at the target point
+    remap = np.arange(n_verts)
+    moves = moving[geo[a]] & (geo[b] == target[geo[a]])
+    remap[a[moves]] = b[moves]
+    return remap, src, dst
+
+
+def compact(mesh, tris):
+    """Mesh with the attributes of mesh for the vertices used by the triangles tris"""
+    used, indexes = np.unique(tris.ravel(), return_inverse=True)
+    out = Mesh()
+    out.indexes = indexes.astype(np.int32)
+    out.positions = mesh.positions[used]
+    out.normals = mesh.normals[used]
+    out.texcoords = [uv[used] for uv in mesh.texcoords]
+    out.tangents = [tg[used] for tg in mesh.tangents]
+    if mesh.colors is not None:
+        out.colors = mesh.colors[used]
+    if mesh.has_skin:
+        counts = mesh.skin.boneCount
+        offsets = np.cumsum(counts) - counts
+        gather_skin((counts, offsets, mesh.skin.boneIndex, mesh.skin.boneWeight), used, out)
+    return out
+
+
+def simplify(mesh, target_triangles, max_passes=100):
+    """Mesh simplified to about target_triangles, or as close as the locked vertices allow"""
+    tris = mesh.indexes.reshape(-1, 3).astype(np.int64)
+    # The vertices split by the welding (seams, hard edges) are the same point
+    rep, geo = dedup_keys(pack_keys(mesh.positions))
+    geo = geo.astype(np.int64)
+    positions = mesh.positions[rep].astype(np.float64)
+    normals = mesh.normals[rep].astype(np.float64)
+    quadrics = vertex_quadrics(positions, geo[tris])
+    bones = influence_table(mesh)
+    if bones is not None:
+        bones = bones[rep]
+    for _ in range(max_passes):
+        excess = len(tris) - target_triangles
+        if excess <= 0:
+            break
+        # Each collapse removes about two triangles
+        remap, src, dst = collapse_pass(tris, geo, positions, normals, quadrics, bones, max(1, (excess + 1) // 2))
+        if len(src) == 0:
+            break
+        quadrics[dst] += quadrics[src]
+        tris = remap[tris]
+        g = geo[tris]
+        tris = tris[(g[:, 0] != g[:, 1]) & (g[:, 1] != g[:, 2]) & (g[:, 2] != g[:, 0])]
+    return compact(mesh, tris)
+
+
+def lod_chain(mesh, levels, ratio):
+    """
+    Up to levels simplified meshes, level k having about ratio^k of the triangles of mesh.
+    The chain stops early when a level can't be simplified any further
+    """
+    chain = []
+    triangles = len(mesh.indexes) // 3
+    current = mesh
+    for level in range(1, levels + 1):
+        target = int(triangles * ratio ** level)
+        if target < MIN_LOD_TRIANGLES:
+            break
+        lod = simplify(current, target)
+        if len(lod.indexes) >= len(current.indexes):
+            break
+        chain.append(lod)
+        current = lod
+    return chain
+
+
+def lod_screen_size(screen_size, ratio, level):
+    """
+    Screen size (fraction of the screen height) below which the LOD level replaces the previous one.
+    The triangles of a level are ratio times the ones of the previous one, so the size is scaled by
+    sqrt(ratio) at each level to keep the same triangles per pixel
+    """
+    return screen_size * math.sqrt(ratio) ** (level - 1)
+
+
+class LodQueue:
+    """The LOD chains of the exported meshes, computed by a pool of threads while the export goes on"""
+
+    def __init__(self, levels, ratio, max_workers=None):
+        self.levels = levels
+        self.ratio = ratio
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = None
+        self.jobs = deque()
+
+    def submit(self, key, mesh):
+        """Compute the LOD chain of mesh, returned with key by results()"""
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.jobs.append((key, self.pool.submit(lod_chain, mesh, self.levels, self.ratio)))
+
+    def results(self, wait=True):
+        """
+        (key, chain) of the submitted meshes, in order, removed from the queue once returned.
+        Without wait, only the ones finished before the first one still running
+        """
+        while self.jobs and (wait or self.jobs[0][1].done()):
+            key, job = self.jobs[0]
+            chain = job.result()
+            self.jobs.popleft()
+            yield key, chain
+
+    def keys(self):
+        """Keys of the meshes whose chains are not returned yet"""
+        return [key for key, _ in self.jobs]
+
+    def close(self):
+        """Drop the pending chains and stop the threads"""
+        for _, job in self.jobs:
+            job.cancel()
+        self.jobs.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
@@ -0,0 +1,274 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Scene snapshots: the export split in a capture done in blender and a conversion
+done anywhere else.
+
+The capture runs the exporter with cfg.snapshot set. The entities that are
+cheap to export (nodes, materials, lights, skeletons, physics, relations...)
+are exported as usual, but the meshes and the sampled transforms are left
+empty: the raw arrays read from blender (the loop attributes of every mesh,
+see read_mesh_arrays, and the matrices sampled by the animations) are kept
+instead. Everything is saved in one .npz file:
+    meta   json: version, export settings, mesh sources and where their
+           meshes and clips are in data
+    data   the encoded Data message, without the mesh and clip arrays
+    mesh<k>.*, clip<k>.*   the raw arrays
+
+convert() fills the meshes (welding, tangents, skin, LODs, vertex cache order,
+clusters, with their cluster files next to the f3b file) and the clips
+(repeated samples removal, decomposition, keyframe reduction) from the raw
+arrays and writes the f3b file. It only needs numpy and the f3b library, so it can run
+without blender, on many files at once (see snapshot_convert.py), and again
+with other settings without capturing the scene again.
+"""
+
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+import f3b
+import f3b.datas_pb2
+import numpy as np
+
+from .mesh_builder import build_submeshes
+from .f3b_encode import export_mesh_arrays, store_sampled_transform, export_lod, link_lod, export_clusters, pack_clusters, clusters_rpath
+from .simplify import lod_chain, lod_screen_size
+from .vertex_cache import Report as VertexCacheReport
+from .meshlets import cluster_mesh
+from .keyframe_reduction import Tolerances
+from .data_writer import DataWriter
+from .logger import Logger
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXT = ".f3bsnap.npz"
+
+
+def snapshot_path(f3b_path):
+    """Path of the snapshot captured for the f3b file f3b_path"""
+    return os.path.splitext(f3b_path)[0] + SNAPSHOT_EXT
+
+
+def f3b_path(path):
+    """Path of the f3b file converted from the snapshot path"""
+    if path.endswith(SNAPSHOT_EXT):
+        return path[:-len(SNAPSHOT_EXT)] + ".f3b"
+    return os.path.splitext(path)[0] + ".f3b"
+
+
+def _bytes_array(body):
+    return np.frombuffer(body, dtype=np.uint8)
+
+
+class SnapshotWriter:
+    """Raw arrays kept by a capture, saved with the Data message they complete"""
+
+    def __init__(self):
+        self.arrays = OrderedDict()
+        self.sources = []  # what each mesh<k> source holds
+        self.meshes = []  # (mesh message, source, material index)
+        self.clips = []  # sampled_transform message of each clip<k>
+
+    def add_mesh_source(self, arrays):
+        """Keep the loop attributes of a whole mesh (see read_mesh_arrays), returns their source key"""
+        k = len(self.sources)
+        prefix = "mesh%d." % k
+        for name in ("poly_material", "poly_loops", "loop_vertex", "positions", "normals"):
+            self.arrays[prefix + name] = arrays[name]
+        for i, uv in enumerate(arrays["texcoords"]):
+            self.arrays[prefix + "texcoord%d" % i] = uv
+        for i, tangents in enumerate(arrays["tangents"]):
+            self.arrays[prefix + "tangent%d" % i] = tangents
+        if arrays["colors"] is not None:
+            self.arrays[prefix + "colors"] = arrays["colors"]
+        if arrays["influences"] is not None:
+            for name, a in zip(("bone_count", "bone_offset", "bone_index", "bone_weight"), arrays["influences"]):
+                self.arrays[prefix + name] = a
+        self.sources.append({"texcoords": len(arrays["texcoords"]), "tangents": len(arrays["tangents"]),
+                             "colors": arrays["colors"] is not None, "skin": arrays["influences"] is not None})
+        return k
+
+    def add_mesh(self, dst_mesh, source, material_index):
+        """dst_mesh is the sub mesh of material_index of the source mesh"""
+        self.meshes.append((dst_mesh, source, material_index))
+
+    def store_sampled_transform(self, dst, times, mats, tolerances=None):
+        """Keep the samples of dst, like f3b_encode.store_sampled_transform. The tolerances are the ones of the settings"""
+        k = len(self.clips)
+        self.arrays["clip%d.times" % k] = np.array(times, dtype=np.int64)
+        self.arrays["clip%d.mats" % k] = np.array(mats, dtype=np.float64)
+        self.clips.append(dst)
+        return len(times)
+
+    def save(self, path, data, settings, log=None):
+        """Write the snapshot of data to path. settings are the ones convert() uses by default"""
+        log = log or Logger()
+        paths = message_paths(data)
+        meshes = []
+        for dst, source, material_index in self.meshes:
+            if id(dst) not in paths:
+                log.warning("Mesh %s is not part of the exported data, not saved", dst.id)
+                continue
+            meshes.append({"path": paths[id(dst)], "source": source, "material_index": material_index})
+        clips = []
+        for k, dst in enumerate(self.clips):
+            if id(dst) not in paths:
+                log.warning("Clip %s is not part of the exported data, not saved", dst.bone_name)
+                continue
+            clips.append({"path": paths[id(dst)], "key": k})
+        meta = {"version": SNAPSHOT_VERSION, "settings": settings, "sources": self.sources, "meshes": meshes, "clips": clips}
+        arrays = OrderedDict()
+        arrays["meta"] = _bytes_array(json.dumps(meta).encode("utf-8"))
+        arrays["data"] = _bytes_array(data.SerializeToString())
+        arrays.update(self.arrays)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+        log.info("Snapshot of %d meshes and %d clips written in %s", len(meshes), len(clips), path)
+
+
+def message_paths(data):
+    """id of the mesh and sampled_transform messages of data -> their path in data, as a list of fields and indexes"""
+    paths = {}
+    for i, mesh in enumerate(data.meshes):
+        paths[id(mesh)] = ["meshes", i]
+    for e, emitter in enumerate(data.cr_emitters):
+        for i, mesh in enumerate(emitter.meshes):
+            paths[id(mesh)] = ["cr_emitters", e, "meshes", i]
+    for a, animation in enumerate(data.animations_kf):
+        for c, clip in enumerate(animation.clips):
+            paths[id(clip.sampled_transform)] = ["animations_kf", a, "clips", c, "sampled_transform"]
+    return paths
+
+
+def resolve(data, path):
+    """Message at path in data, see message_paths"""
+    msg = data
+    for step in path:
+        msg = msg[step] if isinstance(step, int) else getattr(msg, step)
+    return msg
+
+
+def read_mesh_source(snapshot, k, source):
+    """Loop attributes of the source mesh k, as expected by build_submeshes"""
+    prefix = "mesh%d." % k
+    arrays = {name: snapshot[prefix + name] for name in ("poly_material", "poly_loops", "loop_vertex", "positions", "normals")}
+    arrays["texcoords"] = [snapshot[prefix + "texcoord%d" % i] for i in range(source["texcoords"])]
+    arrays["tangents"] = [snapshot[prefix + "tangent%d" % i] for i in range(source["tangents"])]
+    arrays["colors"] = snapshot[prefix + "colors"] if source["colors"] else None
+    arrays["influences"] = None
+    if source["skin"]:
+        arrays["influences"] = tuple(snapshot[prefix + name] for name in ("bone_count", "bone_offset", "bone_index", "bone_weight"))
+    return arrays
+
+
+def write_asset(assets_path, rpath, body):
+    """Write body in assets_path/rpath, unless it is already there (rpath is named after the content)"""
+    output_file = os.path.join(assets_path, rpath)
+    if os.path.exists(output_file):
+        return
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    # Other converters may write it at the same time
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(output_file))
+    with os.fdopen(fd, "wb") as f:
+        f.write(body)
+    os.replace(tmp, output_file)
+
+
+def convert(path, out_path, settings=None, max_workers=None, log=None):
+    """
+    Write the f3b file of the snapshot path to out_path.
+    settings override the ones of the capture (remove_doubles, weld_epsilon, keyframe_tolerances,
+    lod_levels, lod_ratio, lod_screen_size, optimize_vertex_cache, cluster_threshold, cluster_max_vertices,
+    cluster_max_triangles).
+    Returns the number of meshes and of keys written
+    """
+    log = log or Logger()
+    with np.load(path, allow_pickle=False) as snapshot:
+        meta = json.loads(bytes(snapshot["meta"]).decode("utf-8"))
+        if meta["version"] != SNAPSHOT_VERSION:
+            raise ValueError("%s: snapshot version %s, expected %d" % (path, meta["version"], SNAPSHOT_VERSION))
+        cfg = {"lod_levels": 0, "lod_ratio": 0.5, "lod_screen_size": 0.5, "optimize_vertex_cache": False,
+               "cluster_threshold": 0, "cluster_max_vertices": 64, "cluster_max_triangles": 124}
+        cfg.update(meta["settings"])
+        cfg.update(settings or {})
+        data = f3b.datas_pb2.Data()
+        data.MergeFromString(bytes(snapshot["data"]))
+
+        # The LOD chains of the scene meshes (not the ones of the emitters) are computed while the other meshes are built
+        lod_pool = ThreadPoolExecutor(max_workers=max_workers) if cfg["lod_levels"] > 0 else None
+        lod_jobs = []
+        vertex_cache = VertexCacheReport() if cfg["optimize_vertex_cache"] else None
+        targets = [[] for _ in meta["sources"]]
+        for mesh in meta["meshes"]:
+            targets[mesh["source"]].append(mesh)
+        for k, source in enumerate(meta["sources"]):
+            if not targets[k]:
+                continue
+            arrays = read_mesh_source(snapshot, k, source)
+            submeshes = build_submeshes(arrays, cfg["remove_doubles"], cfg["weld_epsilon"],
+                                        set(mesh["material_index"] for mesh in targets[k]), max_workers)
+            for mesh in targets[k]:
+                dst = resolve(data, mesh["path"])
+                out_mesh = submeshes[mesh["material_index"]]
+                if log.debug_enabled:
+                    log.debug("Mesh %s: %d indices, %d unique vertices", dst.name, len(out_mesh.indexes), out_mesh.vertex_count())
+                if vertex_cache is not None:
+                    out_mesh = vertex_cache.optimize(out_mesh)[0]
+                scene_mesh = mesh["path"][0] == "meshes"
+                clusters = None
+                if scene_mesh and cfg["cluster_threshold"] > 0 and len(out_mesh.indexes) // 3 > cfg["cluster_threshold"]:
+                    out_mesh, clusters, bounds = cluster_mesh(out_mesh, cfg["cluster_max_vertices"], cfg["cluster_max_triangles"])
+                    body = pack_clusters(clusters, bounds)
+                    rpath = clusters_rpath(body)
+                    write_asset(os.path.dirname(os.path.abspath(out_path)), rpath, body)
+                    export_clusters(data, dst.id, len(clusters) - 1, rpath)
+                export_mesh_arrays(out_mesh, dst)
+                if lod_pool is not None and scene_mesh:
+                    lod_jobs.append((dst.id, dst.name, lod_pool.submit(lod_chain, out_mesh, cfg["lod_levels"], cfg["lod_ratio"])))
+
+        lods = 0
+        for base_id, base_name, job in lod_jobs:
+            for level, lod in enumerate(job.result(), 1):
+                if vertex_cache is not None:
+                    lod = vertex_cache.optimize(lod)[0]
+                export_lod(lod, data.meshes.add(), base_id, base_name, level)
+                link_lod(data, base_id, level, lod_screen_size(cfg["lod_screen_size"], cfg["lod_ratio"], level))
+                lods += 1
+        if lod_pool is not None:
+            lod_pool.shutdown()
+        if vertex_cache is not None:
+            log.info("Vertex cache: %s", vertex_cache.summary())
+
+        tolerances = Tolerances(*cfg["keyframe_tolerances"]) if cfg["keyframe_tolerances"] is not None else None
+        keys = 0
+        for clip in meta["clips"]:
+            k = clip["key"]
+            keys += store_sampled_transform(resolve(data, clip["path"]), snapshot["clip%d.times" % k], snapshot["clip%d.mats" % k], tolerances)
+
+    writer = DataWriter(out_path)
+    try:
+        writer.close(data)
+    except:
+        writer.abort()
+        raise
+    log.info("%s: %d meshes, %d LODs, %d keys written in %s", path, len(meta["meshes"]), lods, keys, out_path)
+    return len(meta["meshes"]), keys
@@ -0,0 +1,146 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Conversion of scene snapshots to f3b, without blender.
+
+    python3 f3b_exporter/snapshot_convert.py [options] snapshots...
+
+The snapshots are captured with the "Snapshot Only" export option (or
+batch_export.py --snapshot), see snapshot.py. Each snapshot is converted by
+one of --workers processes. The settings of the capture are used unless they
+are overridden, so a snapshot can be converted again with other ones.
+Needs numpy and the libraries bundled with the addon.
+"""
+
+import argparse
+import importlib
+import math
+import os
+import sys
+import time
+import traceback
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="snapshot_convert.py", description="Convert scene snapshots to f3b")
+    parser.add_argument("snapshots", nargs="+", help=".f3bsnap.npz files")
+    parser.add_argument("--output-dir", default=None, help="Where to write the .f3b files (default: next to each snapshot)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Snapshots converted at once")
+    parser.add_argument("--remove-doubles", dest="remove_doubles", action="store_const", const=True, default=None)
+    parser.add_argument("--keep-doubles", dest="remove_doubles", action="store_const", const=False)
+    parser.add_argument("--weld-epsilon", type=float, default=None)
+    parser.add_argument("--lod-levels", type=int, default=None)
+    parser.add_argument("--lod-ratio", type=float, default=None)
+    parser.add_argument("--lod-screen-size", type=float, default=None)
+    parser.add_argument("--cluster-threshold", type=int, default=None)
+    parser.add_argument("--cluster-vertices", dest="cluster_max_vertices", type=int, default=None)
+    parser.add_argument("--cluster-triangles", dest="cluster_max_triangles", type=int, default=None)
+    parser.add_argument("--optimize-vertex-cache", dest="optimize_vertex_cache", action="store_const", const=True, default=None)
+    parser.add_argument("--no-optimize-vertex-cache", dest="optimize_vertex_cache", action="store_const", const=False)
+    parser.add_argument("--reduce-keyframes", dest="reduce_keyframes", action="store_const", const=True, default=None)
+    parser.add_argument("--no-reduce-keyframes", dest="reduce_keyframes", action="store_const", const=False)
+    parser.add_argument("--translation-tolerance", type=float, default=0.001)
+    parser.add_argument("--rotation-tolerance", type=float, default=0.1, help="Degrees")
+    parser.add_argument("--scale-tolerance", type=float, default=0.001)
+    parser.add_argument("--log-level", choices=["QUIET", "INFO", "DEBUG"], default="INFO")
+    return parser.parse_args(argv)
+
+
+def settings_of(args):
+    """The settings overridden by args, see snapshot.convert"""
+    settings = {}
+    if args.remove_doubles is not None:
+        settings["remove_doubles"] = args.remove_doubles
+    if args.weld_epsilon is not None:
+        settings["weld_epsilon"] = args.weld_epsilon
+    for name in ("lod_levels", "lod_ratio", "lod_screen_size", "optimize_vertex_cache", "cluster_threshold", "cluster_max_vertices", "cluster_max_triangles"):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+    if args.reduce_keyframes is not None:
+        settings["keyframe_tolerances"] = None
+        if args.reduce_keyframes:
+            settings["keyframe_tolerances"] = [args.translation_tolerance, math.radians(args.rotation_tolerance), args.scale_tolerance]
+    return settings
+
+
+def import_addon(name):
+    """Module name of the addon this script is part of, without running its __init__ (that needs bpy)"""
+    package = os.path.basename(ADDON_DIR)
+    if package not in sys.modules:
+        libs = os.path.join(ADDON_DIR, "libs")
+        for path in sorted(os.listdir(libs)):
+            sys.path.append(os.path.join(libs, path))
+        module = types.ModuleType(package)
+        module.__path__ = [ADDON_DIR]
+        sys.modules[package] = module
+    return importlib.import_module(package + "." + name)
+
+
+def convert_one(job):
+    """Convert one snapshot, in a worker process. Returns its result"""
+    path, out_path, settings, log_level = job
+    snapshot = import_addon("snapshot")
+    logger = import_addon("logger")
+    result = {"file": path, "output": out_path}
+    start = time.time()
+    log = logger.Logger(logger.LEVELS[log_level], os.path.splitext(out_path)[0] + ".log")
+    try:
+        result["meshes"], result["keys"] = snapshot.convert(path, out_path, settings, log=log)
+        result["ok"] = True
+    except Exception:
+        log.error("Conversion failed")
+        result["ok"] = False
+        result["error"] = traceback.format_exc()
+    finally:
+        log.close()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def main(argv):
+    args = parse_args(argv[1:])
+    snapshot = import_addon("snapshot")
+    settings = settings_of(args)
+    jobs = []
+    for path in args.snapshots:
+        out_path = snapshot.f3b_path(os.path.abspath(path))
+        if args.output_dir:
+            out_path = os.path.join(os.path.abspath(args.output_dir), os.path.basename(out_path))
+        jobs.append((os.path.abspath(path), out_path, settings, args.log_level))
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(jobs)))) as pool:
+        for result in pool.map(convert_one, jobs):
+            if result["ok"]:
+                print("f3b: %s -> %s, %d meshes, %d keys in %.2fs" % (result["file"], result["output"], result["meshes"], result["keys"], result["seconds"]))
+            else:
+                failed += 1
+                print("f3b: FAILED %s\n%s" % (result["file"], result["error"]))
+    print("f3b: converted %d snapshots, %d failed, in %.2fs" % (len(jobs) - failed, failed, time.time() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,108 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Batched processing of sampled 4x4 matrices (row major, [n,4,4]):
+removal of repeated samples and decomposition like mathutils Matrix.decompose().
+"""
+
+import numpy as np
+
+
+def changed_samples(mats, max_cell_delta):
+    """
+    Indexes of the samples to keep: the first one, every sample that differs from
+    the last kept one by more than max_cell_delta in any cell, and the last sample
+    of each run of equal samples followed by a change (so the hold is not interpolated).
+    """
+    n = len(mats)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    flat = mats.reshape(n, -1)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    # The last kept sample is the previous one or within max_cell_delta of it, so a
+    # step above twice max_cell_delta from the previous sample is always kept
+    jumps = np.any(np.abs(flat[1:] - flat[:-1]) > 2 * max_cell_delta, axis=1).tolist()
+    # The others depend on the previous decisions, so one scan in order
+    rows = flat.tolist()
+    anchor = rows[0]
+    for i in range(1, n):
+        row = rows[i]
+        if jumps[i - 1] or any(abs(a - b) > max_cell_delta for a, b in zip(row, anchor)):
+            keep[i] = True
+            anchor = row
+    hold = np.zeros(n, dtype=bool)
+    hold[:-1] = keep[1:] & ~keep[:-1]
+    return np.flatnonzero(keep | hold)
+
+
+def mat3_to_quat(m):
+    """Quaternions (w, x, y, z) of the normalized rotation matrices m [n,3,3], as blender computes them"""
+    n = len(m)
+    # blender indexes matrices as mat[column][row]
+    c = np.swapaxes(m, 1, 2).astype(np.float64)
+    q = np.empty((n, 4), dtype=np.float64)
+    tr = 0.25 * (1.0 + c[:, 0, 0] + c[:, 1, 1] + c[:, 2, 2])
+
+    a = tr > 1e-4
+    s = np.sqrt(tr[a])
+    q[a, 0] = s
+    s = 1.0 / (4.0 * s)
+    q[a, 1] = (c[a, 1, 2] - c[a, 2, 1]) * s
+    q[a, 2] = (c[a, 2, 0] - c[a, 0, 2]) * s
+    q[a, 3] = (c[a, 0, 1] - c[a, 1, 0]) * s
+
+    b = ~a & (c[:, 0, 0] > c[:, 1, 1]) & (c[:, 0, 0] > c[:, 2, 2])
+    s = 2.0 * np.sqrt(np.maximum(1.0 + c[b, 0, 0] - c[b, 1, 1] - c[b, 2, 2], 0.0))
+    q[b, 1] = 0.25 * s
+    s = 1.0 / s
+    q[b, 0] = (c[b, 1, 2] - c[b, 2, 1]) * s
+    q[b, 2] = (c[b, 1, 0] + c[b, 0, 1]) * s
+    q[b, 3] = (c[b, 2, 0] + c[b, 0, 2]) * s
+
+    d = ~a & ~b & (c[:, 1, 1] > c[:, 2, 2])
+    s = 2.0 * np.sqrt(np.maximum(1.0 + c[d, 1, 1] - c[d, 0, 0] - c[d, 2, 2], 0.0))
+    q[d, 2] = 0.25 * s
+    s = 1.0 / s
+    q[d, 0] = (c[d, 2, 0] - c[d, 0, 2]) * s
+    q[d, 1] = (c[d, 1, 0] + c[d, 0, 1]) * s
+    q[d, 3] = (c[d, 2, 1] + c[d, 1, 2]) * s
+
+    e = ~a & ~b & ~d
+    s = 2.0 * np.sqrt(np.maximum(1.0 + c[e, 2, 2] - c[e, 0, 0] - c[e, 1, 1], 0.0))
+    q[e, 3] = 0.25 * s
+    s = 1.0 / s
+    q[e, 0] = (c[e, 0, 1] - c[e, 1, 0]) * s
+    q[e, 1] = (c[e, 2, 0] + c[e, 0, 2]) * s
+    q[e, 2] = (c[e, 2, 1] + c[e, 1, 2]) * s
+
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+
+def decompose(mats):
+    """Translations [n,3], rotations [n,4] (w, x, y, z) and scales [n,3] of mats [n,4,4]"""
+    mats = np.asarray(mats, dtype=np.float64)
+    loc = mats[:, :3, 3].copy()
+    rot = mats[:, :3, :3]
+    sca = np.linalg.norm(rot, axis=1)
+    rot = rot / np.where(sca > 0.0, sca, 1.0)[:, None, :]
+    # Negative scale: like blender, flip both the scale and the rotation
+    negative = np.linalg.det(mats[:, :3, :3]) < 0.0
+    sca[negative] *= -1.0
+    rot[negative] *= -1.0
+    return loc, mat3_to_quat(rot), sca
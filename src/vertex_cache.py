@@ -0,0 +1,175 @@
+# This file is part of blender_io_f3b.  blender_io_f3b is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Riccardo Balbo
+
+# <pep8 compliant>
+
+"""
+Reordering of the exported meshes for the GPU vertex caches.
+
+The triangles are reordered with Tipsify (Sander, Nehab, Barczak, "Fast
+triangle reordering for vertex locality and reduced overdraw", 2007): it fans
+around a vertex, emitting all its remaining triangles, then moves to the
+neighbour that is still in the cache and has the fewest triangles left, so
+the post-transform cache is reused. Then the vertices are renumbered in the
+order the triangles first use them, for the pre-transform (fetch) cache.
+
+Tipsify is sequential, it runs on python lists: the adjacency is built with
+numpy, the loop only does list lookups.
+"""
+
+import numpy as np
+
+from .Mesh import Mesh
+from .mesh_builder import gather_skin
+
+# Entries of the post-transform cache the triangles are ordered for, and that acmr() simulates
+CACHE_SIZE = 16
+
+
+def acmr(indexes, cache_size=CACHE_SIZE):
+    """Average cache miss ratio of the triangles indexes with a FIFO cache of cache_size vertices: misses per triangle"""
+    if len(indexes) == 0:
+        return 0.0
+    # A vertex is in the cache if fewer than cache_size misses happened since its own miss
+    missed_at = {}
+    misses = 0
+    for v in indexes.tolist():
+        if misses - missed_at.get(v, -cache_size) >= cache_size:
+            missed_at[v] = misses
+            misses += 1
+    return misses / (len(indexes) / 3.0)
+
+
+def tipsify(indexes, n_verts, cache_size=CACHE_SIZE):
+    """New order of the triangles indexes [t*3] for a cache of cache_size vertices, as triangle indexes [t]"""
+    tris = indexes.reshape(-1, 3)
+    n_tris = len(tris)
+    # Triangles around every vertex, compressed rows
+    corners = tris.ravel()
+    order = np.argsort(corners, kind="stable")
+    around = (order // 3).tolist()
+    live = np.bincount(corners, minlength=n_verts)
+    starts = np.concatenate(([0], np.cumsum(live))).tolist()
+    live = live.tolist()
+    tri_verts = tris.tolist()
+
+    stamp = [0] * n_verts  # time each vertex entered the cache
+    emitted = [False] * n_tris
+    dead_ends = []
+    out = []
+    time = cache_size + 1
+    cursor = 0
+    fan = 0 if n_tris > 0 else -1
+    while fan >= 0:
+        candidates = []
+        for t in around[starts[fan]:starts[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            out.append(t)
+            for v in tri_verts[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamp[v] > cache_size:
+                    stamp[v] = time
+                    time += 1
+
+        # The candidate that will still be in the cache after its remaining triangles, the oldest one first
+        fan = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - stamp[v] + 2 * live[v] <= cache_size:
+                    priority = time - stamp[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+        if fan >= 0:
+            continue
+        # Dead end: the last vertices used, then the next ones in index order
+        while dead_ends:
+            v = dead_ends.pop()
+            if live[v] > 0:
+                fan = v
+                break
+        if fan >= 0:
+            continue
+        while cursor < n_verts:
+            if live[cursor] > 0:
+                fan = cursor
+                break
+            cursor += 1
+    return np.array(out, dtype=np.int64)
+
+
+def reorder_vertices(mesh, order, indexes):
+    """Mesh with the vertices of mesh in order and the triangles indexes (of the vertices of mesh)"""
+    remap = np.empty(len(order), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    out = Mesh()
+    out.indexes = remap[indexes]
+    out.positions = mesh.positions[order]
+    out.normals = mesh.normals[order]
+    out.texcoords = [uv[order] for uv in mesh.texcoords]
+    out.tangents = [tg[order] for tg in mesh.tangents]
+    if mesh.colors is not None:
+        out.colors = mesh.colors[order]
+    if mesh.has_skin:
+        counts = mesh.skin.boneCount
+        offsets = np.cumsum(counts) - counts
+        gather_skin((counts, offsets, mesh.skin.boneIndex, mesh.skin.boneWeight), order, out)
+    return out
+
+
+def first_use_order(indexes, n_verts):
+    """The n_verts vertices in the order the indexes first use them, the unused ones last"""
+    first_use = np.full(n_verts, len(indexes), dtype=np.int64)
+    used, first = np.unique(indexes, return_index=True)
+    first_use[used] = first
+    return np.argsort(first_use, kind="stable")
+
+
+def optimize(mesh, cache_size=CACHE_SIZE):
+    """Mesh with the triangles of mesh ordered by tipsify and the vertices in the order they are first used"""
+    n_verts = mesh.vertex_count()
+    indexes = mesh.indexes.reshape(-1, 3)[tipsify(mesh.indexes, n_verts, cache_size)].ravel()
+    return reorder_vertices(mesh, first_use_order(indexes, n_verts), indexes)
+
+
+class Report:
+    """ACMR of the meshes optimized through it, before and after"""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self.triangles = 0
+        self.misses_before = 0.0
+        self.misses_after = 0.0
+
+    def optimize(self, mesh):
+        """optimize(mesh), returns the optimized mesh and its ACMR before and after"""
+        before = acmr(mesh.indexes, self.cache_size)
+        mesh = optimize(mesh, self.cache_size)
+        after = acmr(mesh.indexes, self.cache_size)
+        triangles = len(mesh.indexes) // 3
+        self.triangles += triangles
+        self.misses_before += before * triangles
+        self.misses_after += after * triangles
+        return mesh, before, after
+
+    def summary(self):
+        triangles = max(1, self.triangles)
+        return "%d triangles, ACMR %.3f -> %.3f" % (self.triangles, self.misses_before / triangles, self.misses_after / triangles)